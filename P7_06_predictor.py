@@ -11,12 +11,12 @@ from werkzeug.serving import run_simple
 
 # data handling
 import pandas as pd
+import numpy as np
 import base64
 import io
 
 # modeling
 import lightgbm
-import pickle
 
 external_stylesheets = ['assets//bWLwgP.css']
 
@@ -25,26 +25,23 @@ server = app.server
 
 
 #################### PREDICTOR (new clients from a uploaded file) ####################
-# 1) load modeling utilities (trained model, imputer and scaler made on training base)
+# 1) load modeling utilities (trained model with the imputer and scaler folded in the trees)
 # 2) define predictor function called in parse_content function
 # 3) define parse_content function (with display options)
 # 4) app's layout with uploading data solution and result of parse_content function
 # 5) callback with data retrieving
 
-# Load model, imputer and scaler from file
-loaded_model = pickle.load(open('assets//payback_predictor.pickle.dat', 'rb'))
-loaded_imputer = pickle.load(open('assets//imputer.pickle.dat', 'rb'))
-loaded_scaler = pickle.load(open('assets//scaler.pickle.dat', 'rb'))
-
-def predictor(model, imputer, scaler, row):
-    # Drop unwanted columns
-    row_reduce = row.drop(columns=['SK_ID_CURR','TARGET'])
-    # Impute missing value and normalize
-    row_reduce = imputer.transform(row_reduce)
-    row_reduce = scaler.transform(row_reduce)
+# Load the fused artifact (model, imputer and scaler) from file
+with np.load('assets//payback_predictor.npz', allow_pickle=False) as artifact:
+    feature_names = [str(name) for name in artifact['feature_names']]
+    loaded_model = lightgbm.Booster(model_str=str(artifact['model_string']))
+
+def predictor(model, rows):
+    # Select the model's features (raw values, imputation and scaling are folded in the model)
+    rows_reduce = np.ascontiguousarray(rows[feature_names].to_numpy(dtype=np.float32))
     # Perform prediction
-    pred_value = model.predict_proba(row_reduce)[0,1]
-    return pred_value
+    pred_values = model.predict(rows_reduce)
+    return pred_values
 
 def parse_contents(contents, filename):
     content_type, content_string = contents.split(',')
@@ -65,9 +62,7 @@ def parse_contents(contents, filename):
         ])
 
     # Perform predictions on uploaded database
-    pred=list()
-    for i in df.index:
-        pred.append(predictor(loaded_model, loaded_imputer, loaded_scaler, df.iloc[[i]]))
+    pred = predictor(loaded_model, df)
 
     # Selection of main features for final display
     df_extract = df[['SK_ID_CURR','EXT_SOURCE_3','EXT_SOURCE_2',
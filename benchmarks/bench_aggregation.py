@@ -0,0 +1,168 @@
+# data retreiving
+import sys
+import pathlib
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the repository folder: python benchmarks/bench_aggregation.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from pipeline import build
+
+#################### CHILD TABLE AGGREGATION BENCHMARK ####################
+# 1) write synthetic child tables of growing size (loans of clients, numeric, flag and categorical columns)
+# 2) aggregate them by client with the functions of notebook 2 (whole table in memory)
+#    and with the chunked pipeline
+# 3) check that both give the same features, compare the time and the peak memory
+
+SIZES = [10000, 100000, 1000000]
+SPEC = {'name': 'child_balance', 'key': 'SK_ID_PREV', 'df_names': ['cash', 'client'], 'XNA': ['NAME_CONTRACT_STATUS']}
+
+
+def synthetic_child(n, seed=0):
+    # About 10 rows per loan and 4 loans per client
+    rng = np.random.default_rng(seed)
+    loans = rng.integers(0, max(n // 10, 1), n)
+    df = pd.DataFrame({'SK_ID_PREV': 1000000 + loans, 'SK_ID_CURR': 100000 + loans // 4,
+                       'MONTHS_BALANCE': -rng.integers(1, 96, n),
+                       'AMT_BALANCE': rng.lognormal(10, 1.5, n),
+                       'AMT_PAYMENT': rng.normal(5000, 2000, n),
+                       'CNT_INSTALMENT': rng.integers(0, 60, n).astype(float),
+                       'FLAG_ACTIVE': rng.integers(0, 2, n),
+                       'NAME_CONTRACT_STATUS': rng.choice(['Active', 'Completed', 'Signed', 'XNA'], n,
+                                                          p=[0.6, 0.3, 0.08, 0.02])})
+    df.loc[rng.random(n) < 0.1, 'AMT_PAYMENT'] = np.nan
+    df.loc[rng.random(n) < 0.3, 'CNT_INSTALMENT'] = np.nan
+    return df
+
+
+#################### FUNCTIONS OF NOTEBOOK 2 (reference) ####################
+
+def convert_types(df):
+    for col in df:
+        if ('SK_ID' in col):
+            df[col] = df[col].fillna(0).astype(np.int32)
+        elif (df[col].dtype == 'object') and (df[col].nunique() < df.shape[0]):
+            df[col] = df[col].astype('category')
+        elif set(df[col].unique()) == {1, 0}:
+            df[col] = df[col].astype(bool)
+        elif df[col].dtype == float:
+            df[col] = df[col].astype(np.float32)
+        elif df[col].dtype == int:
+            df[col] = df[col].astype(np.int32)
+    return df
+
+
+def remove_XNA(df, features_list):
+    for col in features_list:
+        # the 'XNA' category is dropped, as with the replace of pandas 1.2
+        df[col] = df[col].astype(object).replace({'XNA': np.nan})
+        df[col] = df[col].astype('category')
+    return df
+
+
+def remove_outliers(df, quant_low=0.2, quant_up=0.8, whisker=2):
+    for col in df:
+        if 'SK_ID' in col:
+            # ids left out, as in the pipeline
+            continue
+        if (df[col].dtypes != 'bool') and (str(df[col].dtypes) != 'category') and (df[col].nunique(dropna=True) > 2):
+            Q1 = df[col].quantile(quant_low)
+            Q3 = df[col].quantile(quant_up)
+            interquart = Q3 - Q1
+            low_lim = Q1 - whisker * interquart
+            up_lim = Q3 + whisker * interquart
+            df[col] = df[col].mask(cond=((df[col] < low_lim) | (df[col] > up_lim)), other=np.nan)
+    return df
+
+
+def agg_categorical(df, parent_var, df_name):
+    categorical = pd.get_dummies(df.select_dtypes('category')).astype(np.int64)
+    categorical[parent_var] = df[parent_var]
+    categorical = categorical.groupby(parent_var).agg(['sum', 'count', 'mean'])
+    categorical.columns = ['%s_%s_%s' % (df_name, var, stat) for var, stat in categorical.columns]
+    _, idx = np.unique(categorical, axis=1, return_index=True)
+    return categorical.iloc[:, idx]
+
+
+def agg_numeric(df, parent_var, df_name):
+    for col in df:
+        if col != parent_var and 'SK_ID' in col:
+            df = df.drop(columns=col)
+    parent_ids = df[parent_var].copy()
+    numeric_df = df.select_dtypes('number').copy()
+    numeric_df[parent_var] = parent_ids
+    agg = numeric_df.groupby(parent_var).agg(['count', 'mean', 'max', 'min', 'sum'])
+    agg.columns = ['%s_%s_%s' % (df_name, var, stat) for var, stat in agg.columns]
+    _, idx = np.unique(agg, axis=1, return_index=True)
+    return agg.iloc[:, idx]
+
+
+def aggregate_client(df, group_vars, df_names):
+    df_agg = agg_numeric(df, parent_var=group_vars[0], df_name=df_names[0])
+    df_counts = agg_categorical(df, parent_var=group_vars[0], df_name=df_names[0])
+    df_by_loan = df_counts.merge(df_agg, on=group_vars[0], how='outer')
+    df_by_loan = df_by_loan.merge(df[[group_vars[0], group_vars[1]]], on=group_vars[0], how='left')
+    df_by_loan = df_by_loan.drop(columns=[group_vars[0]])
+    return agg_numeric(df_by_loan, parent_var=group_vars[1], df_name=df_names[1])
+
+
+def notebook_features(path):
+    df = convert_types(pd.read_csv(path))
+    df = remove_outliers(remove_XNA(df, SPEC['XNA']))
+    return aggregate_client(df, group_vars=[SPEC['key'], 'SK_ID_CURR'], df_names=SPEC['df_names'])
+
+
+def pipeline_features(data_path, work_dir, chunk_size, n_partitions):
+    build.build_table(SPEC, data_path, work_dir.joinpath('work'), work_dir.joinpath('features'),
+                      n_partitions=n_partitions, chunk_size=chunk_size)
+    features = build.load_features(work_dir.joinpath('features', SPEC['name']))
+    return pd.DataFrame(np.asarray(features['values']), index=pd.Index(features['ids'], name='SK_ID_CURR'),
+                        columns=features['columns'])
+
+
+def measure(func):
+    # Time and peak traced memory of a call
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the notebook and chunked aggregations of a child table.')
+    parser.add_argument('--sizes', type=int, nargs='*', default=SIZES, help='rows of the synthetic tables')
+    parser.add_argument('--chunk-size', type=int, default=build.CHUNK_SIZE, help='rows parsed at once')
+    parser.add_argument('--partitions', type=int, default=build.N_PARTITIONS, help='partitions of the table')
+    args = parser.parse_args()
+
+    print('%10s %-10s %10s %12s %10s' % ('rows', 'method', 'time (s)', 'peak (MB)', 'columns'))
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as data_path:
+            data_path = pathlib.Path(data_path)
+            synthetic_child(n).to_csv(data_path.joinpath(SPEC['name'] + '.csv'), index=False)
+
+            expected, elapsed, peak = measure(lambda: notebook_features(data_path.joinpath(SPEC['name'] + '.csv')))
+            print('%10i %-10s %10.2f %12.1f %10i' % (n, 'notebook', elapsed, peak / 2**20, expected.shape[1]))
+
+            result, elapsed, peak = measure(lambda: pipeline_features(data_path, data_path, args.chunk_size,
+                                                                      args.partitions))
+            print('%10i %-10s %10.2f %12.1f %10i' % (n, 'pipeline', elapsed, peak / 2**20, result.shape[1]))
+
+            # same features, in the same order (float64 sums against the float32 groupby of the notebook)
+            assert list(result.columns) == list(expected.columns)
+            if n <= build.SAMPLE_SIZE:
+                pd.testing.assert_frame_equal(result, expected.astype(np.float64), check_names=False,
+                                              check_index_type=False, rtol=1e-5)
+            else:
+                # outlier limits from a sample of the rows: a few values near the limits differ
+                close = np.isclose(result.to_numpy(), expected.to_numpy(dtype=np.float64), rtol=1e-5, equal_nan=True)
+                print('%10s %-10s %.3f %% of the values differ (sampled outlier limits)' % ('', '', 100 * (1 - close.mean())))
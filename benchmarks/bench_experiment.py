@@ -0,0 +1,112 @@
+# data retreiving
+import sys
+import pathlib
+import argparse
+import time
+import warnings
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# modeling
+from lightgbm import LGBMClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.model_selection import KFold
+from sklearn.metrics import roc_auc_score
+
+# run from the repository folder: python benchmarks/bench_experiment.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from pipeline import experiment, tuning
+from bench_tuning import synthetic_training
+
+warnings.filterwarnings('ignore')
+
+#################### EXPERIMENT HARNESS BENCHMARK ####################
+# 1) evaluate several parameter sets (the chosen goss / 5 leaves model of notebook 4, then random sets
+#    of notebook 3) with the run_experiment of the notebooks and with pipeline.experiment
+# 2) run the feature_reduction of notebook 4 with both
+# 3) compare the times and the scores (identical with float64 matrices, close with float32 ones)
+
+TRIALS = 10
+ROWS = 50000
+
+# final model of notebook 4
+CHOSEN = dict(boosting_type='goss', objective='binary', num_leaves=5, n_estimators=82, learning_rate=0.092,
+              reg_alpha=0.82, reg_lambda=0.4, subsample=1.0, colsample_bytree=0.55, is_unbalance=False,
+              random_state=0)
+
+
+#################### FUNCTIONS OF NOTEBOOK 4 (reference) ####################
+
+def run_experiment(model_input, data, feat_imp=False, n_folds=5):
+    labels = data['TARGET']
+    data = data.drop(columns=['SK_ID_CURR', 'TARGET'])
+    feature_names = list(data.columns)
+    data = SimpleImputer(missing_values=np.nan, strategy='median').fit_transform(data)
+    data = MinMaxScaler(feature_range=(0, 1)).fit_transform(data)
+    k_fold = KFold(n_splits=n_folds, random_state=0, shuffle=True)
+    feature_importance_values = np.zeros(len(feature_names))
+    train_scores, valid_scores = list(), list()
+    for train_indices, valid_indices in k_fold.split(data):
+        train_features, train_labels = data[train_indices], labels[train_indices]
+        valid_features, valid_labels = data[valid_indices], labels[valid_indices]
+        model = model_input
+        model.fit(train_features, train_labels)
+        feature_importance_values += model.feature_importances_ / k_fold.n_splits
+        train_scores.append(roc_auc_score(train_labels, model.predict_proba(train_features)[:, 1]))
+        valid_scores.append(roc_auc_score(valid_labels, model.predict_proba(valid_features)[:, 1]))
+    valid_scores.append(np.mean(valid_scores))
+    train_scores.append(np.mean(train_scores))
+    metrics = pd.DataFrame({'fold': list(range(n_folds)) + ['overall'], 'train': train_scores, 'valid': valid_scores})
+    if feat_imp:
+        return pd.DataFrame({'feature': feature_names, 'importance': feature_importance_values}), metrics
+    return metrics
+
+
+def feature_reduction(model, data, n_folds=5):
+    zero_features = [0]
+    while len(zero_features) != 0:
+        feature_importances, metrics = run_experiment(model, data, feat_imp=True, n_folds=n_folds)
+        zero_features = list(feature_importances[feature_importances['importance'] == 0.0]['feature'])
+        data = data.drop(columns=zero_features)
+    return feature_importances, data
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the run_experiment of the notebooks with pipeline.experiment.')
+    parser.add_argument('--trials', type=int, default=TRIALS, help='parameter sets evaluated')
+    parser.add_argument('--rows', type=int, default=ROWS, help='rows of the synthetic training table')
+    args = parser.parse_args()
+
+    data = synthetic_training(args.rows, n_features=200)
+    trials = [CHOSEN] + tuning.sample_parameters(tuning.PARAM_GRID, args.trials - 1)
+
+    # 1st step: the parameter sets, one run_experiment each
+    expected, notebook_time = timed(lambda: [run_experiment(LGBMClassifier(**p, verbose=-1), data)['valid'].iloc[-1]
+                                             for p in trials])
+    print('%-22s %10s %10s %16s' % ('', 'notebook', 'harness', 'max valid diff'))
+    for dtype in [np.float64, np.float32]:
+        def harness():
+            prepared = experiment.prepare_experiment(data, dtype=dtype)
+            return [experiment.run_experiment(p, prepared)['valid'].iloc[-1] for p in trials]
+        result, harness_time = timed(harness)
+        print('%-22s %10.2f %10.2f %16.6f' % ('%i trials (%s)' % (len(trials), np.dtype(dtype).name), notebook_time,
+                                              harness_time, np.abs(np.array(result) - expected).max()))
+        if dtype == np.float64:
+            assert result == expected
+
+    # 2nd step: feature reduction of the chosen model
+    (importances, reduced), notebook_time = timed(lambda: feature_reduction(LGBMClassifier(**CHOSEN, verbose=-1), data))
+    (result_importances, kept), harness_time = timed(
+        lambda: experiment.feature_reduction(CHOSEN, experiment.prepare_experiment(data, dtype=np.float64)))
+    print('%-22s %10.2f %10.2f %16s' % ('feature_reduction', notebook_time, harness_time,
+                                        '%i of %i features' % (len(kept), data.shape[1] - 2)))
+    assert kept == list(reduced.columns.drop(['SK_ID_CURR', 'TARGET']))
@@ -0,0 +1,93 @@
+# data retreiving
+import os
+import sys
+import pathlib
+import argparse
+import tempfile
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the repository folder: python benchmarks/bench_parallel.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from pipeline import build
+from bench_aggregation import synthetic_child
+
+#################### PARALLEL BUILD BENCHMARK ####################
+# 1) write synthetic Home Credit tables (applications and the 6 child tables)
+# 2) build the global bases with 1 job, then with more jobs
+# 3) check that the bases are identical, compare the wall-clock times
+
+CLIENTS = 20000
+JOBS = sorted({1, 2, os.cpu_count() or 1})
+
+
+def synthetic_tables(folder, n_clients, rows, seed=0):
+    # Tables with the columns used by the build (a few of each kind), clients of ids 100000 and next
+    rng = np.random.default_rng(seed)
+    ids = 100000 + np.arange(n_clients)
+    n_train = n_clients * 4 // 5
+    for name, part in [('application_train', ids[:n_train]), ('application_test', ids[n_train:])]:
+        n = len(part)
+        df = pd.DataFrame({'SK_ID_CURR': part, 'CODE_GENDER': rng.choice(['M', 'F', 'XNA'], n, p=[0.45, 0.549, 0.001]),
+                           'AMT_INCOME_TOTAL': rng.lognormal(11, 0.5, n),
+                           'DAYS_EMPLOYED': np.where(rng.random(n) < 0.15, 365243, -rng.integers(0, 15000, n)),
+                           'ORGANIZATION_TYPE': rng.choice(['XNA', 'Business', 'School'], n),
+                           'FLAG_DOC_3': rng.integers(0, 2, n)})
+        if name == 'application_train':
+            df.insert(1, 'TARGET', (rng.random(n) < 0.08).astype(int))
+        df.to_csv(folder.joinpath(name + '.csv'), index=False)
+
+    # bureau loans and their monthly balances
+    n_bureau = rows // 4
+    pd.DataFrame({'SK_ID_CURR': rng.choice(ids, n_bureau), 'SK_ID_BUREAU': 5000000 + np.arange(n_bureau),
+                  'CREDIT_ACTIVE': rng.choice(['Active', 'Closed', 'Sold'], n_bureau),
+                  'DAYS_CREDIT': -rng.integers(0, 3000, n_bureau),
+                  'AMT_CREDIT_SUM': rng.lognormal(12, 1, n_bureau)}).to_csv(folder.joinpath('bureau.csv'), index=False)
+    pd.DataFrame({'SK_ID_BUREAU': 5000000 + rng.integers(0, n_bureau, rows),
+                  'MONTHS_BALANCE': -rng.integers(0, 90, rows),
+                  'STATUS': rng.choice(['C', 'X', '0', '1'], rows)}).to_csv(folder.joinpath('bureau_balance.csv'),
+                                                                           index=False)
+
+    # previous loans and their balances (clients of the synthetic child tables mapped on the ids)
+    for i, name in enumerate(['credit_card_balance', 'installments_payments', 'POS_CASH_balance',
+                              'previous_application']):
+        df = synthetic_child(rows, seed=seed + i)
+        df['SK_ID_CURR'] = ids[(df['SK_ID_CURR'] - 100000) % n_clients]
+        spec = [table for table in build.TABLES if table['name'] == name][0]
+        for col in spec.get('365243', []):
+            df[col] = np.where(rng.random(rows) < 0.3, 365243.0, -rng.integers(0, 3000, rows).astype(float))
+        for col in spec.get('XNA', []):
+            df[col] = rng.choice(['XNA', 'a', 'b'], rows, p=[0.3, 0.5, 0.2])
+        df.to_csv(folder.joinpath(name + '.csv'), index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the sequential and parallel builds of the global bases.')
+    parser.add_argument('--clients', type=int, default=CLIENTS, help='clients of the synthetic applications')
+    parser.add_argument('--rows', type=int, default=200000, help='rows of each child table')
+    parser.add_argument('--jobs', type=int, nargs='*', default=JOBS, help='numbers of worker processes')
+    parser.add_argument('--partitions', type=int, default=build.N_PARTITIONS, help='partitions of each child table')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder = pathlib.Path(folder)
+        data_path = folder.joinpath('data')
+        data_path.mkdir()
+        synthetic_tables(data_path, args.clients, args.rows)
+
+        print('%6s %10s %10s' % ('jobs', 'time (s)', 'speed-up'))
+        reference, reference_time = None, None
+        for n_jobs in args.jobs:
+            output_path = folder.joinpath('jobs_%i' % n_jobs)
+            start = time.perf_counter()
+            paths = build.build(data_path, output_path, folder, args.partitions, n_jobs=n_jobs)
+            elapsed = time.perf_counter() - start
+            bases = [path.read_bytes() for path in paths]
+            if reference is None:
+                reference, reference_time = bases, elapsed
+            # same bases, byte for byte, whatever the number of jobs
+            assert bases == reference
+            print('%6i %10.2f %10.2f' % (n_jobs, elapsed, reference_time / elapsed))
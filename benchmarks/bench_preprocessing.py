@@ -0,0 +1,135 @@
+# data retreiving
+import sys
+import pathlib
+import argparse
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the repository folder: python benchmarks/bench_preprocessing.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from pipeline import preprocessing
+
+# text columns as object columns, as with the pandas version of the notebooks
+if hasattr(pd.options, 'future') and hasattr(pd.options.future, 'infer_string'):
+    pd.options.future.infer_string = False
+
+#################### PREPROCESSING BENCHMARK ####################
+# 1) build a synthetic table shaped like application_train (ids, floats, integers, flags,
+#    DAYS columns with 365243 values, text columns with 'XNA' entries)
+# 2) clean it with the functions of notebook 2 and with pipeline.preprocessing, step by step
+# 3) check that both give the same table and the same spotted features, compare the times
+
+SIZES = [30000, 300000]
+STEPS = ['convert_types', 'spot_365243', 'remove_365243', 'spot_XNA', 'remove_XNA', 'remove_outliers']
+
+
+def synthetic_application(n, seed=0):
+    # About the columns of application_train: 65 floats, 40 integers and flags, 16 text columns
+    rng = np.random.default_rng(seed)
+    columns = {'SK_ID_CURR': 100000 + np.arange(n)}
+    for j in range(60):
+        values = rng.lognormal(10, 1 + j % 3, n)
+        values[rng.random(n) < 0.02 * (j % 20)] = np.nan
+        columns['AMT_%i' % j] = values
+    for j in range(5):
+        columns['DAYS_%i' % j] = np.where(rng.random(n) < 0.15, 365243, -rng.integers(0, 15000, n))
+    for j in range(15):
+        columns['CNT_%i' % j] = rng.poisson(1 + j, n)
+    for j in range(20):
+        columns['FLAG_%i' % j] = rng.integers(0, 2, n)
+    columns['FLAG_NAN'] = np.where(rng.random(n) < 0.1, np.nan, rng.integers(0, 2, n))
+    for j in range(15):
+        columns['NAME_%i' % j] = rng.choice(['XNA', 'a', 'b', 'c', 'd'][j % 2:], n)
+    return pd.DataFrame(columns)
+
+
+#################### FUNCTIONS OF NOTEBOOK 2 (reference) ####################
+
+def convert_types(df):
+    for col in df:
+        if ('SK_ID' in col):
+            df[col] = df[col].fillna(0).astype(np.int32)
+        elif (df[col].dtype == 'object') and (df[col].nunique() < df.shape[0]):
+            df[col] = df[col].astype('category')
+        elif set(df[col].unique()) == {1, 0}:
+            df[col] = df[col].astype(bool)
+        elif df[col].dtype == float:
+            df[col] = df[col].astype(np.float32)
+        elif df[col].dtype == int:
+            df[col] = df[col].astype(np.int32)
+    return df
+
+
+def spot_365243(df):
+    return [col for col in df if 365243 in df[col].drop_duplicates().to_numpy() and 'SK_ID' not in col]
+
+
+def remove_365243(df, features_list):
+    for col in features_list:
+        df[col] = df[col].replace({365243.0: np.nan})
+    return df
+
+
+def spot_XNA(df):
+    return [col for col in df if str(df[col].dtypes) == 'category' and 'XNA' in df[col].drop_duplicates().to_numpy()]
+
+
+def remove_XNA(df, features_list):
+    for col in features_list:
+        # the 'XNA' category is dropped, as with the replace of pandas 1.2
+        df[col] = df[col].astype(object).replace({'XNA': np.nan})
+        df[col] = df[col].astype('category')
+    return df
+
+
+def remove_outliers(df, quant_low=0.2, quant_up=0.8, whisker=2):
+    for col in df:
+        if (df[col].dtypes != 'bool') and (str(df[col].dtypes) != 'category') and (df[col].nunique(dropna=True) > 2):
+            Q1 = df[col].quantile(quant_low)
+            Q3 = df[col].quantile(quant_up)
+            interquart = Q3 - Q1
+            low_lim = Q1 - whisker * interquart
+            up_lim = Q3 + whisker * interquart
+            df[col] = df[col].mask(cond=((df[col] < low_lim) | (df[col] > up_lim)), other=np.nan)
+    return df
+
+
+def clean(module, df):
+    # Steps of notebook 2 with the functions of a module, time of each step
+    times, spotted = dict(), dict()
+    for step in STEPS:
+        start = time.perf_counter()
+        if step in ['spot_365243', 'spot_XNA']:
+            spotted[step] = getattr(module, step)(df) or []
+        elif step == 'remove_365243':
+            df = module.remove_365243(df, spotted['spot_365243'])
+        elif step == 'remove_XNA':
+            df = module.remove_XNA(df, spotted['spot_XNA'])
+        else:
+            df = getattr(module, step)(df)
+        times[step] = time.perf_counter() - start
+    return df, spotted, times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the cleaning functions of notebook 2 and pipeline.preprocessing.')
+    parser.add_argument('--sizes', type=int, nargs='*', default=SIZES, help='rows of the synthetic tables')
+    args = parser.parse_args()
+
+    print('%10s %-16s %12s %12s %10s' % ('rows', 'step', 'notebook (s)', 'library (s)', 'speed-up'))
+    for n in args.sizes:
+        raw = synthetic_application(n)
+        expected, expected_spotted, notebook_times = clean(sys.modules[__name__], raw.copy())
+        result, spotted, library_times = clean(preprocessing, raw.copy())
+
+        for step in STEPS + ['total']:
+            old = sum(notebook_times.values()) if step == 'total' else notebook_times[step]
+            new = sum(library_times.values()) if step == 'total' else library_times[step]
+            print('%10i %-16s %12.3f %12.3f %10.1f' % (n, step, old, new, old / new))
+
+        # same spotted features, same table (values, dtypes and categories)
+        assert spotted == expected_spotted
+        pd.testing.assert_frame_equal(result, expected)
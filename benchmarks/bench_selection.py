@@ -0,0 +1,58 @@
+# data retreiving
+import sys
+import pathlib
+import argparse
+import time
+import warnings
+
+# data handling
+import numpy as np
+
+# modeling
+from lightgbm import LGBMClassifier
+
+# run from the repository folder: python benchmarks/bench_selection.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from pipeline import experiment, selection
+from bench_tuning import synthetic_training
+from bench_experiment import feature_reduction, timed
+
+warnings.filterwarnings('ignore')
+
+#################### FEATURE SELECTION BENCHMARK ####################
+# 1) build a wide synthetic training table (TARGET depending on a few features)
+# 2) reduce the features of the model of notebook 4 with the feature_reduction of the notebook,
+#    with pipeline.experiment (datasets built again at each round) and with pipeline.selection
+# 3) compare the times and the kept features (identical with float64 matrices)
+
+ROWS = 50000
+FEATURES = 300
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the feature_reduction of notebook 4 with pipeline.selection.')
+    parser.add_argument('--rows', type=int, default=ROWS, help='rows of the synthetic training table')
+    parser.add_argument('--features', type=int, default=FEATURES, help='features of the synthetic training table')
+    parser.add_argument('--skip-notebook', action='store_true', help='do not run the (slow) function of the notebook')
+    args = parser.parse_args()
+
+    data = synthetic_training(args.rows, n_features=args.features)
+    times, kept = dict(), dict()
+
+    if not args.skip_notebook:
+        (_, reduced), times['notebook'] = timed(
+            lambda: feature_reduction(LGBMClassifier(**selection.MODEL, verbose=-1), data))
+        kept['notebook'] = list(reduced.columns.drop(['SK_ID_CURR', 'TARGET']))
+    (_, kept['experiment']), times['experiment'] = timed(
+        lambda: experiment.feature_reduction(selection.MODEL, experiment.prepare_experiment(data, dtype=np.float64)))
+    print()
+    (_, kept['selection'], report), times['selection'] = timed(
+        lambda: selection.select_features(selection.MODEL, experiment.prepare_experiment(data, dtype=np.float64)))
+
+    print('%-12s %10s %10s' % ('', 'time (s)', 'features'))
+    for name in times:
+        print('%-12s %10.2f %10i' % (name, times[name], len(kept[name])))
+    print(report.to_string(index=False))
+
+    # the same features are kept
+    assert all(features == kept['selection'] for features in kept.values())
@@ -0,0 +1,62 @@
+# data retreiving
+import os
+import sys
+import pathlib
+import argparse
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the repository folder: python benchmarks/bench_tuning.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from pipeline import tuning
+
+#################### HYPERPARAMETERS SEARCH BENCHMARK ####################
+# 1) build a synthetic training table (TARGET depending on a few features, missing values)
+# 2) run the random search of notebook 3 sequentially on all the folds (eta = 1, 1 job),
+#    then with successive halving on the pool
+# 3) compare the times, the numbers of trained models and the best parameter sets found
+
+EVALS = 60
+ROWS = 20000
+
+
+def synthetic_training(n, n_features=50, seed=0):
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(n, n_features))
+    features[rng.random(features.shape) < 0.1] = np.nan
+    score = np.nan_to_num(features[:, :5]) @ rng.normal(size=5) + rng.normal(size=n)
+    data = pd.DataFrame(features, columns=['FEATURE_%i' % j for j in range(n_features)])
+    data.insert(0, 'TARGET', (score > np.quantile(score, 0.92)).astype(int))
+    data.insert(0, 'SK_ID_CURR', 100000 + np.arange(n))
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the sequential random search with the halving search.')
+    parser.add_argument('--evals', type=int, default=EVALS, help='number of parameter sets')
+    parser.add_argument('--rows', type=int, default=ROWS, help='rows of the synthetic training table')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='worker processes of the halving search')
+    parser.add_argument('--top', type=int, default=5, help='best sets compared')
+    args = parser.parse_args()
+
+    data = synthetic_training(args.rows)
+    runs = {'sequential': dict(eta=1, n_jobs=1), 'halving': dict(eta=tuning.ETA, n_jobs=args.jobs)}
+
+    print('%-12s %10s %8s %12s' % ('search', 'time (s)', 'models', 'best valid'))
+    results = dict()
+    for name, kwargs in runs.items():
+        start = time.perf_counter()
+        results[name] = tuning.random_search(tuning.PARAM_GRID, data, args.evals, **kwargs)
+        elapsed = time.perf_counter() - start
+        print('%-12s %10.2f %8i %12.4f' % (name, elapsed, results[name]['folds'].sum(),
+                                           results[name]['valid'][results[name]['folds'] == 5].max()))
+
+    # the scores of the sets evaluated on all the folds are the same, the best sets are mostly kept
+    complete = results['halving'][results['halving']['folds'] == 5]
+    assert np.allclose(complete['valid'].astype(float), results['sequential'].loc[complete.index, 'valid'].astype(float))
+    best = results['sequential'].sort_values(by='valid', ascending=False).index[:args.top]
+    print('%i of the %i best sets of the sequential search evaluated on all the folds by the halving search'
+          % (complete.index.isin(best).sum(), args.top))
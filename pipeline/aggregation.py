@@ -0,0 +1,251 @@
+# data handling
+import hashlib
+import numpy as np
+import pandas as pd
+
+#################### MERGEABLE AGGREGATES (groupby statistics of notebook 2 computed chunk by chunk) ####################
+# 1) aggregate a chunk of a child table into partial statistics by key (count, sum, min, max, rows, dummies)
+# 2) merge the partial statistics of several chunks (sums of the counts and sums, min of the mins, max of the maxs)
+# 3) turn the merged statistics into the columns of agg_numeric and agg_categorical (means = sums / counts)
+# 4) aggregate a loan-level table at the client level, each loan weighted by its number of rows
+# 5) find the duplicated columns from digests of their values, computed partition by partition
+#
+# The means are only computed at the end, so the results do not depend on how the rows
+# of a table were split into chunks.
+
+NUMERIC_STATS = ['count', 'mean', 'max', 'min', 'sum']
+CATEGORICAL_STATS = ['sum', 'count', 'mean']
+
+# how each partial statistic is merged
+MERGE_RULES = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max', 'rows': 'sum', 'dummies': 'sum'}
+
+
+def dummies(df, categories):
+    # One-hot encoding of the categorical columns with the categories of the whole table
+    # (same columns whatever the chunk, named like pd.get_dummies: column_category)
+    encoded = pd.DataFrame({col: pd.Categorical(df[col], categories=cats) for col, cats in categories.items()},
+                           index=df.index)
+    return pd.get_dummies(encoded).astype(np.int64)
+
+
+def partial_aggregates(df, key, numeric, categories):
+    """
+    Partial statistics of a chunk of a child table, by key.
+
+    Parameters
+    ----------
+    df : dataframe
+        The chunk (cleaned, outliers already replaced by nan values).
+
+    key : string
+        The variable by which to group the chunk (e.g. 'SK_ID_PREV').
+
+    numeric : list of strings
+        The numeric columns to aggregate (count, sum, min, max).
+
+    categories : dictionary
+        The categorical columns to count, with the categories of the whole table.
+
+    Return
+    ------
+    partial : dictionary of dataframes indexed by key
+        'count', 'sum', 'min', 'max' of the numeric columns, number of 'rows'
+        and counts of the 'dummies'.
+
+    """
+
+    keys = df[key].to_numpy()
+    values = df[numeric].astype(np.float64).groupby(keys)
+    partial = {'count': values.count(), 'sum': values.sum(), 'min': values.min(), 'max': values.max(),
+               'rows': pd.Series(1, index=df.index).groupby(keys).sum().to_frame('rows')}
+    if categories:
+        partial['dummies'] = dummies(df, categories).groupby(keys).sum()
+    return partial
+
+
+def merge_partials(partials):
+    # Partial statistics of the union of several chunks
+    return {stat: pd.concat([partial[stat] for partial in partials]).groupby(level=0).agg(MERGE_RULES[stat])
+            for stat in partials[0]}
+
+
+def numeric_columns(partial, numeric, df_name):
+    """
+    Final numeric statistics of merged partial statistics, as returned by agg_numeric
+    (before the removal of the duplicated columns).
+
+    Parameters
+    ----------
+    partial : dictionary of dataframes
+        Merged partial statistics (see partial_aggregates).
+
+    numeric : list of strings
+        The aggregated numeric columns (order of the result).
+
+    df_name : string
+        Prefix of the column names.
+
+    Return
+    ------
+    agg : dataframe
+        Columns '<df_name>_<variable>_<stat>' for the stats count, mean, max, min and sum.
+
+    """
+
+    count = partial['count'][numeric].to_numpy(dtype=np.float64)
+    total = partial['sum'][numeric].to_numpy(dtype=np.float64)
+    # the mean of a group without values is nan, as with groupby (0 / 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    stats = {'count': count, 'mean': mean, 'max': partial['max'][numeric].to_numpy(dtype=np.float64),
+             'min': partial['min'][numeric].to_numpy(dtype=np.float64), 'sum': total}
+
+    # one block of columns per variable, one column per stat
+    values = np.stack([stats[stat] for stat in NUMERIC_STATS], axis=2).reshape(len(count), -1)
+    columns = ['%s_%s_%s' % (df_name, var, stat) for var in numeric for stat in NUMERIC_STATS]
+    return pd.DataFrame(values, index=partial['count'].index, columns=columns)
+
+
+def categorical_columns(partial, df_name):
+    # Final counts of merged partial statistics, as returned by agg_categorical
+    # (before the removal of the duplicated columns): sum, count and mean of each dummy
+    counts = partial['dummies'].to_numpy(dtype=np.float64)
+    rows = np.repeat(partial['rows'].to_numpy(dtype=np.float64), counts.shape[1], axis=1)
+    stats = {'sum': counts, 'count': rows, 'mean': counts / rows}
+    values = np.stack([stats[stat] for stat in CATEGORICAL_STATS], axis=2).reshape(len(counts), -1)
+    columns = ['%s_%s_%s' % (df_name, var, stat) for var in partial['dummies'].columns for stat in CATEGORICAL_STATS]
+    return pd.DataFrame(values, index=partial['dummies'].index, columns=columns)
+
+
+def client_aggregates(loans, links, loan_key, df_name, client_key='SK_ID_CURR'):
+    """
+    Numeric statistics by client of a loan-level table (agg_numeric of aggregate_client).
+
+    In notebook 2 the loan-level table is merged with the (loan, client) pairs of the rows
+    of the child table before the aggregation: a loan counts as many times as it has rows.
+    The same weights are applied here, without building the repeated rows.
+
+    Parameters
+    ----------
+    loans : dataframe
+        The loan-level statistics (indexed by loan).
+
+    links : dataframe
+        The columns loan_key, client_key and 'weight' (number of rows of each pair).
+        The loans of the links without statistics count as missing values.
+
+    loan_key, df_name, client_key : strings
+        The loan variable, the prefix of the columns and the client variable.
+
+    Return
+    ------
+    agg : dataframe
+        See numeric_columns (indexed by client).
+
+    """
+
+    values = loans.reindex(links[loan_key].to_numpy())
+    weights = links['weight'].to_numpy()
+    clients = links[client_key].to_numpy()
+    partial = {'count': values.notna().mul(weights, axis=0).groupby(clients).sum(),
+               'sum': values.mul(weights, axis=0).groupby(clients).sum(),
+               'min': values.groupby(clients).min(),
+               'max': values.groupby(clients).max()}
+    agg = numeric_columns(partial, list(loans.columns), df_name)
+    agg.index.name = client_key
+    return agg
+
+
+def column_digests(df):
+    # Digest of the values of each column of a partition, and whether it has nan values
+    digests = dict()
+    for col in df.columns:
+        # compared as float64 values (0.0 and -0.0 are equal values, all the nan values too)
+        values = df[col].to_numpy(dtype=np.float64) + 0.0
+        nan = np.isnan(values)
+        values[nan] = np.nan
+        digests[col] = (hashlib.sha1(values.tobytes()).hexdigest(), bool(nan.any()))
+    return digests
+
+
+def tied_sets(block):
+    # Sets of equal columns (nan values equal) of a block with one row per column, already sorted
+    sets, current = list(), [0]
+    for i in range(1, len(block)):
+        if np.array_equal(block[i], block[i - 1], equal_nan=True):
+            current.append(i)
+        else:
+            sets.append(current)
+            current = [i]
+    sets.append(current)
+    return sets
+
+
+def unique_columns(columns, partition_digests, read_rows, n_rows, window=1024):
+    """
+    Columns left by the removal of the duplicated columns of agg_numeric / agg_categorical,
+    in the same order.
+
+    np.unique(df, axis=1, return_index=True) sorts the columns by their values (first row
+    first, nan values last) and keeps the first of each set of equal columns (never equal
+    when they have nan values). This order matters: it is the order of the loan-level
+    columns, so it decides which client-level duplicates are kept.
+    The equal columns are found from their digests. The others are sorted from their first
+    rows, reading more rows only while some of them are tied.
+
+    Parameters
+    ----------
+    columns : list of strings
+        The columns of the aggregated table.
+
+    partition_digests : list of dictionaries
+        The column digests of each partition of the table (see column_digests), in the
+        same partition order for all the columns.
+
+    read_rows : function
+        read_rows(columns, start, stop) returns the values of some columns for the rows
+        start to stop of the aggregated table (sorted by key) as a 2D array.
+
+    n_rows : integer
+        The number of rows of the aggregated table.
+
+    window : integer
+        The number of rows read first (8 times more at each next reading).
+
+    Return
+    ------
+    kept : list of strings
+
+    """
+
+    # 1st step: sets of equal columns (same values in every partition)
+    equal = dict()
+    for col in columns:
+        digest = hashlib.sha1(''.join(digests[col][0] for digests in partition_digests).encode('ascii'))
+        equal.setdefault(digest.hexdigest(), list()).append(col)
+    has_nan = {col: any(digests[col][1] for digests in partition_digests) for col in columns}
+    firsts = {members[0]: members for members in equal.values()}
+
+    # 2nd step: sort the different columns, tied columns sorted again with the next rows
+    groups, start = [list(firsts)], 0
+    while start < n_rows and any(len(group) > 1 for group in groups):
+        stop = min(start + window, n_rows)
+        tied = [col for group in groups if len(group) > 1 for col in group]
+        values = dict(zip(tied, read_rows(tied, start, stop).T))
+        sorted_groups = list()
+        for group in groups:
+            if len(group) == 1:
+                sorted_groups.append(group)
+                continue
+            block = np.array([values[col] for col in group])
+            # stable sort of the columns by their values (first row as primary key)
+            block_order = np.lexsort(block.T[::-1])
+            group, block = [group[i] for i in block_order], block[block_order]
+            sorted_groups.extend([group[i] for i in tied_set] for tied_set in tied_sets(block))
+        groups, start, window = sorted_groups, stop, window * 8
+
+    # 3rd step: one column of each set of equal columns (all of them if they have nan values)
+    kept = list()
+    for col in [col for group in groups for col in group]:
+        kept.extend(firsts[col] if has_nan[col] else [col])
+    return kept
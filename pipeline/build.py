@@ -0,0 +1,712 @@
+# data retreiving
+import os
+import json
+import pickle
+import shutil
+import pathlib
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# data handling
+import numpy as np
+import pandas as pd
+
+# mergeable statistics of the aggregations, cleaning helpers
+from pipeline import aggregation
+from pipeline import preprocessing
+
+#################### GLOBAL DATABASE (notebook 2 rebuilt chunk by chunk, out of core) ####################
+# 1) scan each child table in chunks: clean the chunk (types, 365243 and XNA values), collect the statistics
+#    of its columns (categories, flags, sample for the outlier limits) and split its rows by client into
+#    partition files (all the rows of a client, and so of its loans, land in the same partition)
+# 2) aggregate each partition at the loan level from partial statistics merged chunk by chunk,
+#    then at the client level
+# 3) remove the duplicated columns (digests gathered over all the partitions) and store the client-level
+#    features of each table as a memory-mapped matrix
+# 4) stream application_train / application_test in blocks, encode them and join the client-level
+#    features of the child tables, writing the global bases block by block
+#
+# Only one chunk, one partition or one block is in memory at once (plus the mapping of the bureau loans,
+# and the rows of the aggregated tables still read by the duplicates removal, within ROWS_CACHE_BYTES).
+# The bases are the ones of notebook 2 before the removal of the "too empty" and collinear columns.
+#
+# The child tables are independent until the final merges (except bureau_balance, partitioned with the
+# loans of bureau): with several jobs, the tables are built at the same time and their scans, partitions
+# and application tables are processed on a pool of worker processes (one chunk / partition in memory by
+# worker). The results are always gathered in the partition order, so the bases do not depend on the
+# number of jobs.
+
+# get relative data folder (raw tables of notebooks 1 and 2)
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../data_1-2').resolve()
+
+CLIENT_ID = 'SK_ID_CURR'
+TARGET = 'TARGET'
+
+# rows parsed at once, number of partitions of a child table, rows of the bases written at once
+CHUNK_SIZE = 100000
+N_PARTITIONS = 16
+BLOCK_SIZE = 10000
+
+# rows kept to compute the outlier limits (exact quantiles for the smaller tables)
+SAMPLE_SIZE = 500000
+
+# partial statistics merged every few chunks
+MERGE_EVERY = 8
+
+# rows of the aggregated tables kept between two readings of the duplicates removal (in bytes)
+ROWS_CACHE_BYTES = 512 * 2**20
+
+# worker processes (all the cores by default)
+N_JOBS = os.cpu_count() or 1
+
+# child tables, in the order of their merges in notebook 2
+# (POS_CASH_balance and previous_application keep the 'installments' prefix of the notebook:
+#  the trained models use these column names)
+TABLES = [
+    {'name': 'bureau', 'key': 'SK_ID_CURR', 'df_names': ['bureau'], 'links': 'SK_ID_BUREAU'},
+    {'name': 'bureau_balance', 'key': 'SK_ID_BUREAU', 'df_names': ['bureau_balance', 'client'],
+     'link': 'bureau', 'numeric_first': True},
+    {'name': 'credit_card_balance', 'key': 'SK_ID_PREV', 'df_names': ['cash', 'client']},
+    {'name': 'installments_payments', 'key': 'SK_ID_PREV', 'df_names': ['installments', 'client']},
+    {'name': 'POS_CASH_balance', 'key': 'SK_ID_PREV', 'df_names': ['installments', 'client'],
+     'XNA': ['NAME_CONTRACT_STATUS']},
+    {'name': 'previous_application', 'key': 'SK_ID_PREV', 'df_names': ['installments', 'client'],
+     '365243': ['DAYS_FIRST_DRAWING', 'DAYS_FIRST_DUE', 'DAYS_LAST_DUE_1ST_VERSION', 'DAYS_LAST_DUE',
+                'DAYS_TERMINATION'],
+     'XNA': ['NAME_CONTRACT_TYPE', 'NAME_CASH_LOAN_PURPOSE', 'NAME_PAYMENT_TYPE', 'CODE_REJECT_REASON',
+             'NAME_CLIENT_TYPE', 'NAME_GOODS_CATEGORY', 'NAME_PORTFOLIO', 'NAME_PRODUCT_TYPE',
+             'NAME_SELLER_INDUSTRY', 'NAME_YIELD_GROUP']},
+]
+
+APPLICATIONS = [
+    {'name': 'application_train', 'base': 'train_GlobalBase', '365243': ['DAYS_EMPLOYED'],
+     'XNA': ['CODE_GENDER', 'ORGANIZATION_TYPE']},
+    {'name': 'application_test', 'base': 'test_GlobalBase', '365243': ['DAYS_EMPLOYED'],
+     'XNA': ['ORGANIZATION_TYPE']},
+]
+
+
+def is_id(col):
+    return 'SK_ID' in col
+
+
+def new_pool(n_jobs):
+    # Pool of worker processes (None: everything runs in the calling process)
+    if n_jobs <= 1:
+        return None
+    # spawned workers: the pool is used from the threads of the tables
+    return ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn'))
+
+
+def run(pool, func, *args):
+    # Call of a function on the pool (waiting for its result)
+    return func(*args) if pool is None else pool.submit(func, *args).result()
+
+
+def run_all(pool, func, *iterables):
+    # Calls of a function on the pool, results in the order of the arguments
+    return list(map(func, *iterables)) if pool is None else list(pool.map(func, *iterables))
+
+
+def clean_chunk(chunk, spec):
+    # Types of convert_types and anomalous values of remove_365243 / remove_XNA (row by row, so chunk by chunk)
+    for col in chunk.columns:
+        if is_id(col):
+            chunk[col] = chunk[col].fillna(0).astype(np.int64)
+        elif chunk[col].dtype == np.float64:
+            chunk[col] = chunk[col].astype(np.float32)
+    if spec.get('365243'):
+        chunk = preprocessing.remove_365243(chunk, spec['365243'])
+    if spec.get('XNA'):
+        chunk[spec['XNA']] = chunk[spec['XNA']].replace('XNA', np.nan)
+    return chunk
+
+
+def new_stats(columns, seed=0):
+    # Statistics of the columns of a table, updated chunk by chunk
+    return {'columns': list(columns), 'rows': 0, 'categories': dict(), 'distinct': dict(), 'has_nan': dict(),
+            'sample': None, 'rng': np.random.default_rng(seed)}
+
+
+def update_sample(stats, block):
+    # Reservoir sample of the rows (every row has the same probability to be in the sample)
+    if stats['sample'] is None:
+        stats['sample'] = np.empty((SAMPLE_SIZE, block.shape[1]), dtype=np.float32)
+    sample, seen = stats['sample'], stats['rows']
+
+    # the first rows fill the sample
+    fill = max(0, min(SAMPLE_SIZE - seen, len(block)))
+    sample[seen:seen + fill] = block[:fill]
+
+    # each next row replaces a random row of the sample with probability SAMPLE_SIZE / (row number + 1)
+    slots = stats['rng'].integers(0, np.arange(seen + fill, seen + len(block)) + 1)
+    kept = slots < SAMPLE_SIZE
+    sample[slots[kept]] = block[fill:][kept]
+
+
+def update_stats(stats, chunk):
+    """
+    Update the statistics of a table with a cleaned chunk.
+
+    Parameters
+    ----------
+    stats : dictionary
+        The statistics of the table (see new_stats), updated in place:
+        categories of the text columns, first distinct values and missing values
+        of the numeric columns, sample of the rows.
+
+    chunk : dataframe
+        The cleaned chunk.
+
+    """
+
+    sampled = [col for col in stats['columns'] if not is_id(col)]
+    block = np.empty((len(chunk), len(sampled)), dtype=np.float32)
+
+    for j, col in enumerate(sampled):
+        values = chunk[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            stats['categories'].setdefault(col, set()).update(values.dropna().unique())
+            block[:, j] = np.nan
+        else:
+            # up to 3 distinct values are enough to tell flags and outliers candidates apart
+            distinct = stats['distinct'].setdefault(col, set())
+            if len(distinct) < 3:
+                distinct.update(values.dropna().unique()[:3].tolist())
+            stats['has_nan'][col] = stats['has_nan'].get(col, False) or bool(values.isna().any())
+            block[:, j] = values.to_numpy(dtype=np.float32)
+
+    update_sample(stats, block)
+    stats['rows'] += len(chunk)
+
+
+def column_types(stats):
+    # Columns of a scanned table as convert_types would type them: ids, categories (sorted), flags, numeric
+    categories = {col: sorted(stats['categories'][col]) for col in stats['columns'] if col in stats['categories']}
+    flags = [col for col in stats['columns'] if col not in categories and col in stats['distinct']
+             and not stats['has_nan'][col] and stats['distinct'][col] == {0, 1}]
+    numeric = [col for col in stats['columns']
+               if not is_id(col) and col not in categories and col not in flags]
+    return {'categories': categories, 'flags': flags, 'numeric': numeric}
+
+
+def outlier_limits(stats, types, quant_low=0.2, quant_up=0.8, whisker=2):
+    """
+    Limits of the outliers of the numeric columns (remove_outliers of notebook 2).
+
+    The quantiles are the ones of the sample of the rows (exact for the tables
+    smaller than the sample). The ids are left out.
+
+    Parameters
+    ----------
+    stats, types : dictionaries
+        The statistics of the table and its column types.
+
+    quant_low, quant_up, whisker :
+        The quantiles and the number of interquantile spaces of the Tukey's box plot.
+
+    Return
+    ------
+    limits : dictionary
+        The (lower, upper) limits of each numeric column with more than 2 distinct values.
+
+    """
+
+    sampled = [col for col in stats['columns'] if not is_id(col)]
+    masked = [j for j, col in enumerate(sampled) if col in types['numeric'] and len(stats['distinct'][col]) > 2]
+    if not masked:
+        return dict()
+    sample = stats['sample'][:min(stats['rows'], SAMPLE_SIZE), masked]
+    low, up = preprocessing.tukey_limits(sample, quant_low, quant_up, whisker)
+    return dict(zip([sampled[j] for j in masked], zip(low, up)))
+
+
+def partition_path(folder, prefix, p):
+    return pathlib.Path(folder).joinpath('%s-%03i.pkl' % (prefix, p))
+
+
+def read_pieces(path):
+    # Chunks appended to a partition file
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def client_lookup(links, key):
+    # Sorted loans and their client (first one) from the (loan, client) pairs of another table
+    pairs = links.drop_duplicates(key).sort_values(key)
+    return pairs[key].to_numpy(), pairs[CLIENT_ID].to_numpy()
+
+
+def partition_ids(chunk, spec, n_partitions, lookup=None):
+    # Partition of each row: client modulo the number of partitions (loan if the client is unknown)
+    if lookup is None:
+        clients = chunk[CLIENT_ID].to_numpy()
+    else:
+        loans, loan_clients = lookup
+        keys = chunk[spec['key']].to_numpy()
+        pos = np.searchsorted(loans, keys).clip(max=len(loans) - 1)
+        clients = np.where(loans[pos] == keys, loan_clients[pos], keys)
+    return clients % n_partitions
+
+
+def scan_table(spec, data_path, work_dir=None, n_partitions=N_PARTITIONS, chunk_size=CHUNK_SIZE, lookup=None):
+    """
+    Scan a table in chunks: statistics of its columns and partition files.
+
+    Parameters
+    ----------
+    spec : dictionary
+        The description of the table (see TABLES and APPLICATIONS).
+
+    data_path : path
+        The folder of the raw csv tables.
+
+    work_dir : path
+        The folder of the partition files (the rows are not kept if None).
+
+    n_partitions, chunk_size : integers
+        The number of partitions and the number of rows parsed at once.
+
+    lookup : tuple of arrays
+        The clients of the loans (see client_lookup) for the tables without client ids.
+
+    Return
+    ------
+    stats : dictionary
+        The statistics of the columns (see update_stats).
+
+    links : dataframe
+        The number of rows of each pair of spec['links'] and client ids (None if not requested).
+
+    """
+
+    stats, links, files = None, list(), list()
+    try:
+        for chunk in pd.read_csv(pathlib.Path(data_path).joinpath(spec['name'] + '.csv'), chunksize=chunk_size):
+            chunk = clean_chunk(chunk, spec)
+
+            if not files and work_dir is not None:
+                files = [open(partition_path(work_dir, 'rows', p), 'wb') for p in range(n_partitions)]
+                # an empty chunk first: every partition knows the columns and their types
+                for f in files:
+                    pickle.dump(chunk.iloc[:0], f, protocol=pickle.HIGHEST_PROTOCOL)
+            if stats is None:
+                stats = new_stats(chunk.columns)
+
+            update_stats(stats, chunk)
+            if spec.get('links'):
+                links.append(chunk.groupby([spec['links'], CLIENT_ID]).size())
+            if files:
+                for p, piece in chunk.groupby(partition_ids(chunk, spec, n_partitions, lookup)):
+                    pickle.dump(piece, files[p], protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files:
+            f.close()
+
+    if links:
+        links = pd.concat(links).groupby(level=[0, 1]).sum().rename('weight').reset_index()
+    return stats, links if spec.get('links') else None
+
+
+def table_scan(spec, data_path, work_dir=None, n_partitions=N_PARTITIONS, chunk_size=CHUNK_SIZE, lookup=None):
+    # Scan of a table reduced to what the next steps need (the sample of the rows stays in the worker):
+    # columns, column types, outlier limits and links
+    stats, links = scan_table(spec, data_path, work_dir, n_partitions, chunk_size, lookup)
+    types = column_types(stats)
+    return {'columns': stats['columns'], 'types': types, 'limits': outlier_limits(stats, types), 'links': links}
+
+
+def loan_frames(partial, spec, types):
+    # Aggregated tables of a merged partition, in the order of the merges of the notebook
+    numeric = aggregation.numeric_columns(partial, types['numeric'], spec['df_names'][0])
+    frames = [numeric]
+    if types['categories']:
+        categorical = aggregation.categorical_columns(partial, spec['df_names'][0])
+        frames = [numeric, categorical] if spec.get('numeric_first') else [categorical, numeric]
+    for frame in frames:
+        frame.index.name = spec['key']
+    return frames
+
+
+def aggregate_partition(spec, types, limits, rows_path, out_path):
+    """
+    Aggregate a partition of a child table by spec['key'] (loan, or client for bureau).
+
+    Parameters
+    ----------
+    spec, types, limits :
+        The description of the table, its column types and its outlier limits.
+
+    rows_path, out_path : paths
+        The partition file of the rows, the file of the aggregated tables.
+
+    Return
+    ------
+    digests : list of dictionaries
+        The column digests of each aggregated table (see aggregation.column_digests).
+
+    keys : array
+        The keys of the aggregated tables.
+
+    """
+
+    partials, links = list(), list()
+    for piece in read_pieces(rows_path):
+        piece = preprocessing.mask_outliers(piece, limits)
+        partials.append(aggregation.partial_aggregates(piece, spec['key'], types['numeric'], types['categories']))
+        if len(spec['df_names']) == 2 and 'link' not in spec:
+            links.append(piece.groupby([spec['key'], CLIENT_ID]).size())
+        if len(partials) == MERGE_EVERY:
+            partials = [aggregation.merge_partials(partials)]
+
+    frames = loan_frames(aggregation.merge_partials(partials), spec, types)
+    links = pd.concat(links).groupby(level=[0, 1]).sum().rename('weight').reset_index() if links else None
+
+    with open(out_path, 'wb') as f:
+        pickle.dump({'frames': frames, 'links': links}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return [aggregation.column_digests(frame) for frame in frames], frames[0].index.to_numpy()
+
+
+def client_partition(spec, kept, links, loans_path, out_path):
+    # Aggregate the loans of a partition by client (loan-level columns left by the duplicates removal)
+    with open(loans_path, 'rb') as f:
+        loans = pickle.load(f)
+    frames = [frame[columns] for frame, columns in zip(loans['frames'], kept)]
+    loans_df = pd.concat(frames, axis=1)
+    if links is None:
+        links = loans['links']
+    clients = aggregation.client_aggregates(loans_df, links, spec['key'], spec['df_names'][1], CLIENT_ID)
+
+    with open(out_path, 'wb') as f:
+        pickle.dump({'frames': [clients]}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return [aggregation.column_digests(clients)], clients.index.to_numpy()
+
+
+def load_frame(path, i):
+    with open(path, 'rb') as f:
+        return pickle.load(f)['frames'][i]
+
+
+def rows_reader(paths, i, max_bytes=ROWS_CACHE_BYTES):
+    """
+    Reader of the rows of the i-th aggregated table of the partitions, by windows of keys.
+
+    The duplicates removal reads growing windows of keys, each one after the previous one,
+    for fewer and fewer columns (see aggregation.unique_columns). Instead of loading every
+    partition file again for each window, the rows after the window are kept for the columns
+    just read, as long as they fit in max_bytes (the other partitions are loaded again).
+
+    Parameters
+    ----------
+    paths : list of paths
+        The files of the aggregated tables of the partitions.
+
+    i : integer
+        The index of the aggregated table in the files.
+
+    max_bytes : integer
+        The size of the rows kept between two windows.
+
+    Return
+    ------
+    read_rows : function
+        read_rows(low, high, columns) returns the values of some columns for the keys from
+        low to high (all the partitions, sorted by key) as a 2D array.
+
+    """
+
+    # kept rows of each partition (keys after 'high', some columns)
+    state = {'frames': dict(), 'high': None}
+
+    def read_rows(low, high, columns):
+        # the kept rows only serve a window after the previous one, with some of its columns
+        if state['high'] is None or low <= state['high']:
+            state['frames'] = dict()
+        parts, kept, kept_bytes = list(), dict(), 0
+        for p, path in enumerate(paths):
+            frame = state['frames'].pop(p, None)
+            if frame is None or not set(columns) <= set(frame.columns):
+                frame = load_frame(path, i)
+            parts.append(frame.loc[low:high, columns])
+            rest = frame.loc[frame.index > high, columns]
+            size = int(rest.memory_usage(index=True).sum())
+            if kept_bytes + size <= max_bytes:
+                kept[p] = rest
+                kept_bytes += size
+        state['frames'], state['high'] = kept, high
+        return pd.concat(parts).sort_index().to_numpy(dtype=np.float64)
+
+    return read_rows
+
+
+def kept_columns(paths, results):
+    """
+    Columns of each aggregated table of the partitions left by the duplicates removal.
+
+    Parameters
+    ----------
+    paths : list of paths
+        The files of the aggregated tables of the partitions.
+
+    results : list of tuples
+        The digests and keys of each partition (see aggregate_partition).
+
+    Return
+    ------
+    kept : list of lists of strings
+        The columns of each aggregated table, in the order of np.unique.
+
+    """
+
+    keys = np.sort(np.concatenate([partition_keys for _, partition_keys in results]))
+    kept = list()
+    for i, columns in enumerate(results[0][0]):
+        read_rows = rows_reader(paths, i)
+        rows = lambda columns, start, stop, read_rows=read_rows: read_rows(keys[start], keys[stop - 1], columns)
+        kept.append(aggregation.unique_columns(list(columns), [digests[i] for digests, _ in results], rows, len(keys)))
+    return kept
+
+
+def store_features(folder, paths, kept):
+    """
+    Write the client-level features of a table as a memory-mappable matrix.
+
+    Parameters
+    ----------
+    folder : path
+        The folder of the features (ids.npy sorted, values.npy, columns.json).
+
+    paths : list of paths
+        The files of the client-level tables of the partitions.
+
+    kept : list of lists of strings
+        The columns of each client-level table.
+
+    """
+
+    folder = pathlib.Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    def partition_frame(path):
+        with open(path, 'rb') as f:
+            frames = pickle.load(f)['frames']
+        return pd.concat([frame[columns] for frame, columns in zip(frames, kept)], axis=1)
+
+    ids = np.sort(np.concatenate([partition_frame(path).index.to_numpy(dtype=np.int64) for path in paths]))
+    columns = [col for columns in kept for col in columns]
+    values = np.lib.format.open_memmap(folder.joinpath('values.npy'), mode='w+', dtype=np.float64,
+                                       shape=(len(ids), len(columns)))
+    for path in paths:
+        df = partition_frame(path)
+        values[np.searchsorted(ids, df.index.to_numpy(dtype=np.int64))] = df.to_numpy(dtype=np.float64)
+    values.flush()
+    del values
+
+    np.save(folder.joinpath('ids.npy'), ids)
+    with open(folder.joinpath('columns.json'), 'w') as f:
+        json.dump(columns, f)
+
+
+def load_features(folder):
+    folder = pathlib.Path(folder)
+    with open(folder.joinpath('columns.json')) as f:
+        columns = json.load(f)
+    return {'ids': np.load(folder.joinpath('ids.npy')), 'values': np.load(folder.joinpath('values.npy'), mmap_mode='r'),
+            'columns': columns}
+
+
+def build_table(spec, data_path, work_dir, feature_dir, n_partitions=N_PARTITIONS, chunk_size=CHUNK_SIZE,
+                links=None, pool=None):
+    """
+    Client-level features of a child table (aggregate_client of notebook 2, or the bureau aggregations).
+
+    Parameters
+    ----------
+    spec : dictionary
+        The description of the table (see TABLES).
+
+    data_path, work_dir, feature_dir : paths
+        The folder of the raw tables, a temporary folder, the folder of the stored features.
+
+    n_partitions, chunk_size : integers
+        See scan_table.
+
+    links : dataframe
+        The (loan, client) pairs of the table spec['link'] (see scan_table).
+
+    pool : executor
+        The pool of worker processes running the scan and the partitions (see new_pool),
+        everything runs in the calling process if None.
+
+    Return
+    ------
+    links : dataframe
+        The (loan, client) pairs of this table if spec['links'] is set.
+
+    """
+
+    work_dir = pathlib.Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    lookup = client_lookup(links, spec['key']) if links is not None else None
+
+    # 1st step: statistics of the columns and partitions of the rows
+    scan = run(pool, table_scan, spec, data_path, work_dir, n_partitions, chunk_size, lookup)
+
+    # 2nd step: aggregation of each partition by key
+    paths = [partition_path(work_dir, 'loans', p) for p in range(n_partitions)]
+    results = run_all(pool, aggregate_partition, [spec] * n_partitions, [scan['types']] * n_partitions,
+                      [scan['limits']] * n_partitions, [partition_path(work_dir, 'rows', p) for p in range(n_partitions)],
+                      paths)
+    kept = kept_columns(paths, results)
+
+    # 3rd step: aggregation of the loans by client
+    if len(spec['df_names']) == 2:
+        partition_links = [None] * n_partitions
+        if links is not None:
+            partition_links = [links[links[CLIENT_ID] % n_partitions == p] for p in range(n_partitions)]
+        client_paths = [partition_path(work_dir, 'clients', p) for p in range(n_partitions)]
+        results = run_all(pool, client_partition, [spec] * n_partitions, [kept] * n_partitions, partition_links,
+                          paths, client_paths)
+        paths = client_paths
+        kept = kept_columns(paths, results)
+
+    store_features(pathlib.Path(feature_dir).joinpath(spec['name']), paths, kept)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return scan['links']
+
+
+def encode(chunk, types):
+    # Flags as booleans (convert_types), one-hot encoding of the categories (get_dummies at the end)
+    for col in types['flags']:
+        chunk[col] = chunk[col].astype(bool)
+    if not types['categories']:
+        return chunk
+    return pd.concat([chunk.drop(columns=list(types['categories'])), aggregation.dummies(chunk, types['categories'])],
+                     axis=1)
+
+
+def encoded_columns(stats, types):
+    # Columns of an encoded application table
+    dummies = ['%s_%s' % (col, cat) for col, cats in types['categories'].items() for cat in cats]
+    return [col for col in stats['columns'] if col not in types['categories']] + dummies
+
+
+def lookup_features(features, ids):
+    # Features of some clients as a dataframe to merge (the clients without rows are left out)
+    if not len(features['ids']):
+        return pd.DataFrame({CLIENT_ID: np.empty(0, dtype=np.int64)})
+    pos = np.searchsorted(features['ids'], ids).clip(max=len(features['ids']) - 1)
+    rows = np.sort(pos[features['ids'][pos] == ids])
+    df = pd.DataFrame(features['values'][rows], columns=features['columns'])
+    df.insert(0, CLIENT_ID, features['ids'][rows])
+    return df
+
+
+def write_base(spec, data_path, output_path, columns, types, limits, feature_dir, block_size=BLOCK_SIZE):
+    # Encode an application table block by block, join the client-level features and write the global base
+    # (features memory-mapped from their folder: they are not copied to the worker)
+    features = [load_features(pathlib.Path(feature_dir).joinpath(table['name'])) for table in TABLES]
+    path = pathlib.Path(output_path).joinpath(spec['base'] + '.csv')
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', newline='') as f:
+        for i, chunk in enumerate(pd.read_csv(pathlib.Path(data_path).joinpath(spec['name'] + '.csv'),
+                                              chunksize=block_size)):
+            chunk = preprocessing.mask_outliers(clean_chunk(chunk, spec), limits)
+            block = encode(chunk, types).reindex(columns=columns)
+            if TARGET in chunk.columns:
+                block[TARGET] = chunk[TARGET]
+            for table in features:
+                block = block.merge(lookup_features(table, block[CLIENT_ID].to_numpy()), on=CLIENT_ID, how='left')
+            block.to_csv(f, header=(i == 0), index=False)
+    tmp_path.replace(path)
+    return path
+
+
+def build(data_path=DATA_PATH, output_path=DATA_PATH, work_path=None, n_partitions=N_PARTITIONS,
+          chunk_size=CHUNK_SIZE, n_jobs=N_JOBS):
+    """
+    Build the global train and test bases of notebook 2 with a bounded memory.
+
+    Parameters
+    ----------
+    data_path : path
+        The folder of the raw Home Credit tables (csv files).
+
+    output_path : path
+        The folder of the global bases (train_GlobalBase.csv, test_GlobalBase.csv)
+        and of the client-level features of each child table (features folder).
+
+    work_path : path
+        The folder of the temporary partition files (system temporary folder by default).
+
+    n_partitions, chunk_size : integers
+        See scan_table.
+
+    n_jobs : integer
+        The number of worker processes (1: sequential build, same bases).
+
+    Return
+    ------
+    paths : list of paths
+        The written global bases.
+
+    """
+
+    output_path = pathlib.Path(output_path)
+    feature_dir = output_path.joinpath('features')
+    work_dir = pathlib.Path(tempfile.mkdtemp(prefix='global_base_', dir=work_path))
+    pool = new_pool(n_jobs)
+    try:
+        # client-level features of each child table: one thread by table, waiting for the pool
+        # (bureau_balance waits for the loans of bureau, submitted before it)
+        tables = dict()
+
+        def table_features(spec):
+            link = spec.get('link')
+            links = tables[link].result() if link else None
+            return build_table(spec, data_path, work_dir.joinpath(spec['name']), feature_dir, n_partitions,
+                               chunk_size, links, pool)
+
+        with ThreadPoolExecutor(max_workers=len(TABLES) if pool is not None else 1) as threads:
+            for spec in TABLES:
+                tables[spec['name']] = threads.submit(table_features, spec)
+            for future in tables.values():
+                future.result()
+
+        # application tables: statistics, then the aligned columns of their encoding
+        n = len(APPLICATIONS)
+        scans = run_all(pool, table_scan, APPLICATIONS, [data_path] * n, [None] * n, [n_partitions] * n,
+                        [chunk_size] * n)
+        encoded = [encoded_columns(scan, scan['types']) for scan in scans]
+        shared = set.intersection(*[set(columns) for columns in encoded])
+        aligned = [col for col in encoded[0] if col in shared]
+
+        return run_all(pool, write_base, APPLICATIONS, [data_path] * n, [output_path] * n, [aligned] * n,
+                       [scan['types'] for scan in scans], [scan['limits'] for scan in scans], [feature_dir] * n)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # e.g. python -m pipeline.build --data data_1-2
+    parser = argparse.ArgumentParser(description='Build the global bases of notebook 2 chunk by chunk.')
+    parser.add_argument('--data', default=str(DATA_PATH), help='folder of the raw csv tables')
+    parser.add_argument('--output', default=None, help='folder of the global bases (data folder by default)')
+    parser.add_argument('--work', default=None, help='folder of the temporary partition files')
+    parser.add_argument('--partitions', type=int, default=N_PARTITIONS, help='partitions of each child table')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows parsed at once')
+    parser.add_argument('--jobs', type=int, default=N_JOBS, help='worker processes (1: sequential build)')
+    args = parser.parse_args()
+
+    for path in build(args.data, args.output or args.data, args.work, args.partitions, args.chunk_size,
+                      args.jobs):
+        print('%s written' % path)
@@ -0,0 +1,237 @@
+# data handling
+import numpy as np
+import pandas as pd
+
+# modeling
+import lightgbm as lgb
+from lightgbm import LGBMClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.model_selection import KFold
+from sklearn.metrics import roc_auc_score
+
+#################### EXPERIMENT HARNESS (run_experiment of notebooks 3 and 4 with cached folds and datasets) ####################
+# 1) preprocess the data once: median imputation and min-max scaling of run_experiment, float32 matrix,
+#    indices of the KFold of the notebooks
+# 2) build the LightGBM Dataset (bins of the features) of each fold once, reused by every parameter set
+#    trained on the same features (cached by fold, features and binning parameters)
+# 3) train the boosters with the parameters of an LGBMClassifier and score them as run_experiment
+#    (train and valid ROC AUC of each fold, split importances)
+#
+# Imputation and scaling work column by column: the features kept by feature_reduction are the
+# matching columns of the preprocessed matrix, only their datasets are built again.
+
+ID = 'SK_ID_CURR'
+TARGET = 'TARGET'
+
+# parameters of an LGBMClassifier which are not parameters of lgb.train
+SKLEARN_ONLY = ['n_estimators', 'importance_type', 'class_weight', 'silent', 'n_jobs', 'random_state',
+                'subsample_for_bin']
+
+
+def prepare_experiment(data, n_folds=5, dtype=np.float32):
+    """
+    Preprocess the data of run_experiment once.
+
+    Parameters
+    ----------
+    data : dataframe
+        The training data (with the SK_ID_CURR and TARGET columns).
+
+    n_folds : integer
+        The number of folds of the cross-validation.
+
+    dtype : numpy dtype
+        The dtype of the preprocessed matrix (float64 gives the exact matrix of the notebooks).
+
+    Return
+    ------
+    experiment : dictionary
+        'features' (preprocessed matrix), 'labels', 'feature_names', 'folds' (train and
+        valid indices of each fold) and 'datasets' (cache of the LightGBM datasets).
+
+    """
+
+    labels = data[TARGET].to_numpy()
+    features = data.drop(columns=[ID, TARGET])
+    feature_names = list(features.columns)
+
+    # median imputation and scaling of run_experiment (fitted on all the data, as in the notebooks)
+    features = SimpleImputer(missing_values=np.nan, strategy='median').fit_transform(features)
+    features = MinMaxScaler(feature_range=(0, 1)).fit_transform(features).astype(dtype, copy=False)
+
+    folds = list(KFold(n_splits=n_folds, random_state=0, shuffle=True).split(features))
+    return {'features': features, 'labels': labels, 'feature_names': feature_names, 'folds': folds,
+            'datasets': dict()}
+
+
+def train_params(model):
+    """
+    Parameters of lgb.train equivalent to an LGBMClassifier.
+
+    Parameters
+    ----------
+    model : LGBMClassifier or dictionary
+        The model or its parameters.
+
+    Return
+    ------
+    params : dictionary
+        The training parameters (binning parameters included).
+
+    num_boost_round : integer
+        The number of trees (n_estimators).
+
+    binning : dictionary
+        The parameters of the dataset (the same for every model with the same seed).
+
+    """
+
+    if not hasattr(model, 'get_params'):
+        model = LGBMClassifier(**model)
+    sklearn_params = model.get_params()
+
+    binning = {'bin_construct_sample_cnt': sklearn_params.get('subsample_for_bin', 200000), 'verbose': -1}
+    if sklearn_params.get('random_state') is not None:
+        binning['seed'] = sklearn_params['random_state']
+    params = {key: value for key, value in sklearn_params.items() if key not in SKLEARN_ONLY and value is not None}
+    params.update(binning)
+    if sklearn_params.get('n_jobs') not in [None, -1]:
+        params['num_threads'] = sklearn_params['n_jobs']
+
+    # the bins do not depend on min_child_samples: no pre-filtering of the features
+    binning['feature_pre_filter'] = False
+    return params, sklearn_params['n_estimators'], binning
+
+
+def fold_dataset(experiment, fold, columns, binning):
+    # LightGBM dataset of the training rows of a fold (built once by fold, features and binning parameters)
+    key = (fold, tuple(columns), tuple(sorted(binning.items())))
+    if key not in experiment['datasets']:
+        train_indices = experiment['folds'][fold][0]
+        features = experiment['features'][np.ix_(train_indices, columns)]
+        experiment['datasets'][key] = lgb.Dataset(features, label=experiment['labels'][train_indices],
+                                                  params=dict(binning), free_raw_data=True).construct()
+    return experiment['datasets'][key]
+
+
+def column_indices(experiment, features=None):
+    # Positions of some features in the preprocessed matrix (all of them by default)
+    if features is None:
+        return list(range(len(experiment['feature_names'])))
+    positions = {name: i for i, name in enumerate(experiment['feature_names'])}
+    return [positions[name] for name in features]
+
+
+def feature_matrix(experiment, columns):
+    # Preprocessed matrix of some columns (the last subset is kept: feature_reduction uses it for all the folds)
+    if columns == list(range(experiment['features'].shape[1])):
+        return experiment['features']
+    if experiment.get('subset', (None,))[0] != tuple(columns):
+        experiment['subset'] = (tuple(columns), experiment['features'][:, columns])
+    return experiment['subset'][1]
+
+
+def train_fold(experiment, model, fold, features=None):
+    """
+    Train a model on a fold and score it (one iteration of run_experiment).
+
+    Parameters
+    ----------
+    experiment : dictionary
+        See prepare_experiment.
+
+    model : LGBMClassifier or dictionary
+        The model (or its parameters) to train.
+
+    fold : integer
+        The fold (its rows are the validation rows).
+
+    features : list of strings
+        The features to train the model on (all of them by default).
+
+    Return
+    ------
+    scores : dictionary
+        The 'train' and 'valid' ROC AUC scores and the split 'importances' of the features.
+
+    """
+
+    columns = column_indices(experiment, features)
+    params, num_boost_round, binning = train_params(model)
+    booster = lgb.train(params, fold_dataset(experiment, fold, columns, binning), num_boost_round=num_boost_round)
+
+    # predictions on all the rows at once, split between the train and valid rows of the fold
+    train_indices, valid_indices = experiment['folds'][fold]
+    predictions = booster.predict(feature_matrix(experiment, columns))
+    labels = experiment['labels']
+    return {'train': roc_auc_score(labels[train_indices], predictions[train_indices]),
+            'valid': roc_auc_score(labels[valid_indices], predictions[valid_indices]),
+            'importances': booster.feature_importance(importance_type='split')}
+
+
+def run_experiment(model_input, experiment, feat_imp=False, features=None):
+    """
+    Train and evaluate a model using cross validation (run_experiment of notebooks 3 and 4
+    on a prepared experiment). Give the features importances if desired.
+
+    Parameters
+    ----------
+    model_input : LGBMClassifier or dictionary
+        The model (or its parameters) to evaluate.
+
+    experiment : dictionary
+        See prepare_experiment (a dataframe is prepared first, without cache between calls).
+
+    feat_imp : boolean
+        Return the feature importances (mean of the folds) too.
+
+    features : list of strings
+        The features to use (all of them by default).
+
+    Return
+    ------
+    feature_importances : dataframe (if feat_imp is True)
+        The feature importances from the model.
+
+    metrics : dataframe
+        The training and validation ROC AUC for each fold and overall.
+
+    """
+
+    if isinstance(experiment, pd.DataFrame):
+        experiment = prepare_experiment(experiment)
+    if features is None:
+        features = list(experiment['feature_names'])
+    n_folds = len(experiment['folds'])
+
+    results = [train_fold(experiment, model_input, k, features) for k in range(n_folds)]
+    train_scores = [result['train'] for result in results]
+    valid_scores = [result['valid'] for result in results]
+    metrics = pd.DataFrame({'fold': list(range(n_folds)) + ['overall'],
+                            'train': train_scores + [np.mean(train_scores)],
+                            'valid': valid_scores + [np.mean(valid_scores)]})
+    if not feat_imp:
+        return metrics
+
+    importances = np.zeros(len(features))
+    for result in results:
+        importances += result['importances'] / n_folds
+    return pd.DataFrame({'feature': features, 'importance': importances}), metrics
+
+
+def feature_reduction(model, experiment, features=None):
+    # Remove the features without importance until all of them are used (feature_reduction of notebook 4):
+    # feature importances and kept features
+    if isinstance(experiment, pd.DataFrame):
+        experiment = prepare_experiment(experiment)
+    features = list(experiment['feature_names']) if features is None else list(features)
+    zero_features = [None]
+    i = 0
+    while len(zero_features) != 0:
+        i += 1
+        print('run number %i' % i, end='\r')
+        feature_importances, _ = run_experiment(model, experiment, feat_imp=True, features=features)
+        zero_features = list(feature_importances[feature_importances['importance'] == 0.0]['feature'])
+        features = [feature for feature in features if feature not in zero_features]
+    return feature_importances, features
@@ -0,0 +1,196 @@
+# data retreiving
+import json
+import time
+import argparse
+import warnings
+
+# data handling
+import numpy as np
+import pandas as pd
+
+# modeling
+import lightgbm as lgb
+from sklearn.metrics import roc_auc_score
+
+# preprocessed matrix, folds and training parameters of run_experiment
+from pipeline import experiment
+
+#################### FEATURE SELECTION (feature_reduction of notebook 4 without rebuilding the datasets) ####################
+# 1) preprocess the data once (see pipeline.experiment): the features kept at each round are columns
+#    of the same matrix, the training frame is never copied nor transformed again
+# 2) bin the training rows of each fold by blocks of columns, once: the dataset of a round is the
+#    merge of the cached blocks (LightGBM add_features_from), only the blocks which lost features
+#    are binned again
+# 3) train the model on each fold, drop all the features without importance in one batch and start
+#    again until every feature is used (as feature_reduction)
+# 4) report the time of each round, the number of features kept and the validation ROC AUC
+#
+# The bins of a feature do not depend on the other features: the merged datasets train the same
+# models as the datasets built from scratch, and the same features are kept as with feature_reduction.
+
+# columns binned together (a block is binned again when one of its features is dropped)
+BLOCK_SIZE = 8
+
+# final model of notebook 4
+MODEL = dict(boosting_type='goss', objective='binary', num_leaves=5, n_estimators=82, learning_rate=0.092,
+             reg_alpha=0.82, reg_lambda=0.4, subsample=1.0, colsample_bytree=0.55, is_unbalance=False,
+             random_state=0)
+
+
+def block_dataset(prepared, fold, columns, binning):
+    # LightGBM dataset of some columns of the training rows of a fold (without label: merged into another one)
+    train_indices = prepared['folds'][fold][0]
+    return lgb.Dataset(prepared['features'][np.ix_(train_indices, columns)], params=dict(binning),
+                       free_raw_data=True).construct()
+
+
+def round_dataset(prepared, fold, columns, binning, block_size=BLOCK_SIZE):
+    """
+    Dataset of the training rows of a fold on some columns, merged from the cached blocks.
+
+    Parameters
+    ----------
+    prepared : dictionary
+        See pipeline.experiment.prepare_experiment (the blocks are cached in prepared['blocks']).
+
+    fold : integer
+        The fold (its rows are the validation rows).
+
+    columns : list of integers
+        The columns of the preprocessed matrix (in increasing order).
+
+    binning : dictionary
+        The parameters of the datasets (see pipeline.experiment.train_params).
+
+    block_size : integer
+        The number of columns of the matrix binned together.
+
+    Return
+    ------
+    dataset : LightGBM dataset
+        A new dataset (the cached blocks are not modified by the training).
+
+    """
+
+    blocks = prepared.setdefault('blocks', dict())
+    binning_key = tuple(sorted(binning.items()))
+
+    # the first column starts a new dataset with the labels, the blocks of the next ones are added to it
+    train_indices = prepared['folds'][fold][0]
+    dataset = lgb.Dataset(prepared['features'][np.ix_(train_indices, columns[:1])],
+                          label=prepared['labels'][train_indices], params=dict(binning),
+                          free_raw_data=True).construct()
+    for block in sorted(set(column // block_size for column in columns[1:])):
+        subset = tuple(column for column in columns[1:] if column // block_size == block)
+        key = (fold, block, binning_key)
+        # a block with dropped features replaces the cached one
+        if blocks.get(key, (None,))[0] != subset:
+            blocks[key] = (subset, block_dataset(prepared, fold, list(subset), binning))
+        dataset.add_features_from(blocks[key][1])
+    return dataset
+
+
+def select_features(model, experiment_input, features=None, block_size=BLOCK_SIZE, verbose=True):
+    """
+    Remove the features without importance until all of them are used (feature_reduction
+    of notebook 4), the datasets of the folds shrinking with the features.
+
+    Parameters
+    ----------
+    model : LGBMClassifier or dictionary
+        The model (or its parameters) to train.
+
+    experiment_input : dictionary or dataframe
+        See pipeline.experiment.prepare_experiment (a dataframe is prepared first).
+
+    features : list of strings
+        The features to start from (all of them by default).
+
+    block_size : integer
+        The number of columns of the matrix binned together.
+
+    verbose : boolean
+        Print a line by round.
+
+    Return
+    ------
+    feature_importances : dataframe
+        The feature importances of the last round (mean of the folds).
+
+    features : list of strings
+        The kept features.
+
+    report : dataframe
+        The 'round', its number of 'features', the 'dropped' ones, the mean 'valid' ROC AUC
+        of the folds and the 'time' of the round (seconds).
+
+    """
+
+    prepared = experiment_input
+    if isinstance(prepared, pd.DataFrame):
+        prepared = experiment.prepare_experiment(prepared)
+    features = list(prepared['feature_names']) if features is None else list(features)
+    params, num_boost_round, binning = experiment.train_params(model)
+    n_folds = len(prepared['folds'])
+    labels = prepared['labels']
+
+    rows = list()
+    zero_features = [None]
+    while len(zero_features) != 0:
+        start = time.perf_counter()
+        columns = sorted(experiment.column_indices(prepared, features))
+        features = [prepared['feature_names'][column] for column in columns]
+
+        # 1st step: the model trained on each fold, importances as in run_experiment
+        importances = np.zeros(len(columns))
+        valid_scores = list()
+        for k in range(n_folds):
+            with warnings.catch_warnings():
+                # the datasets are merged without their raw data
+                warnings.simplefilter('ignore')
+                dataset = round_dataset(prepared, k, columns, binning, block_size)
+            booster = lgb.train(params, dataset, num_boost_round=num_boost_round)
+            importances += booster.feature_importance(importance_type='split') / n_folds
+            valid_indices = prepared['folds'][k][1]
+            valid_scores.append(roc_auc_score(labels[valid_indices],
+                                              booster.predict(prepared['features'][np.ix_(valid_indices, columns)])))
+
+        # 2nd step: all the features without importance dropped at once
+        feature_importances = pd.DataFrame({'feature': features, 'importance': importances})
+        zero_features = list(feature_importances[feature_importances['importance'] == 0.0]['feature'])
+        dropped = set(zero_features)
+        features = [feature for feature in features if feature not in dropped]
+
+        rows.append({'round': len(rows) + 1, 'features': len(columns), 'dropped': len(zero_features),
+                     'valid': np.mean(valid_scores), 'time': time.perf_counter() - start})
+        if verbose:
+            print('round %(round)i: %(features)i features, %(dropped)i dropped, valid %(valid).4f, %(time).1f s'
+                  % rows[-1])
+
+    # the blocks are not used after the selection
+    prepared.pop('blocks', None)
+    return feature_importances, features, pd.DataFrame(rows, columns=['round', 'features', 'dropped', 'valid', 'time'])
+
+
+if __name__ == '__main__':
+    # e.g. python -m pipeline.selection data_3-4/train_SmallGlobalBase.csv --output selected_features.csv
+    parser = argparse.ArgumentParser(description='Feature reduction of notebook 4 on the full training set.')
+    parser.add_argument('data', help='csv file of the training data (SK_ID_CURR, TARGET and the features)')
+    parser.add_argument('--model', default=None, help='json parameters of the LGBMClassifier (model of notebook 4 by default)')
+    parser.add_argument('--sample', type=int, default=None, help='rows sampled from the data (all by default)')
+    parser.add_argument('--folds', type=int, default=5, help='folds of the cross-validation')
+    parser.add_argument('--block', type=int, default=BLOCK_SIZE, help='columns binned together')
+    parser.add_argument('--output', default='selected_features.csv', help='csv file of the kept features and importances')
+    parser.add_argument('--report', default=None, help='csv file of the rounds (time and features kept)')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data)
+    if args.sample is not None:
+        data = data.sample(n=args.sample, random_state=0).reset_index(drop=True)
+    model = MODEL if args.model is None else json.loads(args.model)
+    feature_importances, features, report = select_features(model, experiment.prepare_experiment(data, args.folds),
+                                                            block_size=args.block)
+    feature_importances.to_csv(args.output, index=False)
+    if args.report is not None:
+        report.to_csv(args.report, index=False)
+    print(report.to_string(index=False))
@@ -0,0 +1,292 @@
+# data retreiving
+import os
+import json
+import math
+import random
+import shutil
+import pathlib
+import argparse
+import itertools
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# data handling
+import numpy as np
+import pandas as pd
+
+# training of the folds (cached datasets)
+from pipeline import experiment
+
+#################### HYPERPARAMETERS SEARCH (random / grid search of notebook 3 on a pool of processes) ####################
+# 1) prepare the data once (see pipeline.experiment: median imputation and min-max scaling of run_experiment,
+#    KFold of the notebook) and write it as .npy files memory-mapped by every worker
+# 2) evaluate the parameter sets fold by fold on a pool of processes, LightGBM limited to a few threads each
+#    (each worker bins the data of a fold once, then reuses the dataset)
+# 3) successive halving: every set is evaluated on the first fold, only the best third on the next folds,
+#    and so on until the best sets are evaluated on all the folds
+# 4) write every fold result in a checkpoint file (one json line by fold): an interrupted search
+#    restarts from the folds already evaluated
+#
+# The parameter sets are drawn as in random_search (same seed, same sets) and the scores of a fold
+# do not depend on the process which computed it: the results do not depend on the number of jobs.
+
+# worker processes and LightGBM threads of each of them (all the cores by default)
+N_JOBS = os.cpu_count() or 1
+N_THREADS = 1
+
+# the best third of the parameter sets is evaluated on the next folds
+ETA = 3
+
+# random search space of notebook 3
+PARAM_GRID = {
+    'boosting_type': ['gbdt', 'goss', 'dart'],
+    'objective': ['binary'],
+    'num_leaves': list(np.arange(2, 51, 2)),
+    'n_estimators': list(np.arange(10, 101, 5)),
+    'learning_rate': list(np.logspace(np.log10(0.005), np.log10(0.5), base=10, num=1000).round(6)),
+    'reg_alpha': list(np.arange(0, 1.01, 0.02).round(3)),
+    'reg_lambda': list(np.arange(0, 1.01, 0.02).round(3)),
+    'subsample': list(np.arange(0.5, 1.001, 0.005).round(3)),
+    'colsample_bytree': list(np.arange(0.5, 1.01, 0.05).round(3)),
+    'is_unbalance': [True, False],
+    'random_state': [0]
+}
+
+# data memory-mapped by this process
+_loaded = dict()
+
+
+def to_builtin(value):
+    # Python value of a numpy scalar (json serialization of the parameters)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def sample_parameters(param_grid, max_evals, seed=0):
+    # Parameter sets of random_search (same draws for the same seed)
+    random.seed(seed)
+    trials = list()
+    for _ in range(max_evals):
+        hp = {k: random.sample(v, 1)[0] for k, v in param_grid.items()}
+        # subsample ratio accounting for the boosting type
+        hp['subsample'] = 1.0 if hp['boosting_type'] == 'goss' else hp['subsample']
+        trials.append({k: to_builtin(v) for k, v in hp.items()})
+    return trials
+
+
+def grid_parameters(param_grid):
+    # Parameter sets of grid_search (every combination)
+    keys, values = zip(*param_grid.items())
+    return [{k: to_builtin(v) for k, v in zip(keys, combination)} for combination in itertools.product(*values)]
+
+
+def prepare_data(data, folder, n_folds=5):
+    """
+    Preprocess the data of run_experiment once and write it for the workers.
+
+    Parameters
+    ----------
+    data : dataframe
+        The training data (with the SK_ID_CURR and TARGET columns).
+
+    folder : path
+        The folder of the arrays (features.npy, labels.npy, folds.npy).
+
+    n_folds : integer
+        The number of folds of the cross-validation.
+
+    """
+
+    folder = pathlib.Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    prepared = experiment.prepare_experiment(data, n_folds)
+
+    # fold of each row (validation rows of the KFold of the notebook)
+    folds = np.empty(len(prepared['labels']), dtype=np.int64)
+    for k, (_, valid_indices) in enumerate(prepared['folds']):
+        folds[valid_indices] = k
+
+    np.save(folder.joinpath('features.npy'), prepared['features'])
+    np.save(folder.joinpath('labels.npy'), prepared['labels'])
+    np.save(folder.joinpath('folds.npy'), folds)
+
+
+def load_data(folder):
+    # Experiment of the arrays written by prepare_data, memory-mapped on first use (once per process):
+    # the datasets of the folds are built once by worker, then reused by all its parameter sets
+    folder = str(folder)
+    if folder not in _loaded:
+        arrays = {name: np.load(pathlib.Path(folder).joinpath(name + '.npy'), mmap_mode='r')
+                  for name in ['features', 'labels', 'folds']}
+        folds = np.asarray(arrays['folds'])
+        _loaded[folder] = {'features': arrays['features'], 'labels': np.asarray(arrays['labels']),
+                           'feature_names': list(range(arrays['features'].shape[1])),
+                           'folds': [(np.flatnonzero(folds != k), np.flatnonzero(folds == k))
+                                     for k in range(folds.max() + 1)],
+                           'datasets': dict()}
+    return _loaded[folder]
+
+
+def evaluate_fold(folder, parameters, fold, n_threads=N_THREADS):
+    # Train and validation ROC AUC scores of a parameter set on a fold (one fold of run_experiment)
+    scores = experiment.train_fold(load_data(folder), dict(parameters, n_jobs=n_threads), fold)
+    return {'train': scores['train'], 'valid': scores['valid']}
+
+
+def fold_rungs(n_folds, eta=ETA):
+    # Numbers of folds of the successive halving rungs (1, eta, eta ** 2... then all the folds)
+    rungs, folds = list(), 1
+    while folds < n_folds:
+        rungs.append(folds)
+        folds *= eta
+    return rungs + [n_folds]
+
+
+def read_checkpoint(path, trials, n_folds):
+    # Fold results already written for these parameter sets and folds ({(trial, fold): scores})
+    scores = dict()
+    if path is None or not pathlib.Path(path).exists():
+        return scores
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # last line cut by an interruption
+                continue
+            if record['n_folds'] != n_folds or record['trial'] >= len(trials) \
+                    or record['parameters'] != trials[record['trial']]:
+                raise ValueError('The checkpoint %s was written for another search (trial %i)'
+                                 % (path, record['trial']))
+            scores[(record['trial'], record['fold'])] = {'train': record['train'], 'valid': record['valid']}
+    return scores
+
+
+def mean_scores(scores, trial, folds):
+    return {score: np.mean([scores[(trial, k)][score] for k in range(folds)]) for score in ['train', 'valid']}
+
+
+def halving_search(trials, data, n_folds=5, eta=ETA, n_jobs=N_JOBS, n_threads=N_THREADS, checkpoint=None,
+                   work_path=None):
+    """
+    Evaluate parameter sets with successive halving on the folds of a cross-validation.
+
+    Parameters
+    ----------
+    trials : list of dictionaries
+        The parameter sets of the LGBMClassifier (see sample_parameters and grid_parameters).
+
+    data : dataframe
+        The training data (with the SK_ID_CURR and TARGET columns).
+
+    n_folds : integer
+        The number of folds of the cross-validation.
+
+    eta : integer
+        The fraction (1 / eta) of the parameter sets evaluated on the next folds.
+        Every set is evaluated on all the folds if eta is 1.
+
+    n_jobs, n_threads : integers
+        The number of worker processes and the number of LightGBM threads of each of them.
+
+    checkpoint : path
+        The json lines file of the fold results (read first, then completed).
+
+    work_path : path
+        The folder of the temporary arrays (system temporary folder by default).
+
+    Return
+    ------
+    results : dataframe
+        As returned by random_search: overall 'train' and 'valid' scores (means over the
+        evaluated folds), their 'diff' and the 'parameters', with the number of 'folds'
+        evaluated (n_folds for the sets which went through all the rungs).
+
+    """
+
+    scores = read_checkpoint(checkpoint, trials, n_folds)
+    rungs = fold_rungs(n_folds, eta) if eta > 1 else [n_folds]
+    folder = pathlib.Path(tempfile.mkdtemp(prefix='tuning_', dir=work_path))
+    pool, log = None, None
+    try:
+        prepare_data(data, folder, n_folds)
+        if n_jobs > 1:
+            pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn'))
+        if checkpoint is not None:
+            log = open(checkpoint, 'a')
+            # a line cut by an interruption is ended before the next results
+            if log.tell() and not pathlib.Path(checkpoint).read_bytes().endswith(b'\n'):
+                log.write('\n')
+
+        alive, evaluated = list(range(len(trials))), dict()
+        for r, folds in enumerate(rungs):
+            # 1st step: the folds of the rung not evaluated yet (nor written in the checkpoint)
+            tasks = [(trial, k) for trial in alive for k in range(folds) if (trial, k) not in scores]
+            if pool is None:
+                done = ((task, evaluate_fold(folder, trials[task[0]], task[1], n_threads)) for task in tasks)
+            else:
+                futures = {pool.submit(evaluate_fold, folder, trials[trial], k, n_threads): (trial, k)
+                           for trial, k in tasks}
+                done = ((futures[future], future.result()) for future in as_completed(futures))
+            for (trial, k), fold_scores in done:
+                scores[(trial, k)] = fold_scores
+                if log is not None:
+                    log.write(json.dumps({'trial': trial, 'fold': k, 'n_folds': n_folds, 'parameters': trials[trial],
+                                          **fold_scores}) + '\n')
+                    log.flush()
+
+            # 2nd step: the best sets on these folds go to the next rung (ties broken by trial number)
+            for trial in alive:
+                evaluated[trial] = folds
+            if r < len(rungs) - 1:
+                ranked = sorted(alive, key=lambda trial: (-mean_scores(scores, trial, folds)['valid'], trial))
+                alive = sorted(ranked[:math.ceil(len(alive) / eta)])
+    finally:
+        if pool is not None:
+            # an interrupted search does not wait for the folds not started yet
+            pool.shutdown(cancel_futures=True)
+        if log is not None:
+            log.close()
+        # the arrays of the removed folder are released (the in-process folds memory-mapped them)
+        _loaded.pop(str(folder), None)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    rows = list()
+    for trial in range(len(trials)):
+        overall = mean_scores(scores, trial, evaluated[trial])
+        rows.append({'train': overall['train'], 'valid': overall['valid'], 'diff': overall['train'] - overall['valid'],
+                     'parameters': list(trials[trial].items()), 'folds': evaluated[trial]})
+    return pd.DataFrame(rows, columns=['train', 'valid', 'diff', 'parameters', 'folds'])
+
+
+def random_search(param_grid, data, max_evals, n_folds=5, **kwargs):
+    # Random search of notebook 3 on the pool, with successive halving (see halving_search)
+    return halving_search(sample_parameters(param_grid, max_evals), data, n_folds, **kwargs)
+
+
+def grid_search(param_grid, data, n_folds=5, **kwargs):
+    # Grid search of notebook 3 on the pool, with successive halving (see halving_search)
+    return halving_search(grid_parameters(param_grid), data, n_folds, **kwargs)
+
+
+if __name__ == '__main__':
+    # e.g. python -m pipeline.tuning data_3-4/train_SmallGlobalBase.csv --evals 1000 --checkpoint random_search.jsonl
+    parser = argparse.ArgumentParser(description='Random search of the LGBM hyperparameters of notebook 3.')
+    parser.add_argument('data', help='csv file of the training data (SK_ID_CURR, TARGET and the features)')
+    parser.add_argument('--evals', type=int, default=100, help='number of parameter sets')
+    parser.add_argument('--sample', type=int, default=None, help='rows sampled from the data (all by default)')
+    parser.add_argument('--folds', type=int, default=5, help='folds of the cross-validation')
+    parser.add_argument('--eta', type=int, default=ETA, help='1 / fraction of the sets kept at each rung (1: no pruning)')
+    parser.add_argument('--jobs', type=int, default=N_JOBS, help='worker processes')
+    parser.add_argument('--threads', type=int, default=N_THREADS, help='LightGBM threads of each worker')
+    parser.add_argument('--checkpoint', default=None, help='json lines file of the fold results (resumed if it exists)')
+    parser.add_argument('--output', default='random_search.csv', help='csv file of the results')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data)
+    if args.sample is not None:
+        data = data.sample(n=args.sample, random_state=0).reset_index(drop=True)
+    results = random_search(PARAM_GRID, data, args.evals, args.folds, eta=args.eta, n_jobs=args.jobs,
+                            n_threads=args.threads, checkpoint=args.checkpoint)
+    results.to_csv(args.output, index=False)
+    print(results[results['folds'] == args.folds].sort_values(by='valid', ascending=False).head(10))
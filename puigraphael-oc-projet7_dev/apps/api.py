@@ -0,0 +1,214 @@
+# Flask environment
+import flask
+
+# data retreiving
+import io
+import os
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# Arrow bodies are optional (pyarrow is not a requirement of the app)
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+# modeling (the artifact of the predictor page), csv parsing and metrics of the scoring
+from apps import artifact, ingest, predictor, metrics
+
+# connect to main app.py file
+from app import server
+
+#################### SCORING API (REST endpoints on the Flask server of the app) ####################
+# 1) read the body of a request (json, csv or arrow) into a float32 buffer of the model's features
+# 2) score it with the loaded artifact and attach the risk bands of the predictor's table
+# 3) routes: /api/v1/score (one client) and /api/v1/score/batch (several clients)
+#
+# Every feature of the model must be given (a null value or an empty csv cell is a missing value, sent
+# to the model as nan): a request without some of them is refused with a 400 listing their names.
+# Unknown fields are not scored and listed in the 'unknown_fields' of the response. A request is scored
+# by the artifact live when it arrives, and its version is in the response (a new model may go live
+# meanwhile, see registry.py).
+
+# upper bounds of the risk bands (same colors as the predictor's table)
+RISK_BANDS = [(0.33, 'low'), (0.66, 'medium'), (np.inf, 'high')]
+
+# maximal number of clients in a batch
+MAX_BATCH_ROWS = int(os.environ.get('API_MAX_BATCH_ROWS', 100000))
+
+ARROW_TYPES = ('application/vnd.apache.arrow.stream', 'application/vnd.apache.arrow.file')
+
+# fields of a request that are not features of the model
+ID_FIELD = 'SK_ID_CURR'
+
+
+class ApiError(Exception):
+    # Error returned to the caller as {'error': message, **details} with an http status
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def risk_band(probabilities):
+    # Risk band of each probability
+    bounds = np.array([bound for bound, _ in RISK_BANDS])
+    names = np.array([name for _, name in RISK_BANDS])
+    return names[np.searchsorted(bounds, probabilities, side='right')]
+
+
+def check_fields(fields, loaded_artifact, where=''):
+    # Refuse the fields without some features of the model, return the unknown ones (sorted)
+    missing = [f for f in loaded_artifact['feature_names'] if f not in fields]
+    if missing:
+        raise ApiError('Missing features%s: %s.' % (where, ', '.join(missing)), missing_features=missing)
+    return sorted(set(fields) - set(loaded_artifact['feature_names']) - {ID_FIELD})
+
+
+def records_buffer(records, loaded_artifact):
+    """
+    float32 buffer of the model's features from a list of json objects.
+
+    Parameters
+    ----------
+    records : list of dictionaries
+        The clients, with every feature of the model (null for a missing value).
+
+    loaded_artifact : dictionary
+        See artifact.load_artifact.
+
+    Return
+    ------
+    X : array of floats
+        The features of the clients, in the order of the model.
+
+    ids : list
+        The SK_ID_CURR of the clients (None if not given).
+
+    unknown : list of strings
+        The fields of the records that are neither features nor SK_ID_CURR (not scored).
+
+    """
+
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ApiError('Expected a json object or a list of json objects.')
+    features = loaded_artifact['feature_names']
+    unknown = set()
+    for i, record in enumerate(records):
+        unknown.update(check_fields(record, loaded_artifact, ' (client %i)' % i if len(records) > 1 else ''))
+    try:
+        X = np.array([[record[f] for f in features] for record in records], dtype=np.float32)
+    except (TypeError, ValueError):
+        raise ApiError('Feature values must be numbers or null.')
+    ids = [record.get(ID_FIELD) for record in records]
+    return X.reshape(len(records), len(features)), ids, sorted(unknown)
+
+
+def frame_buffer(df, loaded_artifact, unknown=None):
+    # float32 buffer of the model's features from a dataframe (same return as records_buffer;
+    # unknown columns already dropped while reading can be given)
+    found = check_fields(df.columns, loaded_artifact)
+    ids = df[ID_FIELD].tolist() if ID_FIELD in df.columns else [None] * len(df)
+    try:
+        X = artifact.features_buffer(loaded_artifact, df)
+    except (TypeError, ValueError):
+        raise ApiError('Feature values must be numbers.')
+    return X, ids, sorted(set(found) | set(unknown or ()))
+
+
+def request_buffer(request, loaded_artifact):
+    # Features, ids and unknown fields of the clients in the body of the request
+    content_type = request.mimetype
+
+    if content_type == 'application/json':
+        body = request.get_json(silent=True)
+        if body is None:
+            raise ApiError('Invalid json body.')
+        if isinstance(body, dict):
+            body = body.get('records', [body])
+        return records_buffer(body, loaded_artifact)
+
+    if content_type == 'text/csv':
+        wanted = set(loaded_artifact['feature_names']) | {ID_FIELD}
+        # the other columns are not parsed, only reported
+        unknown = set()
+        def use_column(col):
+            if col in wanted:
+                return True
+            unknown.add(col)
+            return False
+        try:
+            df = pd.read_csv(io.BytesIO(request.get_data()), usecols=use_column,
+                             dtype=ingest.column_dtypes(wanted))
+        except (ValueError, pd.errors.ParserError) as e:
+            raise ApiError('Invalid csv body: %s' % e)
+        return frame_buffer(df, loaded_artifact, unknown)
+
+    if content_type in ARROW_TYPES:
+        if pyarrow is None:
+            raise ApiError('Arrow bodies are not supported by this server.', 415)
+        try:
+            source = pyarrow.BufferReader(request.get_data())
+            reader = pyarrow.ipc.open_stream(source) if content_type == ARROW_TYPES[0] else pyarrow.ipc.open_file(source)
+            df = reader.read_all().to_pandas()
+        except pyarrow.ArrowException as e:
+            raise ApiError('Invalid arrow body: %s' % e)
+        return frame_buffer(df, loaded_artifact)
+
+    raise ApiError('Unsupported content type: %s' % content_type, 415)
+
+
+def score_buffer(X, loaded_artifact):
+    # Probabilities and risk bands of a float32 buffer
+    start = time.perf_counter()
+    with metrics.timer('predict'):
+        probabilities = loaded_artifact['booster'].predict(X) if len(X) else np.empty(0)
+    metrics.scored(len(X), time.perf_counter() - start, source='api')
+    return probabilities, risk_band(probabilities)
+
+
+def clean_id(client_id):
+    # Ids as integers in the responses (None for missing or invalid ids)
+    try:
+        return int(client_id)
+    except (TypeError, ValueError):
+        return None
+
+
+@server.errorhandler(ApiError)
+def api_error(error):
+    return flask.jsonify({'error': str(error), **error.details}), error.status
+
+
+@server.route('/api/v1/score', methods=['POST'])
+def score():
+    # Score a single client
+    loaded_artifact = predictor.get_artifact()
+    X, ids, unknown = request_buffer(flask.request, loaded_artifact)
+    if len(X) != 1:
+        raise ApiError('Expected a single client, use /api/v1/score/batch for several clients.')
+    probabilities, bands = score_buffer(X, loaded_artifact)
+    return flask.jsonify({'model_version': loaded_artifact['version'],
+                          'SK_ID_CURR': clean_id(ids[0]),
+                          'probability': float(probabilities[0]),
+                          'risk_band': str(bands[0]),
+                          'unknown_fields': unknown})
+
+
+@server.route('/api/v1/score/batch', methods=['POST'])
+def score_batch():
+    # Score several clients (results in the order of the body, as columns)
+    loaded_artifact = predictor.get_artifact()
+    X, ids, unknown = request_buffer(flask.request, loaded_artifact)
+    if len(X) > MAX_BATCH_ROWS:
+        raise ApiError('Too many clients in the batch (at most %i).' % MAX_BATCH_ROWS, 413)
+    probabilities, bands = score_buffer(X, loaded_artifact)
+    return flask.jsonify({'model_version': loaded_artifact['version'],
+                          'SK_ID_CURR': [clean_id(i) for i in ids],
+                          'probability': probabilities.tolist(),
+                          'risk_band': bands.tolist(),
+                          'unknown_fields': unknown})
@@ -0,0 +1,214 @@
+# data retreiving
+import pathlib
+import argparse
+import hashlib
+import re
+import pickle
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# modeling
+import lightgbm
+
+# timing of the scoring stages
+from apps import metrics
+
+#################### FUSED PREDICTOR ARTIFACT (imputer + scaler + model) ####################
+# 1) fold the median imputation and the min-max scaling into the trees of the booster
+# 2) save / load the folded booster with the feature names as a single versioned .npz file
+# 3) predict payback failure probabilities from raw (unimputed, unscaled) features
+#
+# The scaler maps x to x*scale + min, so a split 'x*scale + min <= t' is the split
+# 'x <= (t - min)/scale' on raw values. The imputer only replaces nan values by the
+# median, so nan values just have to follow the branch the median would have taken.
+# The resulting booster scores a raw float32 buffer without any preprocessing pass.
+
+# version of the file layout (not of the model, see 'version' in the artifact)
+FORMAT_VERSION = 1
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../datasets').resolve()
+ARTIFACT_PATH = DATA_PATH.joinpath('payback_predictor.npz')
+
+# LightGBM decision_type bits (numerical splits only)
+DEFAULT_LEFT_MASK = 2
+MISSING_NAN = 2 << 2
+
+# lines of the text model used for scoring (the other ones, e.g. the LightGBM version, the gains or
+# the counts, do not change the predictions), and the ones holding floats
+SCORING_KEYS = ['num_class', 'num_tree_per_iteration', 'objective', 'Tree', 'num_leaves', 'split_feature',
+                'threshold', 'decision_type', 'left_child', 'right_child', 'leaf_value']
+FLOAT_KEYS = ['threshold', 'leaf_value']
+
+
+def fold_model_string(model_string, fill, scale, offset):
+    """
+    Rewrite a LightGBM text model trained on imputed and min-max scaled data
+    into an equivalent model working on the raw data (nan values included).
+
+    Parameters
+    ----------
+    model_string : string
+        The booster dumped as text (Booster.model_to_string).
+
+    fill, scale, offset : arrays of floats
+        Per feature median (imputer.statistics_), scale_ and min_ of the scaler.
+
+    Return
+    ------
+    folded : string
+        The text model with raw thresholds and nan values sent to the median's branch.
+
+    """
+
+    lines = model_string.splitlines()
+    split_feature = list()
+
+    for i, line in enumerate(lines):
+        key, _, value = line.partition('=')
+
+        if key == 'Tree':
+            split_feature = list()
+
+        elif key == 'split_feature':
+            split_feature = [int(f) for f in value.split()]
+
+        elif key == 'threshold' and split_feature:
+            thresholds = [float(t) for t in value.split()]
+            raw = [float((t - offset[f]) / scale[f]) for f, t in zip(split_feature, thresholds)]
+            lines[i] = 'threshold=' + ' '.join(repr(t) for t in raw)
+            # remember the scaled thresholds for the decision types below
+            scaled_thresholds = thresholds
+
+        elif key == 'decision_type' and split_feature:
+            decision_types = list()
+            for f, t, d in zip(split_feature, scaled_thresholds, value.split()):
+                if int(d) & 1:
+                    raise ValueError('Categorical splits cannot be folded.')
+                # nan values go where the (scaled) median would have gone
+                default_left = DEFAULT_LEFT_MASK if fill[f] * scale[f] + offset[f] <= t else 0
+                decision_types.append(str(MISSING_NAN | default_left))
+            lines[i] = 'decision_type=' + ' '.join(decision_types)
+
+        elif key == 'feature_infos':
+            infos = list()
+            for f, info in enumerate(value.split()):
+                if info.startswith('['):
+                    low, high = (float(v) for v in info[1:-1].split(':'))
+                    info = '[%r:%r]' % (float((low - offset[f]) / scale[f]), float((high - offset[f]) / scale[f]))
+                infos.append(info)
+            lines[i] = 'feature_infos=' + ' '.join(infos)
+
+    return update_tree_sizes('\n'.join(lines) + '\n')
+
+
+def update_tree_sizes(model_string):
+    # The header lists the size (in bytes) of every tree block: recompute it after edition
+    starts = [match.start() for match in re.finditer('^Tree=', model_string, flags=re.MULTILINE)]
+    starts.append(model_string.index('end of trees'))
+    sizes = [len(model_string[a:b].encode('utf-8')) for a, b in zip(starts[:-1], starts[1:])]
+
+    lines = model_string.split('\n')
+    for i, line in enumerate(lines):
+        if line.startswith('tree_sizes='):
+            lines[i] = 'tree_sizes=' + ' '.join(str(size) for size in sizes)
+            break
+    return '\n'.join(lines)
+
+
+def model_version(model_string, feature_names):
+    # The model version is a digest of everything used for scoring: the feature names and the folded
+    # trees (thresholds, decision types, children and leaf values, floats written back with repr),
+    # so that the same model gives the same version whatever the LightGBM version that dumped it
+    digest = hashlib.sha256('\n'.join(feature_names).encode('utf-8'))
+    for line in model_string.splitlines():
+        key, _, value = line.partition('=')
+        if key in SCORING_KEYS:
+            if key in FLOAT_KEYS:
+                value = ' '.join(repr(float(v)) for v in value.split())
+            digest.update(('\n%s=%s' % (key, value)).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def build_artifact(model, imputer, scaler, feature_names):
+    # Fold the imputer and the scaler into the booster of the model
+    model_string = fold_model_string(model.booster_.model_to_string(),
+                                     np.asarray(imputer.statistics_, dtype=np.float64),
+                                     np.asarray(scaler.scale_, dtype=np.float64),
+                                     np.asarray(scaler.min_, dtype=np.float64))
+
+    return {'format_version': FORMAT_VERSION,
+            'version': model_version(model_string, feature_names),
+            'model_string': model_string,
+            'feature_names': list(feature_names)}
+
+
+def save_artifact(artifact, path=ARTIFACT_PATH):
+    # Write in a temporary file first so that a reader never sees a partial file
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f,
+                            format_version=np.array(artifact['format_version']),
+                            version=np.array(artifact['version']),
+                            model_string=np.array(artifact['model_string']),
+                            feature_names=np.array(artifact['feature_names']))
+    tmp_path.replace(path)
+
+
+def load_artifact(path=ARTIFACT_PATH):
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['format_version']) != FORMAT_VERSION:
+            raise ValueError('Unsupported artifact format: %s' % data['format_version'])
+        artifact = {'format_version': FORMAT_VERSION,
+                    'version': str(data['version']),
+                    'model_string': str(data['model_string']),
+                    'feature_names': [str(name) for name in data['feature_names']]}
+    artifact['booster'] = lightgbm.Booster(model_str=artifact['model_string'])
+    return artifact
+
+
+def features_buffer(artifact, df):
+    # Select the model's features (in the training order) into a single float32 buffer
+    # (the only preprocessing left: the imputation and the scaling are folded into the trees)
+    with metrics.timer('features'):
+        return np.ascontiguousarray(df[artifact['feature_names']].to_numpy(dtype=np.float32))
+
+
+def predict(artifact, df):
+    # Payback failure probabilities of every row of the dataframe (raw features)
+    X = features_buffer(artifact, df)
+    with metrics.timer('predict'):
+        return artifact['booster'].predict(X)
+
+
+def build_from_pickles(data_path=DATA_PATH, sample_path=None):
+    # Load model, imputer and scaler as saved by the final modeling notebook
+    model = pickle.load(open(pathlib.Path(data_path).joinpath('payback_predictor.pickle.dat'), 'rb'))
+    imputer = pickle.load(open(pathlib.Path(data_path).joinpath('imputer.pickle.dat'), 'rb'))
+    scaler = pickle.load(open(pathlib.Path(data_path).joinpath('scaler.pickle.dat'), 'rb'))
+
+    # The pickled objects were fitted on numpy arrays: take the feature names from a data sample
+    header = pd.read_csv(sample_path, nrows=0).columns
+    feature_names = [col for col in header if col not in ('SK_ID_CURR', 'TARGET')]
+    if len(feature_names) != scaler.scale_.shape[0]:
+        raise ValueError('The sample has %i features, the scaler expects %i.'
+                         % (len(feature_names), scaler.scale_.shape[0]))
+
+    return build_artifact(model, imputer, scaler, feature_names)
+
+
+if __name__ == '__main__':
+    # e.g. python -m apps.artifact --sample ../app_samples/global_extract_10.csv
+    parser = argparse.ArgumentParser(description='Build the fused predictor artifact from the pickles.')
+    parser.add_argument('--data', default=str(DATA_PATH), help='folder with the three pickles')
+    parser.add_argument('--sample', required=True, help='csv file with the training columns (header)')
+    parser.add_argument('--out', default=str(ARTIFACT_PATH))
+    args = parser.parse_args()
+
+    artifact = build_from_pickles(args.data, args.sample)
+    save_artifact(artifact, args.out)
+    print('artifact %s written to %s' % (artifact['version'], args.out))
@@ -0,0 +1,146 @@
+# data retreiving
+import os
+import pathlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+# data handling
+import pandas as pd
+
+#################### RESULT CACHE (scored uploads indexed by content and model version) ####################
+# 1) key an upload by a hash of its content, its format, the version of the predictor artifact and the
+#    fingerprint of the extracts its percentiles are ranked against
+# 2) keep the scored tables in memory, evicting the least recently used ones beyond a size limit
+# 3) optionally keep them on disk too (shared by all the workers, also bounded in size)
+#
+# A new artifact has a new version and new extracts a new fingerprint, so the results of the previous
+# model or of the previous population are never returned.
+
+# bounds of the memory tier and of the disk tier (in bytes)
+MEMORY_MAX_BYTES = int(os.environ.get('CACHE_MEMORY_BYTES', 64 * 2**20))
+DISK_MAX_BYTES = int(os.environ.get('CACHE_DISK_BYTES', 1024 * 2**20))
+
+# folder of the disk tier (no disk tier if not set)
+CACHE_PATH = os.environ.get('CACHE_PATH')
+
+# characters of the upload hashed at once
+BLOCK_SIZE = 1 << 20
+
+# memory tier: key -> (table, size), the most recently used last
+_memory = OrderedDict()
+_memory_bytes = 0
+_lock = threading.Lock()
+
+
+def upload_key(contents, filename, version, data_key=''):
+    """
+    Cache key of an uploaded file.
+
+    Parameters
+    ----------
+    contents : string
+        The content of the upload, as given by dcc.Upload.
+
+    filename : string
+        The name of the uploaded file (only its format is part of the key).
+
+    version : string
+        The version of the predictor artifact.
+
+    data_key : string
+        The fingerprint of the data the results depend on besides the model
+        (the PERCENTILE columns, see percentiles.index_key).
+
+    Return
+    ------
+    key : string
+        Hexadecimal sha256 digest.
+
+    """
+
+    digest = hashlib.sha256()
+    digest.update(version.encode('utf-8') + b'\0')
+    digest.update(data_key.encode('utf-8') + b'\0')
+    digest.update(filename.rsplit('.', 1)[-1].lower().encode('utf-8') + b'\0')
+    # the base64 text is a canonical encoding of the file's bytes: hash it as it is
+    start = contents.index(',') + 1
+    for i in range(start, len(contents), BLOCK_SIZE):
+        digest.update(contents[i:i + BLOCK_SIZE].encode('ascii'))
+    return digest.hexdigest()
+
+
+def table_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def disk_path(key):
+    return pathlib.Path(CACHE_PATH).joinpath(key + '.pkl')
+
+
+def put_memory(key, df):
+    # Insert a table and evict the least recently used ones beyond the size limit
+    global _memory_bytes
+    size = table_size(df)
+    if size > MEMORY_MAX_BYTES:
+        return
+    with _lock:
+        if key in _memory:
+            _memory_bytes -= _memory.pop(key)[1]
+        _memory[key] = (df, size)
+        _memory_bytes += size
+        while _memory_bytes > MEMORY_MAX_BYTES:
+            _memory_bytes -= _memory.popitem(last=False)[1][1]
+
+
+def put_disk(key, df):
+    # Write the table (atomically) and remove the oldest tables beyond the size limit
+    path = disk_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name('%s.%i.tmp' % (path.name, os.getpid()))
+    df.to_pickle(tmp_path)
+    tmp_path.replace(path)
+
+    files = sorted(path.parent.glob('*.pkl'), key=lambda f: f.stat().st_mtime)
+    total = sum(f.stat().st_size for f in files)
+    for f in files[:-1]:
+        if total <= DISK_MAX_BYTES:
+            break
+        total -= f.stat().st_size
+        f.unlink(missing_ok=True)
+
+
+def get(key):
+    # Scored table of a key (None if not cached), from memory first then from disk
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key][0]
+
+    if CACHE_PATH is not None:
+        path = disk_path(key)
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)
+        except (OSError, EOFError, ValueError):
+            return None
+        put_memory(key, df)
+        return df
+
+    return None
+
+
+def put(key, df):
+    put_memory(key, df)
+    if CACHE_PATH is not None:
+        try:
+            put_disk(key, df)
+        except OSError:
+            pass
+
+
+def clear():
+    global _memory_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
@@ -0,0 +1,52 @@
+# data handling
+import numpy as np
+
+#################### CLIENT STORE (clients of the database indexed by SK_ID_CURR) ####################
+# 1) build the store once: sorted ids and the matching rows of the displayed fields
+# 2) fetch all the displayed fields of a client with a single binary search
+# 3) search the clients whose id starts with the typed characters (sorted id strings)
+
+
+def build_client_store(df, columns, id_column='SK_ID_CURR'):
+    # Sort the clients by id (ids are stored as float32 in the extracts)
+    ids = df[id_column].to_numpy().astype(np.int64)
+    order = np.argsort(ids, kind='stable')
+
+    return {'ids': ids[order],
+            'columns': list(columns),
+            'values': df[list(columns)].to_numpy()[order]}
+
+
+def client_row(store, client_id):
+    # Position of the client in the store (None if unknown)
+    ids = store['ids']
+    i = int(np.searchsorted(ids, int(client_id)))
+    if i == len(ids) or ids[i] != int(client_id):
+        return None
+    return i
+
+
+def lookup_client(store, client_id):
+    # All the fields of a client as a dictionary of python floats (None if unknown)
+    i = client_row(store, client_id)
+    if i is None:
+        return None
+    return dict(zip(store['columns'], store['values'][i].tolist()))
+
+
+def build_search_index(ids):
+    # Ids as sorted strings: the ids starting with a prefix are contiguous
+    return np.sort(np.asarray(ids, dtype=np.int64).astype(str))
+
+
+def search_clients(search_index, prefix, limit=20):
+    # First ids (in lexicographic order) starting with the prefix
+    prefix = str(prefix).strip()
+    start = int(np.searchsorted(search_index, prefix))
+    candidates = search_index[start:start + limit]
+    return [int(i) for i in candidates[np.char.startswith(candidates, prefix)]]
+
+
+def client_options(client_ids):
+    # Dropdown options of a few clients
+    return [{'label': str(i), 'value': i} for i in client_ids]
@@ -0,0 +1,174 @@
+# data retreiving
+import os
+import json
+import shutil
+import pathlib
+import argparse
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# fingerprint of the source files
+from apps import store
+
+#################### COLUMNAR DATASETS (csv extracts converted to one .npy file per column) ####################
+# 1) convert a csv extract chunk by chunk into a folder with one binary file per column
+# 2) load only the needed columns, memory-mapped (no text parsing)
+# 3) read a dataset from its columnar folder if it is up to date, from the csv file otherwise
+#
+# The csv files stay the reference: a columnar folder records the fingerprint of the csv
+# it was converted from and is ignored once the csv changes.
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../datasets').resolve()
+
+# extracts of the dashboard
+DATASETS = ['train_extract', 'global_general_extract']
+
+MANIFEST_FILE = 'columns.json'
+CHUNK_SIZE = 100000
+
+# types of the stored columns (ids as exact integers, float32 otherwise)
+ID_COLUMN = 'SK_ID_CURR'
+
+
+def columns_path(data_path, name):
+    return pathlib.Path(data_path).joinpath(name + '.columns')
+
+
+def csv_path(data_path, name):
+    return pathlib.Path(data_path).joinpath(name + '.csv')
+
+
+def convert_csv(source, folder, chunk_size=CHUNK_SIZE):
+    """
+    Convert a csv file into a folder of .npy column files.
+
+    Parameters
+    ----------
+    source : path
+        The csv file (all its columns must be numeric).
+
+    folder : path
+        The columnar folder to create (replaced if it exists).
+
+    chunk_size : integer
+        The number of rows parsed at once.
+
+    Return
+    ------
+    manifest : dictionary
+        Columns, types, number of rows and fingerprint of the source.
+
+    """
+
+    folder = pathlib.Path(folder)
+    tmp_folder = folder.with_name('%s.%i.tmp' % (folder.name, os.getpid()))
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    tmp_folder.mkdir(parents=True)
+
+    # 1st step: append the raw values of each chunk to one file per column
+    raw_files, dtypes, rows = dict(), dict(), 0
+    for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=np.float64):
+        for col in chunk.columns:
+            values = chunk[col].to_numpy()
+            if col not in raw_files:
+                # ids as integers when they are all known, float32 otherwise
+                dtypes[col] = np.int64 if col == ID_COLUMN and not np.isnan(values).any() else np.float32
+                raw_files[col] = open(tmp_folder.joinpath(col + '.raw'), 'wb')
+            raw_files[col].write(values.astype(dtypes[col]).tobytes())
+        rows += len(chunk)
+
+    # 2nd step: prepend the .npy header (the number of rows is known now)
+    for col, raw_file in raw_files.items():
+        raw_file.close()
+        raw_path = tmp_folder.joinpath(col + '.raw')
+        with open(tmp_folder.joinpath(col + '.npy'), 'wb') as f, open(raw_path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtypes[col])),
+                                                     'fortran_order': False, 'shape': (rows,)})
+            shutil.copyfileobj(raw, f, 1 << 20)
+        raw_path.unlink()
+
+    manifest = {'columns': list(raw_files),
+                'dtypes': {col: np.dtype(dtype).str for col, dtype in dtypes.items()},
+                'rows': rows,
+                'source': store.sources_key([source])}
+    with open(tmp_folder.joinpath(MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+    # replace the previous version at once
+    shutil.rmtree(folder, ignore_errors=True)
+    tmp_folder.rename(folder)
+    return manifest
+
+
+def read_manifest(folder):
+    with open(pathlib.Path(folder).joinpath(MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def load_columns(folder, columns=None, mmap_mode='r'):
+    # Columns of a columnar folder as a dictionary of (memory-mapped) arrays
+    folder = pathlib.Path(folder)
+    if columns is None:
+        columns = read_manifest(folder)['columns']
+    return {col: np.load(folder.joinpath(col + '.npy'), mmap_mode=mmap_mode) for col in columns}
+
+
+def is_up_to_date(data_path, name):
+    # A columnar folder is used if it was converted from the current csv (or if there is no csv)
+    folder = columns_path(data_path, name)
+    if not folder.joinpath(MANIFEST_FILE).exists():
+        return False
+    source = csv_path(data_path, name)
+    return not source.exists() or read_manifest(folder)['source'] == store.sources_key([source])
+
+
+def dataset_sources(data_path, name):
+    # Files a dataset is read from (to detect its changes): the csv, or the columnar folder alone
+    source = csv_path(data_path, name)
+    return [source] if source.exists() else [columns_path(data_path, name).joinpath(MANIFEST_FILE)]
+
+
+def read_dataset(data_path, name, columns):
+    """
+    Load some columns of an extract, from its columnar folder when possible.
+
+    Parameters
+    ----------
+    data_path : path
+        The folder of the extracts.
+
+    name : string
+        The name of the extract (without extension).
+
+    columns : list of strings
+        The columns to load (projection).
+
+    Return
+    ------
+    df : dataframe
+        The requested columns (features as float32).
+
+    """
+
+    if is_up_to_date(data_path, name):
+        return pd.DataFrame(load_columns(columns_path(data_path, name), columns), columns=columns)
+
+    dtypes = {col: np.float32 for col in columns}
+    return pd.read_csv(csv_path(data_path, name), usecols=columns, dtype=dtypes)[columns]
+
+
+if __name__ == '__main__':
+    # e.g. python -m apps.columnar
+    parser = argparse.ArgumentParser(description='Convert the csv extracts of the dashboard to columnar folders.')
+    parser.add_argument('names', nargs='*', default=DATASETS, help='extracts to convert (without extension)')
+    parser.add_argument('--data', default=str(DATA_PATH), help='folder of the extracts')
+    args = parser.parse_args()
+
+    for name in args.names:
+        manifest = convert_csv(csv_path(args.data, name), columns_path(args.data, name))
+        print('%s: %i rows, %i columns written to %s' % (name, manifest['rows'], len(manifest['columns']),
+                                                         columns_path(args.data, name)))
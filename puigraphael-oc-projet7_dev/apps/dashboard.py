@@ -1,166 +1,127 @@
 # Dash environment
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 # data retreiving
 import pathlib
+import json
 
 # data handling
-import pandas as pd
 import numpy as np
-from scipy import stats
 
 # plotting
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+# clients lookup, KDE curves, shared arrays, columnar extracts, precomputed drivers of the predictions
+# percentile ranks, metrics and live model version
+from apps import clients, kde, store, columnar, explain, percentiles, metrics, registry
+
 # connect to main app.py file
 from app import app
 
 
 ################## DASHBOARD (clients of the database) ##################
-# 1) compute all KDE plots
-# 2) app's layout with main features values table and created plots
-# 3) callback with main features values retrieving and creation of plots
+# 1) index the clients by id and load all KDE plots (on first use, arrays shared by the workers, loaded
+#    again when a new model and its extract are published)
+# 2) base figure with the KDE plots, built once
+# 3) app's layout with the client search, main features values and percentiles table, main drivers of
+#    the prediction and the base figure
+# 4) callback with main features values, percentiles and drivers retrieving, client's lines drawn in the browser
 
 # get relative data folder
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath('../datasets').resolve()
 
-# load databases from datasets folder
-train_df = pd.read_csv(DATA_PATH.joinpath('train_extract.csv'), dtype=np.float32) # for KDE plots
-global_df = pd.read_csv(DATA_PATH.joinpath('global_general_extract.csv'), dtype=np.float32) # clients data
-
-# list of clients' ID
-available_clients = global_df['SK_ID_CURR']
-
-### EXT_SOURCE_3 KDE
-xmin_ES3 = train_df['EXT_SOURCE_3'].min()
-xmax_ES3 = train_df['EXT_SOURCE_3'].max()
-X_ES3 = np.linspace(xmin_ES3, xmax_ES3, 100)
-
-values_ES3_0 = train_df[train_df['TARGET']==0]['EXT_SOURCE_3'].dropna()
-values_ES3_1 = train_df[train_df['TARGET']==1]['EXT_SOURCE_3'].dropna()
-
-kernel_ES3_0 = stats.gaussian_kde(values_ES3_0, bw_method='scott')
-kernel_ES3_1 = stats.gaussian_kde(values_ES3_1, bw_method='scott')
-
-Z_ES3_0 = np.reshape(kernel_ES3_0(X_ES3).T, X_ES3.shape)
-Z_ES3_1 = np.reshape(kernel_ES3_1(X_ES3).T, X_ES3.shape)
-
-### EXT_SOURCE_2 KDE
-xmin_ES2 = train_df['EXT_SOURCE_2'].min()
-xmax_ES2 = train_df['EXT_SOURCE_2'].max()
-X_ES2 = np.linspace(xmin_ES2, xmax_ES2, 100)
-
-values_ES2_0 = train_df[train_df['TARGET']==0]['EXT_SOURCE_2'].dropna()
-values_ES2_1 = train_df[train_df['TARGET']==1]['EXT_SOURCE_2'].dropna()
-
-kernel_ES2_0 = stats.gaussian_kde(values_ES2_0, bw_method='scott')
-kernel_ES2_1 = stats.gaussian_kde(values_ES2_1, bw_method='scott')
-
-Z_ES2_0 = np.reshape(kernel_ES2_0(X_ES2).T, X_ES2.shape)
-Z_ES2_1 = np.reshape(kernel_ES2_1(X_ES2).T, X_ES2.shape)
-
-### EXT_SOURCE_1 KDE
-xmin_ES1 = train_df['EXT_SOURCE_1'].min()
-xmax_ES1 = train_df['EXT_SOURCE_1'].max()
-X_ES1 = np.linspace(xmin_ES1, xmax_ES1, 100)
-
-values_ES1_0 = train_df[train_df['TARGET']==0]['EXT_SOURCE_1'].dropna()
-values_ES1_1 = train_df[train_df['TARGET']==1]['EXT_SOURCE_1'].dropna()
-
-kernel_ES1_0 = stats.gaussian_kde(values_ES1_0, bw_method='scott')
-kernel_ES1_1 = stats.gaussian_kde(values_ES1_1, bw_method='scott')
-
-Z_ES1_0 = np.reshape(kernel_ES1_0(X_ES1).T, X_ES1.shape)
-Z_ES1_1 = np.reshape(kernel_ES1_1(X_ES1).T, X_ES1.shape)
-
-### Age KDE
-xmin_age = (train_df['DAYS_BIRTH']/-365).min()
-xmax_age = (train_df['DAYS_BIRTH']/-365).max()
-X_age = np.linspace(xmin_age, xmax_age, 100)
-
-values_age_0 = (train_df[train_df['TARGET']==0]['DAYS_BIRTH']/-365).dropna()
-values_age_1 = (train_df[train_df['TARGET']==1]['DAYS_BIRTH']/-365).dropna()
-
-kernel_age_0 = stats.gaussian_kde(values_age_0, bw_method='scott')
-kernel_age_1 = stats.gaussian_kde(values_age_1, bw_method='scott')
-
-Z_age_0 = np.reshape(kernel_age_0(X_age).T, X_age.shape)
-Z_age_1 = np.reshape(kernel_age_1(X_age).T, X_age.shape)
-
-### AMT_CREDIT KDE
-xmin_AMT = train_df['AMT_CREDIT'].min()
-xmax_AMT = train_df['AMT_CREDIT'].max()
-X_AMT = np.linspace(xmin_AMT, xmax_AMT, 100)
-
-values_AMT_0 = train_df[train_df['TARGET']==0]['AMT_CREDIT'].dropna()
-values_AMT_1 = train_df[train_df['TARGET']==1]['AMT_CREDIT'].dropna()
-
-kernel_AMT_0 = stats.gaussian_kde(values_AMT_0, bw_method='scott')
-kernel_AMT_1 = stats.gaussian_kde(values_AMT_1, bw_method='scott')
-
-Z_AMT_0 = np.reshape(kernel_AMT_0(X_AMT).T, X_AMT.shape)
-Z_AMT_1 = np.reshape(kernel_AMT_1(X_AMT).T, X_AMT.shape)
-
-### predictions KDE
-xmin_pred = global_df['PREDICTION'].min()
-xmax_pred = global_df['PREDICTION'].max()
-X_pred = np.linspace(xmin_pred, xmax_pred, 100)
-
-values_pred = global_df['PREDICTION']
-kernel_pred = stats.gaussian_kde(values_pred, bw_method='scott')
-Z_pred = np.reshape(kernel_pred(X_pred).T, X_pred.shape)
-
-layout = html.Div([
-
-        html.Div(
-            dcc.Link('◄ Back to home page', href='/'),
-            style={'textAlign': 'right'},
-        ),
-
-    html.Label('Client'),
-    dcc.Dropdown(
-        id='SK_ID_CURR',
-        options=[{'label': i, 'value': i} for i in available_clients],
-        value=np.min(available_clients),
-        persistence=True, persistence_type='session'        
-    ),
-    
-    html.Table([
-        html.Tr([html.Td(['EXT_SOURCE_3:']), html.Td(id='ES3'),
-                 html.Td(['EXT_SOURCE_2:']), html.Td(id='ES2'),
-                 html.Td(['EXT_SOURCE_1:']), html.Td(id='ES1'), 
-                 html.Td(['Age:']), html.Td(id='Age'),                 
-                 html.Td(['AMT_CREDIT:']), html.Td(id='AMT'),
-                 html.Td(['Payback failure probability:']), html.Td(id='pred')
-                ]),
-    ]),
-    
-    html.Div(
-        dcc.Graph(id='graphic', config={'responsive': True}),
-    ),
-])
-
-@app.callback(
-    Output('graphic','figure'),
-    Output('ES3','children'),
-    Output('ES2','children'),
-    Output('ES1','children'),
-    Output('Age', 'children'),
-    Output('AMT','children'),
-    Output('pred','children'),
-    Input('SK_ID_CURR', 'value'))
-def update_figure(SK_ID_CURR):
-    pred = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].PREDICTION.item(), decimals=3)
-    ES3_value = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].EXT_SOURCE_3.item(), decimals=3)
-    ES2_value = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].EXT_SOURCE_2.item(), decimals=3)
-    ES1_value = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].EXT_SOURCE_1.item(), decimals=3)
-    age_value = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].DAYS_BIRTH.item()/-365, decimals=0)
-    AMT_value = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].AMT_CREDIT.item(), decimals=3)
-    pred = np.round(global_df[global_df.SK_ID_CURR == SK_ID_CURR].PREDICTION.item(), decimals=3)
+# displayed fields of the clients
+CLIENT_COLUMNS = ['EXT_SOURCE_3', 'EXT_SOURCE_2', 'EXT_SOURCE_1', 'DAYS_BIRTH', 'AMT_CREDIT', 'PREDICTION']
+
+# clients' ID searched by prefix (only the matching clients are sent to the dropdown)
+MAX_OPTIONS = 20
+
+
+def build_client_arrays():
+    # load databases from datasets folder (only when the shared arrays are built, displayed columns only)
+    global_df = columnar.read_dataset(DATA_PATH, 'global_general_extract', ['SK_ID_CURR'] + CLIENT_COLUMNS) # clients data
+
+    # clients' displayed values indexed by ID (one binary search per callback) and IDs searched by prefix
+    client_store = clients.build_client_store(global_df, CLIENT_COLUMNS)
+    return {'ids': client_store['ids'],
+            'values': client_store['values'],
+            'search': clients.build_search_index(client_store['ids'])}
+
+
+def get_clients():
+    # clients' arrays built on first use and memory-mapped (shared by all the workers)
+    arrays = store.shared_arrays('clients', columnar.dataset_sources(DATA_PATH, 'global_general_extract'),
+                                 build_client_arrays)
+    return {'ids': arrays['ids'], 'columns': CLIENT_COLUMNS, 'values': arrays['values'], 'search': arrays['search']}
+
+
+def get_curves():
+    # precomputed KDE curves (rebuilt only when the extracts change, see apps/kde.py), checked again
+    # when a new model goes live
+    return store.latest('kde_curves', registry.live_version(), lambda: kde.load_or_build(DATA_PATH))
+
+
+def get_explanations():
+    # main drivers of the predictions, precomputed for all the clients (None without the file, see apps/explain.py)
+    version = registry.live_version()
+    def load():
+        path = DATA_PATH.joinpath(explain.EXPLANATIONS_PATH.name)
+        if not path.exists():
+            return None
+        explanations = explain.load_explanations(path)
+        # drivers computed by another model (e.g. a model published without its explanations) are not shown
+        return explanations if explanations['version'] == version else None
+    return store.latest('explanations', version, load)
+
+
+def get_percentiles():
+    # sorted values of the populations (built on first use and memory-mapped, see apps/percentiles.py)
+    return percentiles.get_index(DATA_PATH)
+
+
+def percentiles_row(client_percentiles):
+    # Percentiles of the client among the clients who repaid (TARGET=0) and who failed (TARGET=1)
+    cells = []
+    for column in CLIENT_COLUMNS:
+        ranks = client_percentiles[column]
+        cells.append(html.Td(['Percentile (repaid / failed):']))
+        cells.append(html.Td(' / '.join('-' if np.isnan(ranks[target]) else '%.1f' % ranks[target]
+                                        for target in percentiles.CLASSES)))
+    return cells
+
+
+def drivers_list(drivers):
+    # Display of a client's drivers (feature and contribution to the predicted log-odds)
+    if drivers is None:
+        return 'Main drivers of the prediction: not available for this client.'
+    return html.Div([
+        html.Label('Main drivers of the prediction (contribution to the log-odds, positive values increase the risk):'),
+        html.Ul([html.Li('%s: %+.3f' % (feature, value),
+                         style={'color': 'red' if value > 0 else 'blue'}) for feature, value in drivers]),
+    ])
+
+
+def build_base_figure(curves):
+    # KDE curves of all the clients and empty marker lines (the client specific part)
+    X_ES3, Z_ES3_0, Z_ES3_1 = curves['X_ES3'], curves['Z_ES3_0'], curves['Z_ES3_1']
+    X_ES2, Z_ES2_0, Z_ES2_1 = curves['X_ES2'], curves['Z_ES2_0'], curves['Z_ES2_1']
+    X_ES1, Z_ES1_0, Z_ES1_1 = curves['X_ES1'], curves['Z_ES1_0'], curves['Z_ES1_1']
+    X_age, Z_age_0, Z_age_1 = curves['X_age'], curves['Z_age_0'], curves['Z_age_1']
+    X_AMT, Z_AMT_0, Z_AMT_1 = curves['X_AMT'], curves['Z_AMT_0'], curves['Z_AMT_1']
+    X_pred, Z_pred = curves['X_pred'], curves['Z_pred']
+
+    # client's value marker lines (subplot, maximum density), drawn over the KDE curves
+    markers = [((1, 1), np.max([Z_ES3_0, Z_ES3_1])),
+               ((1, 2), np.max([Z_ES2_0, Z_ES2_1])),
+               ((1, 3), np.max([Z_ES1_0, Z_ES1_1])),
+               ((2, 1), np.max([Z_age_0, Z_age_1])),
+               ((2, 2), np.max([Z_AMT_0, Z_AMT_1])),
+               ((2, 3), np.max(Z_pred))]
 
     fig = make_subplots(rows=2, cols=3,
                         subplot_titles=('EXT_SOURCE_3', 'EXT_SOURCE_2', 'EXT_SOURCE_1',
@@ -172,7 +133,7 @@ def update_figure(SK_ID_CURR):
     # EXT_SOURCE_2
     fig.add_trace(go.Scatter(x=X_ES2, y=Z_ES2_0, marker = {'color' : 'blue'}, showlegend=False), row=1, col=2)
     fig.add_trace(go.Scatter(x=X_ES2, y=Z_ES2_1, marker = {'color' : 'red'}, showlegend=False), row=1, col=2)
-    
+
     # EXT_SOURCE_1
     fig.add_trace(go.Scatter(x=X_ES1, y=Z_ES1_0, marker = {'color' : 'blue'}, name='success'), row=1, col=3)
     fig.add_trace(go.Scatter(x=X_ES1, y=Z_ES1_1, marker = {'color' : 'red'},  name='failure'), row=1, col=3)
@@ -185,7 +146,7 @@ def update_figure(SK_ID_CURR):
     fig.add_trace(go.Scatter(x=X_AMT, y=Z_AMT_0, marker = {'color' : 'blue'}, showlegend=False), row=2, col=2)
     fig.add_trace(go.Scatter(x=X_AMT, y=Z_AMT_1, marker = {'color' : 'red'}, showlegend=False), row=2, col=2)
 
-    # Predictions    
+    # Predictions
     fig.add_trace(go.Scatter(x=X_pred, y=Z_pred, marker = {'color' : 'purple'}, showlegend=False), row=2, col=3)
 
     fig.update_layout(legend=dict(orientation="h",
@@ -197,43 +158,141 @@ def update_figure(SK_ID_CURR):
 
     fig.update_layout(title={'text': 'Kernel density estimators of the main features and the payback failure probability'})
 
-    # Vertical lines
-    if np.isnan(ES3_value)==False:
-        fig.add_trace(go.Scatter(x=[ES3_value, ES3_value], y=[0,np.max([Z_ES3_0,Z_ES3_1])], mode='lines',
+    # Vertical lines (the x values are filled in the browser, see the clientside callback below)
+    for (row, col), ymax in markers:
+        fig.add_trace(go.Scatter(x=[], y=[0, ymax], mode='lines',
                                  line={'color': 'green', 'width': 1, 'dash': 'dot'},
-                                 showlegend=False),
-                                 row=1, col=1)
+                                 name='client\'s value', showlegend=False),
+                                 row=row, col=col)
 
-    if np.isnan(ES2_value)==False:
-        fig.add_trace(go.Scatter(x=[ES2_value, ES2_value], y=[0,np.max([Z_ES2_0,Z_ES2_1])], mode='lines',
-                                 line={'color': 'green', 'width': 1, 'dash': 'dot'},
-                                 showlegend=False),
-                                 row=1, col=2)
+    fig.update_yaxes(title='density')
 
-    if np.isnan(ES1_value)==False:
-        fig.add_trace(go.Scatter(x=[ES1_value, ES1_value], y=[0,np.max([Z_ES1_0,Z_ES1_1])], mode='lines',
-                                 line={'color': 'green', 'width': 1, 'dash': 'dot'},
-                                 showlegend=False),
-                                 row=1, col=3)
+    # plain json types: the figure is serialized once here, not at each client selection
+    return json.loads(fig.to_json())
 
-    if np.isnan(age_value)==False:
-        fig.add_trace(go.Scatter(x=[age_value, age_value], y=[0,np.max([Z_age_0,Z_age_1])], mode='lines',
-                                 line={'color': 'green', 'width': 1, 'dash': 'dot'},
-                                 showlegend=False),
-                                 row=2, col=1)
 
-    if np.isnan(AMT_value)==False:
-        fig.add_trace(go.Scatter(x=[AMT_value, AMT_value], y=[0,np.max([Z_AMT_0,Z_AMT_1])], mode='lines',
-                                 line={'color': 'green', 'width': 1, 'dash': 'dot'},
-                                 showlegend=False),
-                                 row=2, col=2)
+def get_base_figure():
+    # the base figure is built once per worker (on first display, and again for a new model)
+    def build():
+        with metrics.timer('figure'):
+            return build_base_figure(get_curves())
+    return store.latest('dashboard_figure', registry.live_version(), build)
 
-    if np.isnan(pred)==False:
-        fig.add_trace(go.Scatter(x=[pred, pred], y=[0,np.max(Z_pred)], mode='lines',
-                                 line={'color': 'green', 'width': 1, 'dash': 'dot'},
-                                 name='client\'s value'),
-                                 row=2, col=3)
 
-    fig.update_yaxes(title='density')
+def layout():
+    # built on display (see index.py): nothing is loaded when the app starts
+    default_client = int(get_clients()['ids'][0])
+
+    return html.Div([
+
+            html.Div(
+                dcc.Link('◄ Back to home page', href='/'),
+                style={'textAlign': 'right'},
+            ),
+
+        html.Label('Client'),
+        dcc.Dropdown(
+            id='SK_ID_CURR',
+            options=clients.client_options([default_client]),
+            value=default_client,
+            placeholder='Type the beginning of a client ID',
+            persistence=True, persistence_type='session'        
+        ),
+    
+        html.Table([
+            html.Tr([html.Td(['EXT_SOURCE_3:']), html.Td(id='ES3'),
+                     html.Td(['EXT_SOURCE_2:']), html.Td(id='ES2'),
+                     html.Td(['EXT_SOURCE_1:']), html.Td(id='ES1'), 
+                     html.Td(['Age:']), html.Td(id='Age'),                 
+                     html.Td(['AMT_CREDIT:']), html.Td(id='AMT'),
+                     html.Td(['Payback failure probability:']), html.Td(id='pred')
+                    ]),
+            # client's percentiles within the TARGET classes (binary searches in the sorted populations)
+            html.Tr(id='percentiles'),
+        ]),
+
+        # client's main drivers (one row of the precomputed arrays)
+        html.Div(id='drivers'),
+    
+        html.Div(
+            dcc.Graph(id='graphic', figure=get_base_figure(), config={'responsive': True}),
+        ),
+
+        # client's values of the marker lines (the only client specific part of the figure)
+        dcc.Store(id='markers'),
+    ])
+
+@app.callback(
+    Output('SK_ID_CURR', 'options'),
+    Input('SK_ID_CURR', 'search_value'),
+    Input('SK_ID_CURR', 'value'))
+def update_options(search_value, SK_ID_CURR):
+    # Clients whose ID starts with the typed characters (the selected client stays in the options)
+    client_ids = clients.search_clients(get_clients()['search'], search_value, MAX_OPTIONS) if search_value else []
+    if SK_ID_CURR is not None and int(SK_ID_CURR) not in client_ids:
+        client_ids.append(int(SK_ID_CURR))
+    return clients.client_options(client_ids)
+
 
-    return fig, ES3_value, ES2_value, ES1_value, age_value, AMT_value, pred
\ No newline at end of file
+@app.callback(
+    Output('markers','data'),
+    Output('ES3','children'),
+    Output('ES2','children'),
+    Output('ES1','children'),
+    Output('Age', 'children'),
+    Output('AMT','children'),
+    Output('pred','children'),
+    Output('drivers','children'),
+    Output('percentiles','children'),
+    Input('SK_ID_CURR', 'value'))
+def update_figure(SK_ID_CURR):
+    # Retrieve all the displayed values of the client at once
+    client = clients.lookup_client(get_clients(), SK_ID_CURR) if SK_ID_CURR is not None else None
+    if client is None:
+        raise PreventUpdate
+
+    ES3_value = np.round(client['EXT_SOURCE_3'], decimals=3)
+    ES2_value = np.round(client['EXT_SOURCE_2'], decimals=3)
+    ES1_value = np.round(client['EXT_SOURCE_1'], decimals=3)
+    age_value = np.round(client['DAYS_BIRTH']/-365, decimals=0)
+    AMT_value = np.round(client['AMT_CREDIT'], decimals=3)
+    pred = np.round(client['PREDICTION'], decimals=3)
+
+    # Vertical lines positions (no line for missing values)
+    markers = [None if np.isnan(value) else float(value)
+               for value in (ES3_value, ES2_value, ES1_value, age_value, AMT_value, pred)]
+
+    # Main drivers of the prediction (precomputed, a single lookup)
+    explanations = get_explanations()
+    drivers = explain.lookup_drivers(explanations, SK_ID_CURR) if explanations is not None else None
+
+    # Exact percentiles of the client's values (two binary searches per population)
+    client_percentiles = percentiles.client_percentiles(get_percentiles(), client)
+
+    with metrics.timer('render'):
+        return (markers, ES3_value, ES2_value, ES1_value, age_value, AMT_value, pred, drivers_list(drivers),
+                percentiles_row(client_percentiles))
+
+
+# Draw the client's vertical lines over the base figure in the browser
+app.clientside_callback(
+    """
+    function(markers, figure) {
+        if (!markers || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var first = figure.data.length - markers.length;
+        var data = figure.data.slice();
+        markers.forEach(function(value, i) {
+            data[first + i] = Object.assign({}, data[first + i], {
+                x: value === null ? [] : [value, value],
+                // only the probability line appears in the legend
+                showlegend: i === markers.length - 1 && value !== null
+            });
+        });
+        return Object.assign({}, figure, {data: data});
+    }
+    """,
+    Output('graphic', 'figure'),
+    Input('markers', 'data'),
+    State('graphic', 'figure'))
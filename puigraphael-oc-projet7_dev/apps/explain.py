@@ -0,0 +1,204 @@
+# data retreiving
+import os
+import pathlib
+import argparse
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# modeling (fused imputer, scaler and model) and timing of the scoring stages
+from apps import artifact, metrics
+
+#################### EXPLANATIONS (TreeSHAP contributions of the features to the predictions) ####################
+# 1) compute the contributions of every feature with LightGBM's TreeSHAP (pred_contrib), for a whole
+#    buffer of clients at once, and the probabilities from the same pass
+# 2) keep only the main drivers of each client: k feature indices and their contributions
+# 3) precompute them for all the clients of the dashboard and save them as a small .npz file
+#    (clients sorted by id: the drivers of a client are one row of the arrays)
+#
+# The contributions are in log-odds: they add up (with the expected value) to the raw score of
+# the model, whose sigmoid is the payback failure probability. The folded booster of the artifact
+# gives the contributions of the model trained on the imputed and scaled features.
+
+# version of the file layout
+FORMAT_VERSION = 1
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../datasets').resolve()
+EXPLANATIONS_PATH = DATA_PATH.joinpath('explanations.npz')
+
+# clients of the dashboard
+GLOBAL_FILE = 'global_general_extract.csv'
+
+# main drivers kept by client
+TOP_K = 5
+
+# rows read from the feature files at once
+CHUNK_SIZE = 50000
+
+
+def contributions(predictor_artifact, df):
+    # Contributions of the model's features (last column: expected value) for every row of the dataframe
+    X = artifact.features_buffer(predictor_artifact, df)
+    with metrics.timer('predict'):
+        return predictor_artifact['booster'].predict(X, pred_contrib=True)
+
+
+def top_contributions(contributions, k=TOP_K):
+    """
+    Main drivers of each row: the features with the largest absolute contributions.
+
+    Parameters
+    ----------
+    contributions : 2d array of floats
+        The contributions of the features (without the expected value column).
+
+    k : integer
+        The number of drivers kept by row.
+
+    Return
+    ------
+    features : 2d array of int16
+        The positions of the drivers in the model's features (largest contribution first).
+
+    values : 2d array of float32
+        Their contributions.
+
+    """
+
+    k = min(k, contributions.shape[1])
+    # the k largest absolute values of every row (unsorted), then sorted
+    top = np.argpartition(-np.abs(contributions), k - 1, axis=1)[:, :k]
+    top_values = np.take_along_axis(contributions, top, axis=1)
+    order = np.argsort(-np.abs(top_values), axis=1, kind='stable')
+    return (np.take_along_axis(top, order, axis=1).astype(np.int16),
+            np.take_along_axis(top_values, order, axis=1).astype(np.float32))
+
+
+def score_and_explain(predictor_artifact, df, k=TOP_K):
+    # Probabilities and main drivers of every row, from a single pass over the trees
+    contrib = contributions(predictor_artifact, df)
+    # the raw score is the sum of the contributions (binary objective: probability = sigmoid)
+    probabilities = 1 / (1 + np.exp(-contrib.sum(axis=1)))
+    features, values = top_contributions(contrib[:, :-1], k)
+    return probabilities, features, values
+
+
+def drivers_text(feature_names, features, values):
+    # Drivers of every row as a short text ('EXT_SOURCE_3 (+0.412), DAYS_BIRTH (-0.120)...')
+    return [', '.join('%s (%+.3f)' % (feature_names[f], v) for f, v in zip(row_features, row_values))
+            for row_features, row_values in zip(features.tolist(), values.tolist())]
+
+
+def build_explanations(predictor_artifact, sources, ids=None, k=TOP_K, chunk_size=CHUNK_SIZE):
+    """
+    Main drivers of all the clients of some feature files, computed chunk by chunk.
+
+    Parameters
+    ----------
+    predictor_artifact : dictionary
+        See artifact.load_artifact.
+
+    sources : list of paths
+        The csv files of the clients' features (SK_ID_CURR and the model's features at least,
+        e.g. the train and test bases of notebook 4).
+
+    ids : array of integers
+        The clients to keep (all of them by default).
+
+    k : integer
+        The number of drivers kept by client.
+
+    chunk_size : integer
+        The number of rows read and explained at once.
+
+    Return
+    ------
+    explanations : dictionary
+        'ids' (sorted), 'features' and 'values' of the drivers (one row per client), the 'expected_value'
+        of the model, the 'feature_names' and the model 'version'.
+
+    """
+
+    columns = ['SK_ID_CURR'] + predictor_artifact['feature_names']
+    parts, expected_value = list(), 0.0
+    for source in sources:
+        for chunk in pd.read_csv(source, usecols=columns, dtype=np.float32, chunksize=chunk_size):
+            chunk_ids = chunk['SK_ID_CURR'].to_numpy().astype(np.int64)
+            if ids is not None:
+                kept = np.isin(chunk_ids, ids)
+                chunk, chunk_ids = chunk[kept], chunk_ids[kept]
+            if len(chunk) == 0:
+                continue
+            contrib = contributions(predictor_artifact, chunk)
+            expected_value = float(contrib[0, -1])
+            parts.append((chunk_ids,) + top_contributions(contrib[:, :-1], k))
+
+    if len(parts) == 0:
+        raise ValueError('No client to explain in %s.' % ', '.join(str(source) for source in sources))
+
+    # clients sorted by id (one binary search per client in the dashboard)
+    client_ids, features, values = (np.concatenate(arrays) for arrays in zip(*parts))
+    order = np.argsort(client_ids, kind='stable')
+    return {'format_version': FORMAT_VERSION,
+            'version': predictor_artifact['version'],
+            'ids': client_ids[order],
+            'features': features[order],
+            'values': values[order],
+            'expected_value': expected_value,
+            'feature_names': list(predictor_artifact['feature_names'])}
+
+
+def save_explanations(explanations, path=EXPLANATIONS_PATH):
+    # Write in a temporary file first so that a reader never sees a partial file
+    path = pathlib.Path(path)
+    tmp_path = path.with_name('%s.%i.tmp' % (path.name, os.getpid()))
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **{key: np.asarray(value) for key, value in explanations.items()})
+    tmp_path.replace(path)
+
+
+def load_explanations(path=EXPLANATIONS_PATH):
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['format_version']) != FORMAT_VERSION:
+            raise ValueError('Unsupported explanations format: %s' % data['format_version'])
+        explanations = {key: data[key] for key in data.files}
+    explanations['format_version'] = int(explanations['format_version'])
+    explanations['version'] = str(explanations['version'])
+    explanations['expected_value'] = float(explanations['expected_value'])
+    explanations['feature_names'] = [str(name) for name in explanations['feature_names']]
+    return explanations
+
+
+def lookup_drivers(explanations, client_id):
+    # Drivers of a client as a list of (feature, contribution) (None if the client was not explained)
+    ids = explanations['ids']
+    i = int(np.searchsorted(ids, int(client_id)))
+    if i == len(ids) or ids[i] != int(client_id):
+        return None
+    names = explanations['feature_names']
+    return [(names[f], v) for f, v in zip(explanations['features'][i].tolist(), explanations['values'][i].tolist())]
+
+
+if __name__ == '__main__':
+    # e.g. python -m apps.explain ../data_3-4/train_SmallGlobalBase.csv ../data_3-4/test_SmallGlobalBase.csv
+    parser = argparse.ArgumentParser(description='Precompute the main drivers of the predictions of the dashboard.')
+    parser.add_argument('sources', nargs='+', help='csv files of the clients\' features (SK_ID_CURR and the model\'s features)')
+    parser.add_argument('--data', default=str(DATA_PATH), help='folder with the artifact and the global extract')
+    parser.add_argument('--top', type=int, default=TOP_K, help='drivers kept by client')
+    parser.add_argument('--all', action='store_true', help='explain all the clients, not only those of the global extract')
+    parser.add_argument('--out', default=None, help='explanations file (default: explanations.npz in the data folder)')
+    args = parser.parse_args()
+
+    data_path = pathlib.Path(args.data)
+    predictor_artifact = artifact.load_artifact(data_path.joinpath(artifact.ARTIFACT_PATH.name))
+    ids = None
+    if not args.all and data_path.joinpath(GLOBAL_FILE).exists():
+        ids = pd.read_csv(data_path.joinpath(GLOBAL_FILE), usecols=['SK_ID_CURR'])['SK_ID_CURR'].to_numpy().astype(np.int64)
+
+    explanations = build_explanations(predictor_artifact, args.sources, ids, args.top)
+    out = args.out if args.out is not None else data_path.joinpath(EXPLANATIONS_PATH.name)
+    save_explanations(explanations, out)
+    print('drivers of %i clients (model %s) written to %s' % (len(explanations['ids']), explanations['version'], out))
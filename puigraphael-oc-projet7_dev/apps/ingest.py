@@ -0,0 +1,119 @@
+# data retreiving
+import io
+import base64
+import shutil
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# timing of the decoding and parsing stages
+from apps import metrics
+
+#################### STREAMING INGESTION (uploaded files read chunk by chunk) ####################
+# 1) decode the base64 content of an upload lazily, as a binary file object
+# 2) parse csv files in chunks of rows, reading only the needed columns as float32
+# 3) excel files cannot be parsed in pieces: they are read at once (needed columns only)
+#    and then split in chunks, so that the scoring code is the same for both formats
+# 4) uploads can also be spooled to disk and parsed later from the file (see jobs.py)
+
+# number of rows parsed (and scored) at once
+CHUNK_SIZE = 50000
+
+# base64 characters decoded at once (multiple of 4: whole groups of 3 bytes)
+BLOCK_SIZE = 1 << 20
+
+
+class Base64Stream(io.RawIOBase):
+    # Read only file object over a base64 string, decoded block by block on demand
+
+    def __init__(self, text, start=0):
+        self._text = text
+        self._position = start
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Decode just enough characters to fill the buffer (the rest is kept for the next call)
+        while len(self._pending) < len(buffer) and self._position < len(self._text):
+            end = self._position + BLOCK_SIZE
+            with metrics.timer('decode'):
+                self._pending += base64.b64decode(self._text[self._position:end])
+            self._position = end
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def open_upload(contents):
+    # Binary file object over the content of a dcc.Upload ('data:<type>;base64,<data>')
+    start = contents.index(',') + 1
+    return io.BufferedReader(Base64Stream(contents, start), buffer_size=BLOCK_SIZE)
+
+
+def column_dtypes(columns, id_column='SK_ID_CURR'):
+    # float32 features (the model's buffer type), the type of the ids is left to pandas
+    return {col: np.float32 for col in columns if col != id_column}
+
+
+def spool_upload(contents, path):
+    # Write the decoded upload to a file, block by block
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(open_upload(contents), f, BLOCK_SIZE)
+
+
+def parse_chunks(source, filename, columns, chunk_size=CHUNK_SIZE):
+    """
+    Parse a csv or excel file chunk by chunk.
+
+    Parameters
+    ----------
+    source : path or binary file object
+        The file to parse.
+
+    filename : string
+        The name of the uploaded file (gives the format).
+
+    columns : list of strings
+        The columns to read (the others are skipped while parsing).
+
+    chunk_size : integer
+        The number of rows of each chunk.
+
+    Return
+    ------
+    chunks : iterator of dataframes
+        The successive chunks of rows, with the requested columns.
+
+    """
+
+    dtypes = column_dtypes(columns)
+
+    if 'csv' in filename:
+        # Assume that the user uploaded a CSV file
+        reader = pd.read_csv(source, encoding='utf-8', usecols=columns,
+                             dtype=dtypes, chunksize=chunk_size)
+        with reader:
+            for chunk in metrics.timed_chunks(reader, 'parse'):
+                yield chunk
+
+    elif 'xls' in filename:
+        # Assume that the user uploaded an excel file (a zip or ole archive: read at once)
+        if hasattr(source, 'read'):
+            source = io.BytesIO(source.read())
+        with metrics.timer('parse'):
+            df = pd.read_excel(source, usecols=columns).astype(dtypes)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start+chunk_size]
+
+    else:
+        raise ValueError('Unsupported file format: %s' % filename)
+
+
+def read_chunks(contents, filename, columns, chunk_size=CHUNK_SIZE):
+    # Parse the content of a dcc.Upload chunk by chunk (see parse_chunks)
+    return parse_chunks(open_upload(contents), filename, columns, chunk_size)
@@ -0,0 +1,229 @@
+# data retreiving
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import pathlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+
+# streaming ingestion of the uploads, metrics and profiles of the scoring processes
+from apps import ingest, metrics, profiling
+
+#################### SCORING JOBS (uploads scored in background processes) ####################
+# 1) spool the upload to a job folder and return a job ID right away
+# 2) parse and score the file chunk by chunk in a process pool, appending the results to a csv file
+# 3) keep the job's status (state, progress) in a json file of the job folder
+#
+# Everything is on disk, so any gunicorn worker can answer the polls of a job
+# submitted to another worker.
+
+# folder of the jobs (one sub-folder per job)
+JOBS_PATH = pathlib.Path(os.environ.get('JOBS_PATH', pathlib.Path(tempfile.gettempdir()).joinpath('predictor_jobs')))
+
+# number of scoring processes (per web worker) and lifetime of the job folders (in seconds)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+JOB_TTL = int(os.environ.get('JOB_TTL', 24 * 3600))
+
+UPLOAD_FILE = 'upload'
+STATUS_FILE = 'status.json'
+RESULT_FILE = 'result.csv'
+
+# process pool, started on first use in each web worker
+_pool = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+    return _pool
+
+
+def job_path(job_id):
+    # Folder of a job (the ID comes from the browser: check it before building a path)
+    if not isinstance(job_id, str) or re.fullmatch('[0-9a-f]{32}', job_id) is None:
+        raise ValueError('Invalid job ID: %r' % (job_id,))
+    return JOBS_PATH.joinpath(job_id)
+
+
+def result_path(job_id):
+    return job_path(job_id).joinpath(RESULT_FILE)
+
+
+def write_status(job_dir, status):
+    # Replace the status file at once (a poll never reads a partial file)
+    tmp_path = pathlib.Path(job_dir).joinpath(STATUS_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    tmp_path.replace(pathlib.Path(job_dir).joinpath(STATUS_FILE))
+
+
+def read_status(job_id):
+    # Status of a job (None if unknown)
+    try:
+        with open(job_path(job_id).joinpath(STATUS_FILE)) as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+
+def run_job(job_dir, filename, score, columns, chunk_size=ingest.CHUNK_SIZE, profile=False):
+    """
+    Score a spooled upload chunk by chunk (runs in a process of the pool).
+
+    Parameters
+    ----------
+    job_dir : string
+        The folder of the job (with the spooled upload).
+
+    filename : string
+        The name of the uploaded file (gives the format).
+
+    score : function
+        Turns a chunk of the upload into the chunk of results to save.
+
+    columns : list of strings
+        The columns read from the upload.
+
+    chunk_size : integer
+        The number of rows parsed and scored at once.
+
+    profile : boolean
+        Write a profile of the job (see profiling.py).
+
+    """
+
+    job_dir = pathlib.Path(job_dir)
+    upload = job_dir.joinpath(UPLOAD_FILE)
+    with profiling.profiled('job ' + filename, upload.stat().st_size, enabled=profile):
+        score_upload(job_dir, upload, filename, score, columns, chunk_size)
+    # the timings of the job are exported even if the process stays idle
+    metrics.flush()
+
+
+def score_upload(job_dir, upload, filename, score, columns, chunk_size):
+    # Parse and score the spooled upload, then remove it (see run_job)
+    status = read_status(job_dir.name)
+    status.update(state='running')
+    write_status(job_dir, status)
+
+    tmp_path = job_dir.joinpath(RESULT_FILE + '.tmp')
+    try:
+        size = max(upload.stat().st_size, 1)
+        with open(upload, 'rb') as source, open(tmp_path, 'w', newline='') as result:
+            for chunk in ingest.parse_chunks(source, filename, columns, chunk_size):
+                score(chunk).to_csv(result, header=(status['rows'] == 0), index=False)
+                status['rows'] += len(chunk)
+                status['progress'] = min(source.tell() / size, 1.0)
+                write_status(job_dir, status)
+        tmp_path.replace(job_dir.joinpath(RESULT_FILE))
+        status.update(state='done', progress=1.0)
+
+    except Exception as e:
+        logger.exception('job %s (%s) failed', job_dir.name, filename)
+        status.update(state='error', error=str(e))
+        tmp_path.unlink(missing_ok=True)
+
+    # the upload is not needed any more
+    upload.unlink(missing_ok=True)
+    write_status(job_dir, status)
+
+
+def job_finished(job_dir, future, on_done=None):
+    # Runs in the web worker when the pool is done with a job
+    global _pool
+    try:
+        error = future.exception()
+    except CancelledError as e:
+        # the pool was shut down before the job started
+        error = e
+    if error is not None:
+        # the pool itself failed (e.g. a killed process): the job would stay 'queued' or 'running' forever
+        logger.error('job %s failed in the pool', job_dir.name, exc_info=error)
+        status = read_status(job_dir.name)
+        # no status is written for a job removed meanwhile (see remove_old_jobs)
+        if status is not None:
+            status.update(state='error', error=str(error) or type(error).__name__)
+            write_status(job_dir, status)
+        _pool = None
+    elif on_done is not None and (read_status(job_dir.name) or {}).get('state') == 'done':
+        on_done(job_dir.name)
+
+
+def remove_old_jobs(max_age=JOB_TTL):
+    # Remove the folders of the jobs older than max_age seconds
+    if not JOBS_PATH.exists():
+        return
+    limit = time.time() - max_age
+    for job_dir in JOBS_PATH.iterdir():
+        try:
+            if job_dir.stat().st_mtime < limit:
+                shutil.rmtree(job_dir)
+        except OSError:
+            pass
+
+
+def new_job(filename, state, model_version=None):
+    # Create the folder and the status of a job (with the version of the model scoring it)
+    remove_old_jobs()
+
+    job_id = uuid.uuid4().hex
+    job_dir = job_path(job_id)
+    job_dir.mkdir(parents=True)
+    write_status(job_dir, {'filename': filename, 'state': state, 'progress': 0.0, 'rows': 0,
+                           'error': None, 'created': time.time(), 'model_version': model_version})
+    return job_id
+
+
+def finished_job(filename, df, model_version=None):
+    # Job already done (results known beforehand, e.g. from the cache): nothing is scored
+    job_id = new_job(filename, 'queued', model_version)
+    df.to_csv(result_path(job_id), index=False)
+    status = read_status(job_id)
+    status.update(state='done', progress=1.0, rows=len(df))
+    write_status(job_path(job_id), status)
+    return job_id
+
+
+def submit(contents, filename, score, columns, on_done=None, model_version=None):
+    """
+    Spool an upload to disk and score it in the background.
+
+    Parameters
+    ----------
+    contents : string
+        The content of the upload, as given by dcc.Upload.
+
+    filename : string
+        The name of the uploaded file (gives the format).
+
+    score, columns :
+        See run_job.
+
+    on_done : function
+        Called with the job ID in the web worker when the job is done (optional).
+
+    model_version : string
+        The version of the model used by score (saved in the status of the job).
+
+    Return
+    ------
+    job_id : string
+        The ID used to poll the job and to download its results.
+
+    """
+
+    job_id = new_job(filename, 'queued', model_version)
+    job_dir = job_path(job_id)
+    ingest.spool_upload(contents, job_dir.joinpath(UPLOAD_FILE))
+
+    # the job of a profiled request is profiled too
+    future = get_pool().submit(run_job, str(job_dir), filename, score, columns, profile=profiling.is_profiled())
+    future.add_done_callback(lambda future: job_finished(job_dir, future, on_done))
+    return job_id
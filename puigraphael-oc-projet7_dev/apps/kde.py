@@ -0,0 +1,224 @@
+# data retreiving
+import os
+import pathlib
+import argparse
+import hashlib
+
+# data handling
+import numpy as np
+
+# columnar extracts and fingerprint of the source files
+from apps import columnar, store
+
+#################### KDE CURVES (precomputed density plots of the dashboard) ####################
+# 1) estimate the densities with a binned gaussian KDE (linear binning + FFT convolution)
+# 2) compute all the curves of the dashboard from the train and global extracts
+# 3) save / load the curves as a small .npz file keyed by a digest of the content of the source files,
+#    computed once at build time; the size and modification times of the files (store.sources_key) are
+#    checked first, the files are only read again when they differ (e.g. after a checkout or a copy)
+#
+# The binned KDE uses the same 'scott' bandwidth as scipy.stats.gaussian_kde, but its
+# cost depends on the number of bins instead of (number of values x number of points).
+
+# version of the file layout
+FORMAT_VERSION = 3
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../datasets').resolve()
+CURVES_PATH = DATA_PATH.joinpath('kde_curves.npz')
+
+# source files of the curves
+TRAIN_FILE = 'train_extract.csv'
+GLOBAL_FILE = 'global_general_extract.csv'
+
+# points of the plotted curves and bins of the estimation grid
+N_POINTS = 100
+N_BINS = 4096
+
+# plotted features (short name used in the curves' keys: column)
+FEATURES = {'ES3': 'EXT_SOURCE_3',
+            'ES2': 'EXT_SOURCE_2',
+            'ES1': 'EXT_SOURCE_1',
+            'age': 'DAYS_BIRTH',
+            'AMT': 'AMT_CREDIT'}
+
+
+def binned_kde(values, grid, n_bins=N_BINS):
+    """
+    Gaussian kernel density estimate (scott bandwidth) evaluated on a regular grid.
+
+    Parameters
+    ----------
+    values : array of floats
+        The sample (nan values are dropped).
+
+    grid : array of floats
+        Regular grid where the density is evaluated (its bounds must contain the sample).
+
+    n_bins : integer
+        Number of bins used for the estimation.
+
+    Return
+    ------
+    density : array of floats
+        The density at each point of the grid.
+
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = values.shape[0]
+    if n < 2:
+        raise ValueError('At least two values are needed to estimate a density.')
+
+    # scott's rule, as scipy.stats.gaussian_kde(bw_method='scott') in one dimension
+    bandwidth = n ** -0.2 * values.std(ddof=1)
+    if bandwidth == 0:
+        raise ValueError('Cannot estimate the density of a constant sample.')
+
+    # linear binning: every value is shared between its two nearest bins
+    low, high = float(grid[0]), float(grid[-1])
+    centers = np.linspace(low, high, n_bins)
+    delta = centers[1] - centers[0]
+    position = np.clip((values - low) / delta, 0, n_bins - 1)
+    left = np.minimum(position.astype(np.int64), n_bins - 2)
+    weight = position - left
+    counts = (np.bincount(left, weights=1 - weight, minlength=n_bins)
+              + np.bincount(left + 1, weights=weight, minlength=n_bins))
+
+    # gaussian kernel sampled on the bins (up to 5 bandwidths)
+    half = int(min(np.ceil(5 * bandwidth / delta), n_bins - 1))
+    offsets = np.arange(-half, half + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (np.sqrt(2 * np.pi) * bandwidth * n)
+
+    # convolution of the counts by the kernel with zero padding
+    size = 1 << int(np.ceil(np.log2(n_bins + 2 * half + 1)))
+    density = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    density = np.maximum(density[half:half + n_bins], 0)
+
+    return np.interp(grid, centers, density)
+
+
+def source_hash(paths):
+    # Digest of the content of the source files (in order)
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def feature_values(df, short_name):
+    # Plotted values of a feature (the age is displayed in years)
+    values = df[FEATURES[short_name]]
+    if short_name == 'age':
+        values = values / -365
+    return values
+
+
+def build_curves(train_df, global_df, n_points=N_POINTS):
+    # Grid on the range of each feature and one density per TARGET class
+    curves = dict()
+    for short_name in FEATURES:
+        values = feature_values(train_df, short_name)
+        X = np.linspace(values.min(), values.max(), n_points)
+        curves['X_' + short_name] = X
+        curves['Z_' + short_name + '_0'] = binned_kde(values[train_df['TARGET'] == 0], X)
+        curves['Z_' + short_name + '_1'] = binned_kde(values[train_df['TARGET'] == 1], X)
+
+    # Predictions of all the clients of the database
+    values = global_df['PREDICTION']
+    X = np.linspace(values.min(), values.max(), n_points)
+    curves['X_pred'] = X
+    curves['Z_pred'] = binned_kde(values, X)
+
+    return curves
+
+
+def build_from_sources(data_path=DATA_PATH):
+    # Only the plotted columns are read (from the columnar folders when they are up to date)
+    paths = [pathlib.Path(data_path).joinpath(TRAIN_FILE), pathlib.Path(data_path).joinpath(GLOBAL_FILE)]
+    # fingerprints taken before reading: extracts replaced meanwhile give a rebuild on the next load
+    sources_key = store.sources_key(paths)
+    content_hash = source_hash(paths)
+    train_df = columnar.read_dataset(data_path, paths[0].stem, list(FEATURES.values()) + ['TARGET', 'SK_ID_CURR'])
+    global_df = columnar.read_dataset(data_path, paths[1].stem, ['SK_ID_CURR', 'PREDICTION'])
+
+    curves = build_curves(train_df, global_df)
+    curves['format_version'] = FORMAT_VERSION
+    curves['sources_key'] = sources_key
+    curves['source_hash'] = content_hash
+    return curves
+
+
+def save_curves(curves, path=CURVES_PATH):
+    # Write in a temporary file first so that a reader never sees a partial file
+    # (one temporary file per process: several workers may rebuild the curves at once)
+    path = pathlib.Path(path)
+    tmp_path = path.with_name('%s.%i.tmp' % (path.name, os.getpid()))
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **{key: np.asarray(value) for key, value in curves.items()})
+    tmp_path.replace(path)
+
+
+def load_curves(path=CURVES_PATH):
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['format_version']) != FORMAT_VERSION:
+            raise ValueError('Unsupported curves format: %s' % data['format_version'])
+        curves = {key: data[key] for key in data.files}
+    curves['format_version'] = int(curves['format_version'])
+    curves['sources_key'] = str(curves['sources_key'])
+    curves['source_hash'] = str(curves['source_hash'])
+    return curves
+
+
+def load_or_build(data_path=DATA_PATH, path=None):
+    # Load the saved curves if they match the source files, rebuild (and save) them otherwise
+    data_path = pathlib.Path(data_path)
+    path = pathlib.Path(path) if path is not None else data_path.joinpath(CURVES_PATH.name)
+    sources = [data_path.joinpath(TRAIN_FILE), data_path.joinpath(GLOBAL_FILE)]
+
+    if path.exists():
+        try:
+            curves = load_curves(path)
+            # without the extracts (curves shipped alone) the saved curves are used as they are
+            if not all(source.exists() for source in sources):
+                return curves
+            # same sizes and modification times: nothing to read
+            sources_key = store.sources_key(sources)
+            if curves['sources_key'] == sources_key:
+                return curves
+            # files touched (checkout, deploy copy, registry install): same content, same curves
+            if curves['source_hash'] == source_hash(sources):
+                curves['sources_key'] = sources_key
+                try:
+                    # the next loads take the fast path again
+                    save_curves(curves, path)
+                except OSError:
+                    pass
+                return curves
+        except (ValueError, KeyError, OSError):
+            pass
+
+    curves = build_from_sources(data_path)
+    try:
+        save_curves(curves, path)
+    except OSError:
+        # read-only deployment: keep the curves in memory
+        pass
+    return curves
+
+
+if __name__ == '__main__':
+    # e.g. python -m apps.kde
+    parser = argparse.ArgumentParser(description='Build the KDE curves of the dashboard.')
+    parser.add_argument('--data', default=str(DATA_PATH), help='folder with the train and global extracts')
+    parser.add_argument('--out', default=None, help='curves file (default: kde_curves.npz in the data folder)')
+    args = parser.parse_args()
+
+    curves = build_from_sources(args.data)
+    out = args.out if args.out is not None else pathlib.Path(args.data).joinpath(CURVES_PATH.name)
+    save_curves(curves, out)
+    print('curves %s written to %s' % (curves['source_hash'][:12], out))
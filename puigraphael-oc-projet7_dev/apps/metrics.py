@@ -0,0 +1,308 @@
+# data retreiving
+import os
+import json
+import time
+import atexit
+import bisect
+import pathlib
+import tempfile
+import threading
+import functools
+import contextlib
+
+#################### METRICS (latency histograms of the hot paths, exported for Prometheus) ####################
+# 1) each process (gunicorn worker or scoring process) counts its observations in memory:
+#    histograms with fixed buckets, counters and its resident memory
+# 2) the counts are written to a file per process at most every FLUSH_INTERVAL seconds
+#    (when something is observed, at exit and before an export)
+# 3) the /metrics route sums the files of all the processes and answers in the Prometheus text format
+# 4) a hook of the Flask server times every request and measures its payloads, the requests of the
+#    Dash callbacks being labelled with the name of the callback
+#
+# The counts of the stopped processes stay in their files (the totals never decrease): clear
+# METRICS_PATH when the app is deployed again.
+
+# folder of the per process files, and delay between two writes of a process (in seconds)
+METRICS_PATH = pathlib.Path(os.environ.get('METRICS_PATH', pathlib.Path(tempfile.gettempdir()).joinpath('payback_metrics')))
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# nothing is counted if METRICS=0
+ENABLED = os.environ.get('METRICS', '1') != '0'
+
+# upper bounds of the buckets: durations (seconds), sizes (bytes) and throughputs (rows per second)
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [256 * 4**i for i in range(11)]
+RATE_BUCKETS = [10**i for i in range(1, 8)]
+
+# exported metrics: name -> (type, help, buckets of the histograms)
+METRICS = {
+    'payback_callback_seconds': ('histogram', 'Duration of the requests of the Dash callbacks.', LATENCY_BUCKETS),
+    'payback_request_seconds': ('histogram', 'Duration of the other requests of the server, by route.', LATENCY_BUCKETS),
+    'payback_request_bytes': ('histogram', 'Size of the request bodies, by callback or route.', SIZE_BUCKETS),
+    'payback_response_bytes': ('histogram', 'Size of the response bodies, by callback or route.', SIZE_BUCKETS),
+    'payback_stage_seconds': ('histogram', 'Duration of the stages of the scoring and display paths.', LATENCY_BUCKETS),
+    'payback_function_seconds': ('histogram', 'Duration of the calls of the timed functions.', LATENCY_BUCKETS),
+    'payback_scoring_rows_per_second': ('histogram', 'Throughput of each scored batch of rows.', RATE_BUCKETS),
+    'payback_rows_scored_total': ('counter', 'Rows scored, by source.', None),
+    'payback_worker_rss_bytes': ('gauge', 'Resident memory of each running process.', None),
+}
+
+# counts of this process: (name, labels) -> [counts by bucket (+Inf last), sum, count] or counter value
+_histograms = dict()
+_counters = dict()
+_lock = threading.Lock()
+_last_flush = 0.0
+
+# page size for the resident memory (from /proc/self/statm, Linux only)
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    # Count a value in a histogram (see METRICS for the buckets)
+    if not ENABLED:
+        return
+    buckets = METRICS[name][2]
+    key = (name, label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+    maybe_flush()
+
+
+def inc(name, value=1, **labels):
+    # Add a value to a counter
+    if not ENABLED:
+        return
+    key = (name, label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    maybe_flush()
+
+
+@contextlib.contextmanager
+def timer(stage):
+    # Duration of a block of code, as a stage of payback_stage_seconds
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('payback_stage_seconds', time.perf_counter() - start, stage=stage)
+
+
+def timed(func):
+    # Duration of every call of a function (payback_function_seconds, labelled by its name)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe('payback_function_seconds', time.perf_counter() - start, function=func.__name__)
+    return wrapper
+
+
+def timed_chunks(chunks, stage):
+    # Iterate over chunks, timing the production of each one (e.g. the parsing of an upload)
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        observe('payback_stage_seconds', time.perf_counter() - start, stage=stage)
+        yield chunk
+
+
+def scored(rows, seconds, source):
+    # Rows scored by a batch and its throughput
+    inc('payback_rows_scored_total', rows, source=source)
+    if rows and seconds > 0:
+        observe('payback_scoring_rows_per_second', rows / seconds, source=source)
+
+
+def rss_bytes():
+    # Resident memory of the process (None if unknown)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def snapshot():
+    # Counts of this process, as written to its file
+    with _lock:
+        histograms = [[name, dict(labels), list(h[0]), h[1], h[2]] for (name, labels), h in _histograms.items()]
+        counters = [[name, dict(labels), value] for (name, labels), value in _counters.items()]
+    return {'pid': os.getpid(), 'rss': rss_bytes(), 'histograms': histograms, 'counters': counters}
+
+
+def flush():
+    # Replace the file of this process at once (an export never reads a partial file)
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not ENABLED:
+        return
+    try:
+        METRICS_PATH.mkdir(parents=True, exist_ok=True)
+        path = METRICS_PATH.joinpath('%i.json' % os.getpid())
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot(), f)
+        tmp_path.replace(path)
+    except OSError:
+        # metrics never break the app
+        pass
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def reset():
+    # A forked process (e.g. of the scoring pool) starts from zero: its parent counts its own calls
+    global _lock, _last_flush
+    _histograms.clear()
+    _counters.clear()
+    _lock = threading.Lock()
+    _last_flush = 0.0
+
+
+atexit.register(flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def collect():
+    # Sum of the files of all the processes (the resident memory of the running ones only)
+    histograms = dict()
+    counters = dict()
+    rss = dict()
+    for path in sorted(METRICS_PATH.glob('*.json')) if METRICS_PATH.exists() else []:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, counts, total, count in data['histograms']:
+            key = (name, label_key(labels))
+            histogram = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+            histogram[1] += total
+            histogram[2] += count
+        for name, labels, value in data['counters']:
+            key = (name, label_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        if data['rss'] is not None and is_running(data['pid']):
+            rss[('payback_worker_rss_bytes', (('pid', str(data['pid'])),))] = data['rss']
+    return histograms, counters, rss
+
+
+def format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    values = ['%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+              for key, value in labels]
+    return '{' + ','.join(values) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def export():
+    """
+    Metrics of all the processes in the Prometheus text format (version 0.0.4).
+
+    Return
+    ------
+    text : string
+        The HELP and TYPE lines of every metric, then its samples
+        (cumulative buckets, sum and count of the histograms).
+
+    """
+
+    flush()
+    histograms, counters, rss = collect()
+    samples = dict()
+    for (name, labels), value in sorted(counters.items()) + sorted(rss.items()):
+        samples.setdefault(name, []).append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+    for (name, labels), (counts, total, count) in sorted(histograms.items()):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket_count in zip(METRICS[name][2] + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append('%s_bucket%s %i' % (name, format_labels(labels, [('le', bound)]), cumulative))
+        lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+        lines.append('%s_count%s %i' % (name, format_labels(labels), count))
+
+    text = []
+    for name, (kind, help_text, _) in METRICS.items():
+        if name in samples:
+            text += ['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind)] + samples[name]
+    return '\n'.join(text) + '\n'
+
+
+def callback_name(app, output):
+    # Name of the function of a Dash callback from the 'output' of its request
+    entry = app.callback_map.get(output) if output else None
+    callback = entry.get('callback') if entry else None
+    return getattr(callback, '__name__', 'unknown')
+
+
+def init_app(app):
+    # Time the requests of the Flask server of a Dash app and add the /metrics route
+    import flask
+    server = app.server
+
+    @server.before_request
+    def start_timer():
+        flask.g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def observe_request(response):
+        start = getattr(flask.g, 'metrics_start', None)
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+        request = flask.request
+        if request.path.endswith('/_dash-update-component'):
+            body = request.get_json(silent=True) or {}
+            endpoint = callback_name(app, body.get('output'))
+            observe('payback_callback_seconds', duration, callback=endpoint)
+        else:
+            # routes rather than paths (the ids in the paths would make a metric per job)
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unknown'
+            observe('payback_request_seconds', duration, route=endpoint)
+        if request.content_length is not None:
+            observe('payback_request_bytes', request.content_length, endpoint=endpoint)
+        if response.content_length is not None:
+            observe('payback_response_bytes', response.content_length, endpoint=endpoint)
+        return response
+
+    @server.route('/metrics')
+    def metrics_route():
+        return flask.Response(export(), mimetype='text/plain; version=0.0.4')
+
+    return server
@@ -0,0 +1,132 @@
+# data retreiving
+import pathlib
+
+# data handling
+import numpy as np
+
+# shared arrays, columnar extracts and plotted features of the KDE curves
+from apps import store, columnar, kde
+
+#################### PERCENTILE RANKS (clients compared with the population, one binary search per query) ####################
+# 1) sort once the values of each plotted feature per TARGET class (train extract), and the predictions
+#    of all the clients and per TARGET class (global extract, TARGET of the clients of the train extract)
+# 2) share the sorted arrays between the workers (memory-mapped, rebuilt when the extracts change)
+# 3) percentile of any value, from a client of the database or from an uploaded row: two binary searches
+#
+# The percentile is the mean of the strict and weak ranks (as percentileofscore(kind='mean') of scipy),
+# so the percentile of an age is 100 minus the one of its DAYS_BIRTH.
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../datasets').resolve()
+
+# populations of the sorted arrays (TARGET classes, and all the clients for the predictions)
+CLASSES = ['0', '1']
+PREDICTION = 'PREDICTION'
+
+# features displayed in reverse order (age in years = DAYS_BIRTH / -365)
+REVERSED = ['DAYS_BIRTH']
+
+
+def sorted_values(values):
+    # Known values in increasing order (float32, as in the extracts)
+    values = np.asarray(values, dtype=np.float32)
+    return np.sort(values[~np.isnan(values)])
+
+
+def build_index(train_df, global_df):
+    # Sorted arrays of the features per class, and of the predictions per class and for all the clients
+    index = dict()
+    for column in kde.FEATURES.values():
+        for target in CLASSES:
+            index['%s_%s' % (column, target)] = sorted_values(train_df.loc[train_df['TARGET'] == int(target), column])
+
+    index[PREDICTION + '_all'] = sorted_values(global_df[PREDICTION])
+    known = global_df[['SK_ID_CURR', PREDICTION]].merge(train_df[['SK_ID_CURR', 'TARGET']], on='SK_ID_CURR')
+    for target in CLASSES:
+        index['%s_%s' % (PREDICTION, target)] = sorted_values(known.loc[known['TARGET'] == int(target), PREDICTION])
+    return index
+
+
+def build_from_sources(data_path=DATA_PATH):
+    # Only the needed columns are read (from the columnar folders when they are up to date)
+    train_df = columnar.read_dataset(data_path, pathlib.Path(kde.TRAIN_FILE).stem,
+                                     list(kde.FEATURES.values()) + ['TARGET', 'SK_ID_CURR'])
+    global_df = columnar.read_dataset(data_path, pathlib.Path(kde.GLOBAL_FILE).stem, ['SK_ID_CURR', PREDICTION])
+    return build_index(train_df, global_df)
+
+
+def index_sources(data_path=DATA_PATH):
+    # Files the sorted arrays are built from (train and global extracts)
+    return (columnar.dataset_sources(data_path, pathlib.Path(kde.TRAIN_FILE).stem)
+            + columnar.dataset_sources(data_path, pathlib.Path(kde.GLOBAL_FILE).stem))
+
+
+def index_key(data_path=DATA_PATH):
+    # Fingerprint of the extracts the percentiles are ranked against (e.g. part of the key of the cached uploads)
+    return store.sources_key(index_sources(data_path))
+
+
+def get_index(data_path=DATA_PATH):
+    # Sorted arrays built on first use and memory-mapped (shared by all the workers)
+    return store.shared_arrays('percentiles', index_sources(data_path), lambda: build_from_sources(data_path))
+
+
+def percentile_rank(sorted_array, values):
+    """
+    Percentiles of some values within a population.
+
+    Parameters
+    ----------
+    sorted_array : array of floats
+        The population, sorted (see build_index).
+
+    values : float or array of floats
+        The values to rank.
+
+    Return
+    ------
+    percentiles : float or array of floats
+        Between 0 and 100 (nan for missing values or an empty population).
+
+    """
+
+    values = np.asarray(values, dtype=np.float32)
+    n = len(sorted_array)
+    if n == 0:
+        return np.full(values.shape, np.nan)[()]
+    below = np.searchsorted(sorted_array, values, side='left')
+    not_above = np.searchsorted(sorted_array, values, side='right')
+    percentiles = 100 * (below + not_above) / (2 * n)
+    return np.where(np.isnan(values), np.nan, percentiles)[()]
+
+
+def client_percentiles(index, client):
+    """
+    Percentiles of the displayed values of a client within the TARGET classes.
+
+    Parameters
+    ----------
+    index : dictionary
+        See get_index.
+
+    client : dictionary
+        The values of the client (see clients.lookup_client), with its PREDICTION.
+
+    Return
+    ------
+    percentiles : dictionary
+        {column: {'0': percentile, '1': percentile}} for the plotted features and the PREDICTION
+        (the ages ranked as ages, not as DAYS_BIRTH).
+
+    """
+
+    percentiles = dict()
+    for column in list(kde.FEATURES.values()) + [PREDICTION]:
+        value = client.get(column)
+        ranks = dict()
+        for target in CLASSES:
+            rank = float(percentile_rank(index['%s_%s' % (column, target)], np.nan if value is None else value))
+            ranks[target] = 100 - rank if column in REVERSED else rank
+        percentiles[column] = ranks
+    return percentiles
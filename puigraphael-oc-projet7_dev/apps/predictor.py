@@ -1,77 +1,66 @@
 # Dash environment
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, MATCH
+from dash.exceptions import PreventUpdate
 import dash_table
+import flask
 
 # data retreiving
 import pathlib
+import time
+import functools
 
 # data handling
 import pandas as pd
-import base64
-import io
+import numpy as np
 
-# modeling
-import lightgbm
-import pickle
+# drivers of the predictions, background scoring, cache of the uploads, paged result tables, percentile ranks
+# among the clients of the database, metrics and registry of the published models (fused imputer, scaler and model)
+from apps import explain, jobs, cache, results, percentiles, metrics, registry
 
 # connect to main app.py file
 from app import app
 
 #################### PREDICTOR (new clients from a uploaded file) ####################
-# 1) load modeling utilities (trained model, imputer and scaler made on training base)
-# 2) define predictor function called in parse_content function
-# 3) define parse_content function (with display options)
-# 4) app's layout with uploading data solution and result of parse_content function
-# 5) callback with data retrieving
+# 1) load modeling utilities on first use (trained model with the imputer and scaler folded in, see artifact.py),
+#    swapped without restart when a new model is published (see registry.py)
+# 2) define the scoring of a chunk of an upload (predictions, main drivers and percentiles in a single pass)
+# 3) define the scoring jobs of the uploads (chunked reading in a process pool, cached results)
+# 4) display of the background scoring jobs (progress, results and download routes)
+# 5) app's layout with uploading data solution and the jobs' results
+# 6) callbacks starting a scoring job per uploaded file, polling each job until it is finished (the tables
+#    of the finished jobs are left alone) and serving the pages of the result tables (filtered, sorted and
+#    cut on the server, see results.py)
 
 # get relative data folder
 PATH = pathlib.Path(__file__).parent
 DATA_PATH = PATH.joinpath('../datasets').resolve()
 
-# Load model, imputer and scaler from datasets folder
-loaded_model = pickle.load(open(DATA_PATH.joinpath('payback_predictor.pickle.dat'), 'rb'))
-loaded_imputer = pickle.load(open(DATA_PATH.joinpath('imputer.pickle.dat'), 'rb'))
-loaded_scaler = pickle.load(open(DATA_PATH.joinpath('scaler.pickle.dat'), 'rb'))
-
-def predictor(model, imputer, scaler, row):
-    # Drop unwanted columns
-    row_reduce = row.drop(columns=['SK_ID_CURR','TARGET'])
-    # Impute missing value and normalize
-    row_reduce = imputer.transform(row_reduce)
-    row_reduce = scaler.transform(row_reduce)
-    # Perform prediction
-    pred_value = model.predict_proba(row_reduce)[0,1]
-    return pred_value
-
-def parse_contents(contents, filename):
-    content_type, content_string = contents.split(',')
-
-    decoded = base64.b64decode(content_string)
-    try:
-        if 'csv' in filename:
-            # Assume that the user uploaded a CSV file
-            df = pd.read_csv(
-                io.StringIO(decoded.decode('utf-8')))
-        elif 'xls' in filename:
-            # Assume that the user uploaded an excel file
-            df = pd.read_excel(io.BytesIO(decoded))
-    except Exception as e:
-        print(e)
-        return html.Div([
-            'There was an error processing this file. Please upload a csv or xls format file.'
-        ])
+# Live fused predictor artifact (datasets folder until a model is published to the registry, loaded on first use)
+def get_artifact():
+    return registry.get_artifact(DATA_PATH.joinpath('payback_predictor.npz'))
+
+# columns of the final display
+DISPLAY_COLUMNS = ['SK_ID_CURR','EXT_SOURCE_3','EXT_SOURCE_2',
+                   'EXT_SOURCE_1','DAYS_BIRTH','AMT_CREDIT']
+
+def used_columns(predictor_artifact=None):
+    # columns read from the uploaded files (the model's features and the displayed ones)
+    predictor_artifact = predictor_artifact or get_artifact()
+    return list(dict.fromkeys(predictor_artifact['feature_names'] + DISPLAY_COLUMNS))
+
+@metrics.timed
+def score_chunk(df, version=None):
+    # Perform predictions on a chunk of the uploaded database, with the main drivers of each one (same pass)
+    # (all the chunks of an upload are scored by the version it started with, the live one by default)
+    start = time.perf_counter()
+    predictor_artifact = registry.get_version(version) if version is not None else get_artifact()
+    pred, driver_features, driver_values = explain.score_and_explain(predictor_artifact, df)
 
-    # Perform predictions on uploaded database
-    pred=list()
-    for i in df.index:
-        pred.append(predictor(loaded_model, loaded_imputer, loaded_scaler, df.iloc[[i]]))
+    # Selection of main features for final display (rounded as float64 for a clean display)
+    df_extract = df[DISPLAY_COLUMNS].astype({col: np.float64 for col in DISPLAY_COLUMNS[1:]})
 
-    # Selection of main features for final display
-    df_extract = df[['SK_ID_CURR','EXT_SOURCE_3','EXT_SOURCE_2',
-                     'EXT_SOURCE_1','DAYS_BIRTH','AMT_CREDIT']].copy()
-                                                         
     # Convert 'DAYS' features in years
     df_extract['DAYS_BIRTH'] = df_extract['DAYS_BIRTH'].div(-365)
 
@@ -79,8 +68,14 @@ def parse_contents(contents, filename):
     df_extract.rename(columns={'DAYS_BIRTH': 'AGE (years)'}, inplace=True)
     df_extract.rename(columns={'AMT_CREDIT': 'AMT_CREDIT (dollars)'}, inplace=True)
 
-    # Add the predictions to the dataframe
+    # Add the predictions and their main drivers (contributions in log-odds) to the dataframe
     df_extract['PREDICTION'] = pred
+    df_extract['MAIN DRIVERS'] = explain.drivers_text(predictor_artifact['feature_names'], driver_features, driver_values)
+
+    # Percentiles of the predictions among the clients who repaid and who failed (binary searches, no scan)
+    percentile_index = percentiles.get_index(DATA_PATH)
+    df_extract['PERCENTILE (repaid)'] = percentiles.percentile_rank(percentile_index['PREDICTION_0'], pred)
+    df_extract['PERCENTILE (failed)'] = percentiles.percentile_rank(percentile_index['PREDICTION_1'], pred)
 
     # Round data to improve readabilty
     df_extract = df_extract.round({'EXT_SOURCE_3':3,
@@ -88,16 +83,52 @@ def parse_contents(contents, filename):
                                    'EXT_SOURCE_1':3,
                                    'AGE (years)':0,
                                    'AMT_CREDIT (dollars)':0,
-                                   'PREDICTION': 3})
+                                   'PREDICTION': 3,
+                                   'PERCENTILE (repaid)': 1,
+                                   'PERCENTILE (failed)': 1})
+    metrics.scored(len(df_extract), time.perf_counter() - start, source='upload')
+    return df_extract
+
+def error_message():
+    return html.Div([
+        'There was an error processing this file. Please upload a csv or xls format file.'
+    ])
+
+def result_table(job_id):
+    # Table of the results of a job: only its first page is sent, the next ones on demand
+    with metrics.timer('render'):
+        return build_result_table(job_id)
+
+def build_result_table(job_id):
+    result = results.load_result(job_id)
+    if result is None:
+        return error_message()
+    rows = results.query_rows(result)
 
     return html.Div([
         html.Br(),
-        html.Label('Main features and prediction of payback failure probability:'),
-        html.Br(),
+        html.Label('Main features and prediction of payback failure probability (%i clients, model %s):'
+                   % (result['rows'], (jobs.read_status(job_id) or {}).get('model_version') or 'unknown')),
+        dcc.RadioItems(
+            id={'type': 'result-view', 'index': job_id},
+            options=[{'label': 'all the clients' if n == 0 else 'top %i riskiest' % n, 'value': n}
+                     for n in results.TOP_N],
+            value=0,
+            labelStyle={'display': 'inline-block', 'margin-right': '10px'},
+        ),
         dash_table.DataTable(
-            data=df_extract.to_dict('records'),
-            columns=[{'name': i, 'id': i} for i in df_extract.columns],
-            sort_action='native',
+            id={'type': 'result-table', 'index': job_id},
+            data=results.page_records(result, rows),
+            columns=results.table_columns(result),
+            page_action='custom',
+            page_current=0,
+            page_size=results.PAGE_SIZE,
+            page_count=results.page_count(rows),
+            sort_action='custom',
+            sort_mode='single',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             editable=False,
             style_data_conditional=[
                 {
@@ -121,6 +152,85 @@ def parse_contents(contents, filename):
         ),
     ])
 
+def start_job(contents, filename):
+    # Scoring job of an uploaded file (already done if the file was scored by the same model,
+    # with the percentiles ranked against the same extracts)
+    predictor_artifact = get_artifact()
+    version = predictor_artifact['version']
+    key = cache.upload_key(contents, filename, version, percentiles.index_key(DATA_PATH))
+    df_extract = cache.get(key)
+    if df_extract is not None:
+        return jobs.finished_job(filename, df_extract, version)
+
+    # the job keeps this version even if a new model goes live meanwhile, its results are cached once done
+    return jobs.submit(contents, filename, functools.partial(score_chunk, version=version),
+                       used_columns(predictor_artifact),
+                       on_done=lambda job_id: cache.put(key, pd.read_csv(jobs.result_path(job_id))),
+                       model_version=version)
+
+def is_finished(job_id):
+    # Done, failed or unknown (e.g. removed): nothing left to poll
+    return (jobs.read_status(job_id) or {}).get('state') in (None, 'done', 'error')
+
+def job_block(job_id):
+    # Display of a job and its own polling (disabled for a finished job)
+    return html.Div([
+        html.Div(job_output(job_id), id={'type': 'job-output', 'index': job_id}),
+        dcc.Interval(id={'type': 'job-interval', 'index': job_id}, interval=1000, disabled=is_finished(job_id)),
+    ])
+
+def job_output(job_id):
+    # Display of a background scoring job: progress, error or results
+    status = jobs.read_status(job_id)
+    if status is None or status['state'] == 'error':
+        return error_message()
+
+    if status['state'] != 'done':
+        return html.Div([
+            html.Br(),
+            html.Label('Scoring %s: %i rows done' % (status['filename'], status['rows'])),
+            html.Br(),
+            html.Progress(value=str(status['progress']), max='1'),
+        ])
+
+    # full results as downloads (compressed), the table itself is paged
+    links = [html.A('Download the predictions (csv)', href='/predictor/jobs/%s/result.csv' % job_id), ' | ',
+             html.A('gzip csv', href='/predictor/jobs/%s/result.csv.gz' % job_id)]
+    if results.pyarrow is not None:
+        links += [' | ', html.A('parquet', href='/predictor/jobs/%s/result.parquet' % job_id)]
+    return html.Div([result_table(job_id), html.Div(links)])
+
+
+# Download of the results of a job (from any worker: the results are on disk)
+@app.server.route('/predictor/jobs/<job_id>/result.csv')
+def download_result(job_id):
+    try:
+        path = jobs.result_path(job_id)
+    except ValueError:
+        flask.abort(404)
+    if not path.exists():
+        flask.abort(404)
+    filename = (jobs.read_status(job_id) or {}).get('filename', 'upload')
+    return flask.send_file(str(path), mimetype='text/csv', as_attachment=True,
+                           download_name='predictions_' + filename.rsplit('.', 1)[0] + '.csv')
+
+
+# Compressed downloads of the results of a job (compressed once, then sent as files)
+@app.server.route('/predictor/jobs/<job_id>/result.<any("csv.gz", parquet):extension>')
+def download_compressed_result(job_id, extension):
+    try:
+        if not jobs.result_path(job_id).exists():
+            flask.abort(404)
+    except ValueError:
+        flask.abort(404)
+    path = results.gzip_path(job_id) if extension == 'csv.gz' else results.parquet_path(job_id)
+    if path is None:
+        flask.abort(404)
+    filename = (jobs.read_status(job_id) or {}).get('filename', 'upload')
+    mimetype = 'application/gzip' if extension == 'csv.gz' else 'application/vnd.apache.parquet'
+    return flask.send_file(str(path), mimetype=mimetype, as_attachment=True,
+                           download_name='predictions_' + filename.rsplit('.', 1)[0] + '.' + extension)
+
 
 layout = html.Div([
     
@@ -136,15 +246,64 @@ layout = html.Div([
         ),
         
         html.Div(id='output-data-upload'),
+
+        # IDs of the scoring jobs of the last upload (each one polled until it is finished, see job_block)
+        dcc.Store(id='predictor-jobs'),
     ])
 
 
-@app.callback(Output('output-data-upload', 'children'),
+@app.callback(Output('predictor-jobs', 'data'),
               Input('upload-data', 'contents'),
               Input('upload-data', 'filename'))
 def update_output(list_of_contents, list_of_names):
+    # Start a background scoring job per uploaded file and return right away
     if list_of_contents is not None:
-        children = [
-            parse_contents(c, n) for c, n in
-            zip(list_of_contents, list_of_names)]
-        return children
\ No newline at end of file
+        return [start_job(c, n) for c, n in
+                zip(list_of_contents, list_of_names)]
+
+
+@app.callback(Output('output-data-upload', 'children'),
+              Input('predictor-jobs', 'data'))
+def update_jobs(job_ids):
+    # Display of the jobs of an upload (built once: each job is then polled on its own)
+    if job_ids is None:
+        raise PreventUpdate
+    return [job_block(job_id) for job_id in job_ids]
+
+
+@app.callback(Output({'type': 'job-output', 'index': MATCH}, 'children'),
+              Output({'type': 'job-interval', 'index': MATCH}, 'disabled'),
+              Input({'type': 'job-interval', 'index': MATCH}, 'n_intervals'),
+              State({'type': 'job-interval', 'index': MATCH}, 'id'),
+              prevent_initial_call=True)
+def update_job(n_intervals, interval_id):
+    # Progress of a running job, then its results once (its polling stops: the table keeps its page,
+    # sort and filters while other jobs are running)
+    job_id = interval_id['index']
+    return job_output(job_id), is_finished(job_id)
+
+
+@app.callback(Output({'type': 'result-table', 'index': MATCH}, 'data'),
+              Output({'type': 'result-table', 'index': MATCH}, 'page_count'),
+              Output({'type': 'result-table', 'index': MATCH}, 'page_current'),
+              Input({'type': 'result-table', 'index': MATCH}, 'page_current'),
+              Input({'type': 'result-table', 'index': MATCH}, 'page_size'),
+              Input({'type': 'result-table', 'index': MATCH}, 'sort_by'),
+              Input({'type': 'result-table', 'index': MATCH}, 'filter_query'),
+              Input({'type': 'result-view', 'index': MATCH}, 'value'),
+              State({'type': 'result-table', 'index': MATCH}, 'id'),
+              prevent_initial_call=True)
+def update_table(page_current, page_size, sort_by, filter_query, top_n, table_id):
+    # Visible page of a result table (filtered, reduced to the riskiest clients, sorted on the server)
+    try:
+        result = results.load_result(table_id['index'])
+    except ValueError:
+        result = None
+    if result is None:
+        raise PreventUpdate
+    rows = results.query_rows(result, filter_query, sort_by, top_n or 0)
+    page_size = page_size or results.PAGE_SIZE
+    # a page beyond the filtered rows shows the last one
+    page_count = results.page_count(rows, page_size)
+    page_current = min(page_current or 0, page_count - 1)
+    return results.page_records(result, rows, page_current, page_size), page_count, page_current
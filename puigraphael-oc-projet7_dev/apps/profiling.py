@@ -0,0 +1,251 @@
+# data retreiving
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import itertools
+import pathlib
+import tempfile
+import threading
+import collections
+import contextlib
+from urllib.parse import urlparse, parse_qs
+
+# names of the Dash callbacks
+from apps import metrics
+
+#################### PROFILING (chosen requests sampled, written as flame graphs) ####################
+# 1) choose the requests to profile: 'X-Profile' header, 'profile' query flag (of the request or of
+#    the page sending the Dash callbacks) or a random sample of the requests (PROFILE_RATE)
+# 2) a thread samples the stack of the thread answering the request every PROFILE_INTERVAL seconds
+#    (wall clock: time waiting for files or native code is seen too)
+# 3) the samples are written as a speedscope file (https://www.speedscope.app) or as collapsed
+#    stacks (flamegraph.pl, inferno), named after the callback or route and the input size
+# 4) the scoring job started by a profiled upload is profiled too, in its own process
+#
+# Nothing is hooked unless PROFILING=1: requests are not slowed down when profiling is off.
+
+# profiling allowed (hooks added to the server) and share of the requests profiled at random
+ENABLED = os.environ.get('PROFILING', '0') == '1'
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', 0))
+
+# delay between two samples (in seconds), output format ('speedscope' or 'collapsed')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'speedscope')
+
+# folder of the profiles, only the most recent ones are kept
+PROFILES_PATH = pathlib.Path(os.environ.get('PROFILES_PATH', pathlib.Path(tempfile.gettempdir()).joinpath('payback_profiles')))
+MAX_PROFILES = int(os.environ.get('PROFILES_MAX', 100))
+
+HEADER = 'X-Profile'
+QUERY_FLAG = 'profile'
+
+# number of the profiles of this process (unique file names)
+_counter = itertools.count()
+
+logger = logging.getLogger(__name__)
+
+# frames shown relative to the app folder (the other ones by their file name)
+APP_PATH = str(pathlib.Path(__file__).parent.parent.resolve())
+
+
+class Sampler(threading.Thread):
+    # Count the stacks of another thread, sampled at regular intervals
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                # root first
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def frame_file(filename):
+    if filename.startswith(APP_PATH):
+        return os.path.relpath(filename, APP_PATH)
+    return os.path.basename(filename)
+
+
+def frame_label(frame):
+    name, filename, line = frame
+    return '%s (%s:%i)' % (name, frame_file(filename), line)
+
+
+def collapsed_text(stacks):
+    # One line per stack: frames from the root joined by ';', then the number of samples
+    return ''.join('%s %i\n' % (';'.join(frame_label(frame).replace(';', ':') for frame in stack), count)
+                   for stack, count in stacks.most_common())
+
+
+def speedscope_profile(stacks, interval, name):
+    # Sampled profile of the speedscope file format (weights in milliseconds)
+    frames = dict()
+    samples = []
+    weights = []
+    for stack, count in stacks.most_common():
+        samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(count * interval * 1e3)
+    return {'$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'payback profiling',
+            'shared': {'frames': [{'name': frame[0], 'file': frame_file(frame[1]), 'line': frame[2]}
+                                  for frame in frames]},
+            'profiles': [{'type': 'sampled', 'name': name, 'unit': 'milliseconds',
+                          'startValue': 0, 'endValue': sum(weights),
+                          'samples': samples, 'weights': weights}]}
+
+
+def remove_old_profiles(max_profiles=MAX_PROFILES):
+    # Keep only the most recent profiles
+    paths = sorted(PROFILES_PATH.glob('*.*'), key=lambda path: path.stat().st_mtime)
+    for path in paths[:max(0, len(paths) - max_profiles)]:
+        path.unlink(missing_ok=True)
+
+
+def write_profile(stacks, endpoint, input_bytes, duration, interval=PROFILE_INTERVAL, profile_format=PROFILE_FORMAT):
+    """
+    Write the samples of a request to the profiles folder.
+
+    Parameters
+    ----------
+    stacks : Counter
+        Number of samples of each stack (see Sampler).
+
+    endpoint : string
+        The Dash callback or the route of the request.
+
+    input_bytes : integer
+        The size of the request body (e.g. the base64 upload of update_output).
+
+    duration : float
+        The duration of the request (seconds).
+
+    interval, profile_format :
+        See PROFILE_INTERVAL and PROFILE_FORMAT.
+
+    Return
+    ------
+    path : pathlib.Path
+        The written file.
+
+    """
+
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    name = '%s, %i bytes in, %.3f s' % (endpoint, input_bytes, duration)
+    now = time.time()
+    stem = '%s.%03i_%s_%iB_%i-%i' % (time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now % 1 * 1000),
+                                     re.sub('[^A-Za-z0-9_-]+', '-', endpoint).strip('-'), input_bytes,
+                                     os.getpid(), next(_counter))
+
+    if profile_format == 'collapsed':
+        path = PROFILES_PATH.joinpath(stem + '.folded')
+        text = collapsed_text(stacks)
+    else:
+        path = PROFILES_PATH.joinpath(stem + '.speedscope.json')
+        text = json.dumps(speedscope_profile(stacks, interval, name))
+
+    # written at once (a profile being read is never partial)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    tmp_path.replace(path)
+    remove_old_profiles()
+    return path
+
+
+@contextlib.contextmanager
+def profiled(endpoint, input_bytes, enabled=True):
+    # Profile a block of code run by the current thread (e.g. a scoring job)
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    sampler = Sampler(threading.get_ident())
+    sampler.start()
+    try:
+        yield
+    finally:
+        try:
+            write_profile(sampler.stop(), endpoint, input_bytes, time.perf_counter() - start)
+        except OSError:
+            logger.exception('profile of %s not written', endpoint)
+
+
+def is_profiled():
+    # Whether the current request is being profiled (e.g. to profile the job it starts)
+    import flask
+    return flask.has_request_context() and flask.g.get('profile_sampler') is not None
+
+
+def is_flagged(url):
+    # 'profile' flag in the query of a url (any value but 0)
+    values = parse_qs(urlparse(url or '').query, keep_blank_values=True).get(QUERY_FLAG)
+    return bool(values) and values[-1] not in ('0', 'false')
+
+
+def should_profile(request, rate=PROFILE_RATE):
+    # Profile the request if asked (header or query flag) or if drawn at random
+    header = request.headers.get(HEADER)
+    if header is not None:
+        return header not in ('0', 'false')
+    if QUERY_FLAG in request.args:
+        return is_flagged(request.url)
+    # the callbacks of a page opened with ?profile=1
+    if is_flagged(request.referrer):
+        return True
+    return rate > 0 and random.random() < rate
+
+
+def init_app(app):
+    # Profile the chosen requests of the Flask server of a Dash app (nothing is added unless PROFILING=1)
+    if not ENABLED:
+        return app.server
+    import flask
+    server = app.server
+
+    @server.before_request
+    def start_sampler():
+        if should_profile(flask.request):
+            flask.g.profile_start = time.perf_counter()
+            flask.g.profile_sampler = Sampler(threading.get_ident())
+            flask.g.profile_sampler.start()
+
+    @server.teardown_request
+    def stop_sampler(exception=None):
+        sampler = flask.g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        stacks = sampler.stop()
+        request = flask.request
+        if request.path.endswith('/_dash-update-component'):
+            endpoint = metrics.callback_name(app, (request.get_json(silent=True) or {}).get('output'))
+        else:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unknown'
+        try:
+            write_profile(stacks, endpoint, request.content_length or 0,
+                          time.perf_counter() - flask.g.profile_start)
+        except OSError:
+            # profiling never breaks the app
+            logger.exception('profile of %s not written', endpoint)
+
+    return server
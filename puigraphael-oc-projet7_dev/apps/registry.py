@@ -0,0 +1,315 @@
+# data retreiving
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import pathlib
+import argparse
+import threading
+
+# data handling
+import numpy as np
+
+# fused predictor artifacts
+from apps import artifact
+
+#################### ARTIFACT REGISTRY (new models deployed without restarting the workers) ####################
+# 1) publish: copy an artifact into its own version folder, with the data files of the dashboard scored by
+#    this model, then activate it: install its data files and point CURRENT to it (replaced at once)
+# 2) every process serves the live artifact, loaded on first use (the artifact of the datasets folder
+#    as long as nothing is published)
+# 3) a thread of every process watches CURRENT: a new version is loaded and warmed up in the background,
+#    then swapped in at once (a single assignment)
+# 4) a request keeps the artifact it started with and a scoring job the version it was submitted with,
+#    so they finish on the old model; every result reports the version that scored it
+#
+# The PREDICTION column of the dashboard comes from global_general_extract.csv: a version is activated
+# (published or rolled back to) only with the extract it was published with, installed in the datasets
+# folder with its explanations if any. The dashboard follows the live version.
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath('../datasets').resolve()
+
+# folder of the versions (not tracked by git), pointer to the live one and delay between two checks
+# of the pointer (in seconds)
+REGISTRY_PATH = pathlib.Path(os.environ.get('REGISTRY_PATH', DATA_PATH.joinpath('registry')))
+CURRENT_FILE = 'CURRENT'
+POLL_INTERVAL = float(os.environ.get('REGISTRY_POLL_INTERVAL', 5))
+
+ARTIFACT_FILE = 'payback_predictor.npz'
+
+# files of the dashboard published with a model (kept in its version folder, copied to the datasets
+# folder when it goes live) and the ones a version cannot go live without
+DATA_FILES = {'extract': 'global_general_extract.csv', 'explanations': 'explanations.npz'}
+REQUIRED_FILES = ['extract']
+
+# rows scored to warm up a new version before it goes live
+WARMUP_ROWS = 64
+
+# artifacts loaded by this process: the live one, and the older ones still used by jobs (by version)
+_live = None
+_versions = dict()
+_lock = threading.RLock()
+_watcher = None
+_default_path = DATA_PATH.joinpath(ARTIFACT_FILE)
+
+logger = logging.getLogger(__name__)
+
+
+def version_path(version):
+    # Folder of a version (the version may come from a job: check it before building a path)
+    if not isinstance(version, str) or re.fullmatch('[0-9a-f]{12}', version) is None:
+        raise ValueError('Invalid model version: %r' % (version,))
+    return REGISTRY_PATH.joinpath(version)
+
+
+def read_current():
+    # Version pointed by CURRENT (None if nothing is published)
+    try:
+        with open(REGISTRY_PATH.joinpath(CURRENT_FILE)) as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def set_current(version):
+    # Point CURRENT to a published version (replaced at once: a worker never reads a partial file)
+    if not version_path(version).joinpath(ARTIFACT_FILE).exists():
+        raise ValueError('Unknown model version: %s' % version)
+    tmp_path = REGISTRY_PATH.joinpath('%s.%i.tmp' % (CURRENT_FILE, os.getpid()))
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version, 'activated': time.time()}, f)
+    tmp_path.replace(REGISTRY_PATH.joinpath(CURRENT_FILE))
+
+
+def install_file(source, destination):
+    # Copy a file next to its destination first, then replace it at once
+    destination = pathlib.Path(destination)
+    tmp_path = destination.with_name('%s.%i.tmp' % (destination.name, os.getpid()))
+    shutil.copyfile(source, tmp_path)
+    tmp_path.replace(destination)
+
+
+def publish(artifact_path, activate=True, data_files=None, data_path=DATA_PATH):
+    """
+    Add an artifact to the registry.
+
+    Parameters
+    ----------
+    artifact_path : path
+        The artifact (see artifact.save_artifact).
+
+    activate : boolean
+        Make it the live version (the workers swap to it within POLL_INTERVAL seconds).
+
+    data_files : dictionary
+        Files of the dashboard scored by this model ({'extract': path, 'explanations': path}),
+        kept in the version folder and installed in the data folder whenever the version goes
+        live (the extract is required to activate it).
+
+    data_path : path
+        The data folder of the dashboard.
+
+    Return
+    ------
+    version : string
+        The version of the artifact.
+
+    """
+
+    # the first publication keeps the artifact of the datasets folder with its data files (jobs still
+    # using it, roll back)
+    data_path = pathlib.Path(data_path)
+    default_path = data_path.joinpath(ARTIFACT_FILE)
+    if read_current() is None and default_path.exists() and default_path.resolve() != pathlib.Path(artifact_path).resolve():
+        publish(default_path, activate=False, data_path=data_path,
+                data_files={key: data_path.joinpath(name) for key, name in DATA_FILES.items()
+                            if data_path.joinpath(name).exists()})
+
+    # the artifact is loaded once: a broken file is never published
+    version = artifact.load_artifact(artifact_path)['version']
+    folder = version_path(version)
+    if not folder.joinpath(ARTIFACT_FILE).exists():
+        tmp_folder = folder.with_name('%s.%i.tmp' % (folder.name, os.getpid()))
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        tmp_folder.mkdir(parents=True)
+        shutil.copyfile(artifact_path, tmp_folder.joinpath(ARTIFACT_FILE))
+        tmp_folder.rename(folder)
+
+    # data files given again replace the stored ones (e.g. an extract scored again)
+    for key, source in (data_files or {}).items():
+        if source is not None:
+            install_file(source, folder.joinpath(DATA_FILES[key]))
+
+    if activate:
+        activate_version(version, data_path)
+    return version
+
+
+def activate_version(version, data_path=DATA_PATH):
+    # Install the data files of a published version in the data folder, then make it live
+    # (a version without its extract is refused: the dashboard would show the predictions of another model)
+    folder = version_path(version)
+    if not folder.joinpath(ARTIFACT_FILE).exists():
+        raise ValueError('Unknown model version: %s' % version)
+    missing = [key for key in REQUIRED_FILES if not folder.joinpath(DATA_FILES[key]).exists()]
+    if missing:
+        raise ValueError('Model version %s was published without its %s: publish it again with --%s.'
+                         % (version, ', '.join(missing), ' --'.join(missing)))
+
+    # (drivers left by another model are not shown, see dashboard.get_explanations)
+    for name in DATA_FILES.values():
+        if folder.joinpath(name).exists():
+            install_file(folder.joinpath(name), pathlib.Path(data_path).joinpath(name))
+    set_current(version)
+
+
+def list_versions():
+    # Published versions, the oldest first
+    if not REGISTRY_PATH.exists():
+        return []
+    folders = [folder for folder in REGISTRY_PATH.iterdir()
+               if re.fullmatch('[0-9a-f]{12}', folder.name) and folder.joinpath(ARTIFACT_FILE).exists()]
+    return [folder.name for folder in sorted(folders, key=lambda folder: folder.joinpath(ARTIFACT_FILE).stat().st_mtime)]
+
+
+def warm_up(loaded_artifact, n_rows=WARMUP_ROWS):
+    # Score a few rows with the paths of the app (probabilities and contributions) before going live
+    X = np.zeros((n_rows, len(loaded_artifact['feature_names'])), dtype=np.float32)
+    X[::2] = np.nan
+    loaded_artifact['booster'].predict(X)
+    loaded_artifact['booster'].predict(X, pred_contrib=True)
+    return loaded_artifact
+
+
+def load_version(version):
+    # Artifact of a published version, warmed up
+    return warm_up(artifact.load_artifact(version_path(version).joinpath(ARTIFACT_FILE)))
+
+
+def get_artifact(default_path=None):
+    """
+    Live artifact of this process.
+
+    Parameters
+    ----------
+    default_path : path
+        The artifact served as long as nothing is published (datasets folder by default).
+
+    Return
+    ------
+    artifact : dictionary
+        See artifact.load_artifact. Keep it for the whole request: the next call may return
+        a newer version.
+
+    """
+
+    global _live, _default_path
+    if _live is None:
+        with _lock:
+            if _live is None:
+                if default_path is not None:
+                    _default_path = pathlib.Path(default_path)
+                version = read_current()
+                loaded = load_version(version) if version is not None else artifact.load_artifact(_default_path)
+                _versions[loaded['version']] = loaded
+                _live = loaded
+    start_watcher()
+    return _live
+
+
+def live_version():
+    return get_artifact()['version']
+
+
+def get_version(version):
+    # Artifact of a given version (e.g. the version a job was submitted with)
+    live = get_artifact()
+    if live['version'] == version:
+        return live
+    with _lock:
+        if version not in _versions:
+            _versions[version] = load_version(version)
+        return _versions[version]
+
+
+def swap(version):
+    # Load and warm up a version outside of the lock, then make it live at once
+    global _live
+    loaded = _versions.get(version) or load_version(version)
+    with _lock:
+        _versions[version] = loaded
+        previous, _live = _live, loaded
+        # older versions are loaded again if a job still needs them
+        for old in list(_versions):
+            if old not in (version, previous['version'] if previous else None):
+                del _versions[old]
+    logger.info('model %s live (process %i)', version, os.getpid())
+
+
+def check_current():
+    # Swap to the version pointed by CURRENT if it changed
+    version = read_current()
+    if version is not None and _live is not None and version != _live['version']:
+        swap(version)
+
+
+def watch(interval):
+    # Thread of the watcher: check CURRENT (a single small read) every interval seconds
+    while True:
+        time.sleep(interval)
+        try:
+            check_current()
+        except Exception:
+            # keep serving the live version (e.g. a partial copy of a new one)
+            logger.exception('model reload failed')
+
+
+def start_watcher(interval=POLL_INTERVAL):
+    global _watcher
+    if _watcher is None and interval > 0:
+        with _lock:
+            if _watcher is None:
+                _watcher = threading.Thread(target=watch, args=(interval,), daemon=True)
+                _watcher.start()
+
+
+def after_fork():
+    # Threads are not copied by fork: a forked process (e.g. of the scoring pool) starts its own watcher
+    global _watcher, _lock
+    _watcher = None
+    _lock = threading.RLock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
+if __name__ == '__main__':
+    # e.g. python -m apps.registry publish new_predictor.npz --extract new_global_general_extract.csv
+    parser = argparse.ArgumentParser(description='Publish predictor artifacts to the running app.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish_parser = commands.add_parser('publish', help='add an artifact and make it live')
+    publish_parser.add_argument('artifact', help='artifact file (python -m apps.artifact)')
+    publish_parser.add_argument('--extract', help='global_general_extract.csv scored by this model')
+    publish_parser.add_argument('--explanations', help='explanations.npz of this model (python -m apps.explain)')
+    publish_parser.add_argument('--inactive', action='store_true', help='add the version without making it live')
+    activate_parser = commands.add_parser('activate', help='make a published version live (e.g. roll back)')
+    activate_parser.add_argument('version')
+    commands.add_parser('list', help='list the published versions')
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        version = publish(args.artifact, activate=not args.inactive,
+                          data_files={'extract': args.extract, 'explanations': args.explanations})
+        print('model %s published%s' % (version, '' if args.inactive else ' and live'))
+    elif args.command == 'activate':
+        activate_version(args.version)
+        print('model %s live' % args.version)
+    else:
+        current = read_current()
+        for version in list_versions():
+            print(version + (' (live)' if version == current else ''))
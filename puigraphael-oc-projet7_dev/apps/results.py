@@ -0,0 +1,242 @@
+# data retreiving
+import os
+import re
+import gzip
+import json
+import shutil
+import pathlib
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# Parquet downloads are optional (pyarrow is not a requirement of the app)
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# results of the scoring jobs and columnar folders
+from apps import jobs, columnar
+
+#################### RESULT TABLES (scored uploads served page by page) ####################
+# 1) convert the result csv of a job once into a columnar folder next to it (one .npy file per column,
+#    texts as utf-8 bytes), memory-mapped by every worker
+# 2) filter (filter_query of the DataTable), keep the N riskiest rows if asked, sort (sort_by) and cut
+#    the page on the server: only the visible rows are sent to the browser
+# 3) compressed downloads of the whole result (gzip csv, and parquet when pyarrow is installed),
+#    written once in the job folder
+#
+# The filter_query strings are those written by the DataTable's filter row: comparisons of a column
+# with a value ('{PREDICTION} >= 0.5'), joined by '&&'.
+
+COLUMNS_FOLDER = 'result.columns'
+GZIP_FILE = 'result.csv.gz'
+PARQUET_FILE = 'result.parquet'
+
+# rows of a page, and choices of the riskiest rows view (0: all the rows)
+PAGE_SIZE = 25
+TOP_N = [0, 10, 100, 1000]
+
+# column of the riskiest rows
+RISK_COLUMN = 'PREDICTION'
+
+# a comparison of the filter row ('{column} operator value') and the other spellings of the operators
+FILTER_PART = re.compile(r'^\s*\{(?P<column>[^}]+)\}\s*'
+                         r'(?P<operator>>=|<=|!=|<|>|=|(?:ge|le|lt|gt|ne|eq|contains)\b)\s*(?P<value>.*?)\s*$')
+OPERATORS = {'ge': '>=', 'le': '<=', 'lt': '<', 'gt': '>', 'ne': '!=', 'eq': '='}
+
+
+def columns_folder(job_id):
+    return jobs.job_path(job_id).joinpath(COLUMNS_FOLDER)
+
+
+def write_columns(job_id):
+    # Columnar folder of the result of a job (written once, renamed at once: a reader sees all the files or none)
+    folder = columns_folder(job_id)
+    df = pd.read_csv(jobs.result_path(job_id))
+    tmp_folder = folder.with_name('%s.%i.tmp' % (folder.name, os.getpid()))
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    tmp_folder.mkdir(parents=True)
+
+    dtypes = dict()
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            # texts as utf-8 bytes (no pickled objects in the .npy files)
+            values = df[col].fillna('').str.encode('utf-8').to_numpy().astype(np.bytes_)
+        np.save(tmp_folder.joinpath(col + '.npy'), values)
+        dtypes[col] = values.dtype.str
+    with open(tmp_folder.joinpath(columnar.MANIFEST_FILE), 'w') as f:
+        json.dump({'columns': list(df.columns), 'dtypes': dtypes, 'rows': len(df)}, f)
+
+    try:
+        tmp_folder.rename(folder)
+    except OSError:
+        # another worker was faster: keep its files
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+
+def load_result(job_id):
+    # Columns of the result of a job, memory-mapped (None if the job has no result)
+    folder = columns_folder(job_id)
+    if not folder.joinpath(columnar.MANIFEST_FILE).exists():
+        if not jobs.result_path(job_id).exists():
+            return None
+        try:
+            write_columns(job_id)
+        except pd.errors.EmptyDataError:
+            # nothing scored (empty upload)
+            return None
+    manifest = columnar.read_manifest(folder)
+    return {'columns': manifest['columns'], 'rows': manifest['rows'],
+            'values': columnar.load_columns(folder, manifest['columns'])}
+
+
+def is_text(values):
+    return values.dtype.kind == 'S'
+
+
+def split_filter_part(filter_part):
+    # Column, operator and value of a comparison of the filter row (None if not understood)
+    match = FILTER_PART.match(filter_part)
+    if match is None:
+        return None
+    value = match['value']
+    # quoted values
+    if len(value) > 1 and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    return match['column'], OPERATORS.get(match['operator'], match['operator']), value
+
+
+def filter_mask(result, filter_query):
+    # Rows matching all the comparisons of a filter_query (the comparisons not understood are ignored)
+    mask = np.ones(result['rows'], dtype=bool)
+    for filter_part in (filter_query or '').split(' && '):
+        part = split_filter_part(filter_part)
+        if part is None or part[0] not in result['values']:
+            continue
+        column, operator, value = part
+        values = result['values'][column]
+
+        if is_text(values):
+            value = value.encode('utf-8')
+            if operator == 'contains':
+                mask &= np.char.find(values, value) >= 0
+            elif operator in ('=', '!='):
+                mask &= (values == value) if operator == '=' else (values != value)
+            continue
+
+        try:
+            value = float(value)
+        except ValueError:
+            mask &= False
+            continue
+        if operator in ('=', 'contains'):
+            mask &= values == value
+        elif operator == '!=':
+            mask &= values != value
+        elif operator == '>=':
+            mask &= values >= value
+        elif operator == '<=':
+            mask &= values <= value
+        elif operator == '<':
+            mask &= values < value
+        else:
+            mask &= values > value
+    return mask
+
+
+def sort_order(values, descending=False):
+    # Stable order of some values, missing values last in both directions
+    if is_text(values):
+        order = np.argsort(values, kind='stable')
+        return order[::-1] if descending else order
+    values = np.asarray(values, dtype=np.float64)
+    return np.argsort(-values if descending else values, kind='stable')
+
+
+def query_rows(result, filter_query='', sort_by=None, top_n=0):
+    """
+    Positions of the rows of a result table, as displayed.
+
+    Parameters
+    ----------
+    result : dictionary
+        See load_result.
+
+    filter_query : string
+        The filter_query of the DataTable.
+
+    sort_by : list of dictionaries
+        The sort_by of the DataTable ({'column_id': ..., 'direction': 'asc' or 'desc'}, first key first).
+
+    top_n : integer
+        Keep only the N highest predictions among the filtered rows (all the rows if 0),
+        ordered by decreasing risk unless sorted otherwise.
+
+    Return
+    ------
+    rows : array of integers
+        The positions of the displayed rows, in the display order.
+
+    """
+
+    rows = np.flatnonzero(filter_mask(result, filter_query))
+
+    if top_n and RISK_COLUMN in result['values']:
+        risk = np.asarray(result['values'][RISK_COLUMN][rows], dtype=np.float64)
+        rows = rows[sort_order(risk, descending=True)[:top_n]]
+
+    # the last sort key first (stable sorts: the first key decides)
+    for sort in reversed(sort_by or []):
+        if sort['column_id'] in result['values']:
+            values = result['values'][sort['column_id']][rows]
+            rows = rows[sort_order(values, descending=sort['direction'] == 'desc')]
+    return rows
+
+
+def page_records(result, rows, page_current=0, page_size=PAGE_SIZE):
+    # Records of the rows of a page (json types: missing values as None, texts decoded)
+    page = rows[page_current * page_size:(page_current + 1) * page_size]
+    data = dict()
+    for col in result['columns']:
+        values = result['values'][col][page]
+        if is_text(values):
+            data[col] = [value.decode('utf-8') for value in values.tolist()]
+        else:
+            data[col] = [None if value != value else value for value in values.tolist()]
+    return [dict(zip(data, row)) for row in zip(*data.values())]
+
+
+def page_count(rows, page_size=PAGE_SIZE):
+    return max(1, -(-len(rows) // page_size))
+
+
+def table_columns(result):
+    # Columns of the DataTable (numbers compared as numbers by the filter row)
+    return [{'name': col, 'id': col, 'type': 'text' if is_text(result['values'][col]) else 'numeric'}
+            for col in result['columns']]
+
+
+def gzip_path(job_id):
+    # Gzip csv of the result of a job (compressed once)
+    path = jobs.job_path(job_id).joinpath(GZIP_FILE)
+    if not path.exists():
+        tmp_path = path.with_name('%s.%i.tmp' % (path.name, os.getpid()))
+        with open(jobs.result_path(job_id), 'rb') as source, gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            shutil.copyfileobj(source, f, 1 << 20)
+        tmp_path.replace(path)
+    return path
+
+
+def parquet_path(job_id):
+    # Parquet file of the result of a job (written once, None without pyarrow)
+    if pyarrow is None:
+        return None
+    path = jobs.job_path(job_id).joinpath(PARQUET_FILE)
+    if not path.exists():
+        tmp_path = path.with_name('%s.%i.tmp' % (path.name, os.getpid()))
+        pd.read_csv(jobs.result_path(job_id)).to_parquet(tmp_path, engine='pyarrow', compression='snappy', index=False)
+        tmp_path.replace(path)
+    return path
@@ -0,0 +1,118 @@
+# data retreiving
+import os
+import pathlib
+import hashlib
+import shutil
+import tempfile
+import threading
+
+# data handling
+import numpy as np
+
+#################### SHARED STORE (lazy loading, read-only arrays shared by the workers) ####################
+# 1) load the heavy objects on first use instead of at import (once per process, or again when
+#    what they are built from changes: source files, live model version)
+# 2) write the large read-only arrays once as .npy files, keyed by the state of their source files
+# 3) memory-map these files in every worker: the pages of the arrays are shared by all the processes
+#
+# Several workers may build the same arrays at once on a cold start: each one writes into its
+# own temporary folder and the first rename wins, the others just map the winner's files.
+
+# folder of the shared arrays
+STORE_PATH = pathlib.Path(os.environ.get('STORE_PATH', pathlib.Path(tempfile.gettempdir()).joinpath('payback_store')))
+
+# objects already loaded by this process (name -> object, or name -> (key, object) for latest)
+_loaded = dict()
+_latest = dict()
+_lock = threading.RLock()
+
+
+def once(name, load):
+    # Object returned by load(), called on first use only (per process)
+    with _lock:
+        if name not in _loaded:
+            _loaded[name] = load()
+        return _loaded[name]
+
+
+def latest(name, key, load):
+    # Object returned by load(), called again when the key changes (the previous object is dropped)
+    with _lock:
+        cached = _latest.get(name)
+        if cached is None or cached[0] != key:
+            cached = _latest[name] = (key, load())
+        return cached[1]
+
+
+def sources_key(paths):
+    # Fingerprint of the source files (size and modification time, no need to read them)
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = pathlib.Path(path).stat()
+        digest.update(('%s:%i:%i;' % (pathlib.Path(path).name, stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def write_arrays(folder, arrays):
+    # Write the arrays in a temporary folder, then rename it (a reader sees all the files or none)
+    tmp_folder = folder.with_name('%s.%i.tmp' % (folder.name, os.getpid()))
+    tmp_folder.mkdir(parents=True, exist_ok=True)
+    for key, array in arrays.items():
+        np.save(tmp_folder.joinpath(key + '.npy'), np.ascontiguousarray(array))
+    try:
+        tmp_folder.rename(folder)
+    except OSError:
+        # another worker was faster: keep its files
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+
+def remove_stale(name, folder):
+    # Remove the arrays built from previous versions of the sources
+    for old in STORE_PATH.glob(name + '-*'):
+        if old != folder and not old.name.endswith('.tmp'):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def shared_arrays(name, sources, build):
+    """
+    Read-only arrays built from source files, shared by all the workers.
+
+    Parameters
+    ----------
+    name : string
+        Name of the set of arrays.
+
+    sources : list of paths
+        The files the arrays are built from (the arrays are rebuilt when they change).
+
+    build : function
+        Returns the arrays (dictionary of numpy arrays, no object dtype) from the sources.
+
+    Return
+    ------
+    arrays : dictionary of read-only memory-mapped arrays
+
+    """
+
+    try:
+        key = sources_key(sources)
+    except OSError:
+        # a source being replaced: keep the arrays already loaded
+        if name in _latest:
+            return _latest[name][1]
+        raise
+
+    def load():
+        folder = STORE_PATH.joinpath('%s-%s' % (name, key))
+        if not folder.exists():
+            arrays = build()
+            try:
+                write_arrays(folder, arrays)
+            except OSError:
+                # read-only file system: keep the arrays of this process in memory
+                return arrays
+            remove_stale(name, folder)
+        return {f.stem: np.load(f, mmap_mode='r') for f in sorted(folder.glob('*.npy'))}
+
+    # mapped again when the sources change (e.g. a new extract published with a model)
+    return latest(name, key, load)
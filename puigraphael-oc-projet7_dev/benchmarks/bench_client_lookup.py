@@ -0,0 +1,77 @@
+# data retreiving
+import sys
+import pathlib
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the app folder: python benchmarks/bench_client_lookup.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from apps import clients, dashboard
+
+#################### CLIENT LOOKUP BENCHMARK ####################
+# 1) build synthetic client tables of growing size
+# 2) time the former lookup (one boolean scan per displayed field) against the store
+# 3) time the whole client selection of the dashboard (update_figure) on the same tables
+# 4) print the mean latency per client selection
+
+COLUMNS = ['EXT_SOURCE_3', 'EXT_SOURCE_2', 'EXT_SOURCE_1', 'DAYS_BIRTH', 'AMT_CREDIT', 'PREDICTION']
+SIZES = [1000, 10000, 100000, 1000000]
+N_QUERIES = 50
+
+
+def synthetic_clients(n, seed=0):
+    # Shuffled ids stored as float32 like in the extracts
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.random((n, len(COLUMNS))).astype(np.float32), columns=COLUMNS)
+    df.insert(0, 'SK_ID_CURR', rng.permutation(np.arange(100000, 100000 + n)).astype(np.float32))
+    return df
+
+
+def scan_lookup(global_df, SK_ID_CURR):
+    # Former dashboard lookup: one full scan of the table per field (and twice for the prediction)
+    values = [global_df[global_df.SK_ID_CURR == SK_ID_CURR][col].item() for col in COLUMNS]
+    values.append(global_df[global_df.SK_ID_CURR == SK_ID_CURR].PREDICTION.item())
+    return values
+
+
+def timed(func, queries):
+    start = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def figure_lookup(store):
+    # update_figure of the dashboard (without the dash request context) reading the given store
+    update_figure = getattr(dashboard.update_figure, '__wrapped__', dashboard.update_figure)
+    search = clients.build_search_index(store['ids'])
+    def lookup(SK_ID_CURR):
+        get_clients = dashboard.get_clients
+        dashboard.get_clients = lambda: {'ids': store['ids'], 'columns': COLUMNS, 'values': store['values'],
+                                         'search': search}
+        try:
+            return update_figure(int(SK_ID_CURR))
+        finally:
+            dashboard.get_clients = get_clients
+    return lookup
+
+
+if __name__ == '__main__':
+    print('%10s %14s %14s %14s %14s' % ('clients', 'scan (ms)', 'store (ms)', 'figure (ms)', 'build (ms)'))
+    for n in SIZES:
+        df = synthetic_clients(n)
+        queries = df.SK_ID_CURR.sample(N_QUERIES, random_state=0).tolist()
+
+        start = time.perf_counter()
+        store = clients.build_client_store(df, COLUMNS)
+        build = time.perf_counter() - start
+
+        scan = timed(lambda q: scan_lookup(df, q), queries)
+        lookup = timed(lambda q: clients.lookup_client(store, q), queries)
+        select = figure_lookup(store)
+        select(queries[0])  # percentiles and explanations of the dashboard loaded once, before timing
+        figure = timed(select, queries)
+        print('%10i %14.3f %14.4f %14.3f %14.1f' % (n, scan * 1e3, lookup * 1e3, figure * 1e3, build * 1e3))
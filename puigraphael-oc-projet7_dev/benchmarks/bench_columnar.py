@@ -0,0 +1,75 @@
+# data retreiving
+import sys
+import pathlib
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the app folder: python benchmarks/bench_columnar.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from apps import columnar
+
+#################### COLUMNAR DATASETS BENCHMARK ####################
+# 1) write a synthetic global extract (same columns as the dashboard's one) as csv
+# 2) convert it to a columnar folder
+# 3) compare the load time and the peak memory of the csv and columnar readers
+
+COLUMNS = ['EXT_SOURCE_1', 'EXT_SOURCE_2', 'EXT_SOURCE_3', 'DAYS_BIRTH', 'AMT_CREDIT', 'PREDICTION', 'SK_ID_CURR']
+USED_COLUMNS = ['SK_ID_CURR', 'EXT_SOURCE_3', 'EXT_SOURCE_2', 'EXT_SOURCE_1', 'DAYS_BIRTH', 'AMT_CREDIT', 'PREDICTION']
+
+
+def synthetic_extract(n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'EXT_SOURCE_1': rng.random(n), 'EXT_SOURCE_2': rng.random(n), 'EXT_SOURCE_3': rng.random(n),
+                       'DAYS_BIRTH': -rng.uniform(7500, 25000, n), 'AMT_CREDIT': rng.uniform(45000, 4e6, n),
+                       'PREDICTION': rng.random(n), 'SK_ID_CURR': np.arange(100002, 100002 + n)})
+    # missing values as in the real extracts
+    df.loc[rng.random(n) < 0.5, 'EXT_SOURCE_1'] = np.nan
+    df.loc[rng.random(n) < 0.2, 'EXT_SOURCE_3'] = np.nan
+    return df[COLUMNS]
+
+
+def measure(func):
+    # Time and peak traced memory of a call
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the csv and columnar readers of the extracts.')
+    parser.add_argument('--rows', type=int, default=356255, help='rows of the synthetic extract')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        data_path = pathlib.Path(data_path)
+        synthetic_extract(args.rows).to_csv(columnar.csv_path(data_path, 'global_general_extract'), index=False)
+
+        _, convert, _ = measure(lambda: columnar.convert_csv(columnar.csv_path(data_path, 'global_general_extract'),
+                                                             columnar.columns_path(data_path, 'global_general_extract')))
+        csv_size = columnar.csv_path(data_path, 'global_general_extract').stat().st_size
+        npy_size = sum(f.stat().st_size for f in columnar.columns_path(data_path, 'global_general_extract').glob('*.npy'))
+        print('%i rows: csv %.1f MB, columnar %.1f MB (conversion %.2f s)' % (args.rows, csv_size / 2**20, npy_size / 2**20, convert))
+
+        readers = {
+            'csv, all columns (previous loader)': lambda: pd.read_csv(columnar.csv_path(data_path, 'global_general_extract'),
+                                                                      dtype=np.float32),
+            'csv, used columns': lambda: pd.read_csv(columnar.csv_path(data_path, 'global_general_extract'),
+                                                     usecols=USED_COLUMNS, dtype=np.float32),
+            'columnar, used columns': lambda: columnar.read_dataset(data_path, 'global_general_extract', USED_COLUMNS),
+            'columnar, memory-mapped': lambda: columnar.load_columns(columnar.columns_path(data_path, 'global_general_extract'),
+                                                                     USED_COLUMNS),
+        }
+        print('%-36s %10s %14s' % ('reader', 'time (ms)', 'peak (MB)'))
+        for label, reader in readers.items():
+            _, elapsed, peak = measure(reader)
+            print('%-36s %10.1f %14.1f' % (label, elapsed * 1e3, peak / 2**20))
@@ -0,0 +1,56 @@
+# data retreiving
+import sys
+import pathlib
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the app folder: python benchmarks/bench_explain.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from apps import artifact, explain
+
+#################### EXPLANATIONS BENCHMARK ####################
+# 1) replicate the 1000 clients of the app samples into tables of growing size
+# 2) time the contributions computed client by client (one explainer call per request)
+#    against the batched pass giving the probabilities and the drivers at once
+# 3) compare the size of all the contributions with the top-k arrays and time the lookup of a client
+
+SAMPLE_PATH = pathlib.Path(__file__).parent.joinpath('../../app_samples/global_extract_1000.csv').resolve()
+SIZES = [1000, 10000, 100000]
+N_QUERIES = 200
+
+
+if __name__ == '__main__':
+    predictor_artifact = artifact.load_artifact()
+    sample = pd.read_csv(SAMPLE_PATH, dtype=np.float32)
+
+    print('%10s %16s %16s %14s %14s' % ('clients', 'per client (s)', 'batched (s)', 'all (MB)', 'top-k (MB)'))
+    for n in SIZES:
+        df = sample.iloc[np.arange(n) % len(sample)].reset_index(drop=True)
+        buffer = artifact.features_buffer(predictor_artifact, df)
+
+        # per request explainer (measured on a few clients, extrapolated to the table)
+        start = time.perf_counter()
+        for i in range(N_QUERIES):
+            predictor_artifact['booster'].predict(buffer[i:i + 1], pred_contrib=True)
+        per_client = (time.perf_counter() - start) / N_QUERIES * n
+
+        start = time.perf_counter()
+        probabilities, features, values = explain.score_and_explain(predictor_artifact, df)
+        batched = time.perf_counter() - start
+
+        # same probabilities as the scoring path
+        assert np.allclose(probabilities, artifact.predict(predictor_artifact, df), rtol=0, atol=1e-12)
+        full_size = n * (len(predictor_artifact['feature_names']) + 1) * 8
+        print('%10i %16.3f %16.3f %14.2f %14.2f' % (n, per_client, batched, full_size / 1e6,
+                                                    (features.nbytes + values.nbytes) / 1e6))
+
+    # lookup of the drivers of a client in the precomputed arrays
+    explanations = explain.build_explanations(predictor_artifact, [SAMPLE_PATH])
+    queries = np.random.default_rng(0).choice(explanations['ids'], N_QUERIES)
+    start = time.perf_counter()
+    for client_id in queries:
+        explain.lookup_drivers(explanations, client_id)
+    print('drivers lookup: %.1f us per client' % ((time.perf_counter() - start) / N_QUERIES * 1e6))
@@ -0,0 +1,82 @@
+# data retreiving
+import sys
+import pathlib
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the app folder: python benchmarks/bench_percentiles.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from apps import percentiles
+
+#################### PERCENTILE RANKS BENCHMARK ####################
+# 1) build synthetic populations of growing size (features and predictions of both TARGET classes)
+# 2) time the percentiles of a client computed by scanning the training frame against the binary
+#    searches in the sorted arrays, and the percentiles of a whole uploaded table
+# 3) check that both give the same percentiles
+
+SIZES = [10000, 100000, 1000000]
+N_QUERIES = 200
+N_UPLOAD = 100000
+
+
+def synthetic_population(n, seed=0):
+    rng = np.random.default_rng(seed)
+    train_df = pd.DataFrame({'SK_ID_CURR': 100002 + np.arange(n), 'TARGET': (rng.random(n) < 0.08).astype(int),
+                             'EXT_SOURCE_3': rng.random(n).astype(np.float32),
+                             'EXT_SOURCE_2': rng.random(n).astype(np.float32),
+                             'EXT_SOURCE_1': np.where(rng.random(n) < 0.5, np.nan, rng.random(n)).astype(np.float32),
+                             'DAYS_BIRTH': -rng.integers(7000, 25000, n).astype(np.float32),
+                             'AMT_CREDIT': rng.uniform(45000, 4e6, n).round(0).astype(np.float32)})
+    global_df = pd.DataFrame({'SK_ID_CURR': train_df['SK_ID_CURR'], 'PREDICTION': rng.random(n).astype(np.float32)})
+    return train_df, global_df
+
+
+def scan_percentiles(train_df, global_df, client):
+    # Former way: comparisons with every client of each class
+    known = global_df.merge(train_df[['SK_ID_CURR', 'TARGET']], on='SK_ID_CURR')
+    ranks = dict()
+    for column, df in [(column, train_df) for column in percentiles.kde.FEATURES.values()] + [('PREDICTION', known)]:
+        ranks[column] = dict()
+        for target in percentiles.CLASSES:
+            values = df.loc[df['TARGET'] == int(target), column].dropna()
+            rank = 100 * ((values < client[column]).mean() + (values <= client[column]).mean()) / 2
+            rank = np.nan if np.isnan(client[column]) else rank
+            ranks[column][target] = 100 - rank if column in percentiles.REVERSED else rank
+    return ranks
+
+
+if __name__ == '__main__':
+    print('%10s %12s %14s %14s %16s' % ('clients', 'build (s)', 'scan (ms)', 'index (us)', 'upload (ms)'))
+    for n in SIZES:
+        train_df, global_df = synthetic_population(n)
+        clients = train_df.merge(global_df, on='SK_ID_CURR').sample(N_QUERIES, random_state=0).to_dict('records')
+
+        start = time.perf_counter()
+        index = percentiles.build_index(train_df, global_df)
+        build_time = time.perf_counter() - start
+
+        # scan measured on a few clients
+        start = time.perf_counter()
+        expected = [scan_percentiles(train_df, global_df, client) for client in clients[:5]]
+        scan_time = (time.perf_counter() - start) / 5
+
+        start = time.perf_counter()
+        ranks = [percentiles.client_percentiles(index, client) for client in clients]
+        index_time = (time.perf_counter() - start) / N_QUERIES
+
+        # same percentiles (missing values: nan with both ways)
+        for scanned, searched in zip(expected, ranks):
+            for column in scanned:
+                assert np.allclose(list(scanned[column].values()), list(searched[column].values()), equal_nan=True)
+
+        # predictions of an uploaded table ranked at once
+        upload = np.random.default_rng(1).random(N_UPLOAD)
+        start = time.perf_counter()
+        percentiles.percentile_rank(index['PREDICTION_0'], upload)
+        percentiles.percentile_rank(index['PREDICTION_1'], upload)
+        upload_time = time.perf_counter() - start
+
+        print('%10i %12.3f %14.2f %14.1f %16.2f' % (n, build_time, scan_time * 1e3, index_time * 1e6, upload_time * 1e3))
@@ -0,0 +1,61 @@
+# data retreiving
+import sys
+import json
+import pathlib
+import tempfile
+import time
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the app folder: python benchmarks/bench_results.py
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+from apps import jobs, results
+
+#################### RESULT TABLES BENCHMARK ####################
+# 1) build scored tables of growing size (columns of the predictor's results)
+# 2) time the former response (every row as a record, json encoded) against a page of the
+#    server-side table (first display, then a filtered and sorted page)
+# 3) print the times and the sizes of the responses
+
+SIZES = [1000, 10000, 100000, 500000]
+
+
+def synthetic_results(n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'SK_ID_CURR': 100002 + np.arange(n),
+                       'EXT_SOURCE_3': rng.random(n).round(3), 'EXT_SOURCE_2': rng.random(n).round(3),
+                       'EXT_SOURCE_1': np.where(rng.random(n) < 0.5, np.nan, rng.random(n).round(3)),
+                       'AGE (years)': rng.integers(20, 70, n).astype(float),
+                       'AMT_CREDIT (dollars)': rng.uniform(45000, 4e6, n).round(0),
+                       'PREDICTION': rng.random(n).round(3)})
+    features = np.array(['EXT_SOURCE_3', 'EXT_SOURCE_2', 'DAYS_BIRTH', 'AMT_ANNUITY', 'EXT_SOURCE_1'])
+    df['MAIN DRIVERS'] = [', '.join('%s (%+.3f)' % (f, v) for f, v in zip(rng.permutation(features), rng.normal(0, 0.3, 5)))
+                          for _ in range(n)]
+    return df
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    jobs.JOBS_PATH = pathlib.Path(tempfile.mkdtemp(prefix='bench_results_'))
+    print('%10s %14s %12s %14s %14s %12s' % ('rows', 'records (s)', 'size (MB)', 'columns (s)', 'page (ms)', 'size (kB)'))
+    for n in SIZES:
+        df = synthetic_results(n)
+
+        # former table: all the records in the response
+        payload, records_time = timed(lambda: json.dumps(df.to_dict('records')))
+
+        # server-side table: columnar folder written once, then pages
+        job_id = jobs.finished_job('upload.csv', df)
+        result, columns_time = timed(lambda: results.load_result(job_id))
+        page, page_time = timed(lambda: json.dumps(results.page_records(result, results.query_rows(
+            result, '{PREDICTION} >= 0.5 && {MAIN DRIVERS} contains "EXT_SOURCE_3 (+"',
+            [{'column_id': 'AMT_CREDIT (dollars)', 'direction': 'desc'}]), page_current=3)))
+        print('%10i %14.3f %12.2f %14.3f %14.2f %12.2f' % (n, records_time, len(payload) / 1e6, columns_time,
+                                                          page_time * 1e3, len(page) / 1e3))
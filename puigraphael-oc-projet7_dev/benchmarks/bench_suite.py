@@ -0,0 +1,385 @@
+# data retreiving
+import os
+import sys
+import json
+import time
+import base64
+import random
+import pathlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import urllib.error
+import urllib.request
+
+# data handling
+import pandas as pd
+import numpy as np
+
+# run from the app folder: python benchmarks/bench_suite.py
+APP_PATH = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(APP_PATH))
+
+#################### BENCHMARK AND LOAD TEST SUITE ####################
+# 1) extracts of growing size with the 100 columns of the app samples (the shipped files up to
+#    1000 clients, synthetic ones beyond: every column drawn from the values of the 1000 clients)
+# 2) in process timings: scoring job of an upload run in this process (decoding, parsing, scoring),
+#    the scoring path alone, update_figure of the dashboard, with the peak of traced memory
+# 3) app startup (import of index and first dashboard display) in a fresh process, cold and warm store
+# 4) load test: gunicorn serving index:server, several clients selecting dashboard clients and
+#    calling the scoring API for a fixed duration (latencies, throughput, peak memory of the workers)
+# 5) results written as json (commit, machine, metrics) and compared with a previous run if given
+
+SAMPLES_PATH = APP_PATH.joinpath('../app_samples').resolve()
+SIZES = [10, 100, 1000, 10000, 100000]
+REPEAT = 3
+N_QUERIES = 200
+
+# load test: gunicorn workers, concurrent clients and duration (seconds)
+WORKERS = 2
+CLIENTS = 8
+DURATION = 20
+PORT = 8765
+
+# outputs of the update_figure callback (see apps/dashboard.py), as sent by the browser
+FIGURE_OUTPUTS = [('markers', 'data'), ('ES3', 'children'), ('ES2', 'children'), ('ES1', 'children'),
+                  ('Age', 'children'), ('AMT', 'children'), ('pred', 'children'), ('drivers', 'children'),
+                  ('percentiles', 'children')]
+
+# requests of the load test, in turn (each client starts at a different one)
+SCENARIOS = ['dashboard', 'dashboard', 'score', 'batch']
+
+
+#################### EXTRACTS ####################
+
+def synthetic_extract(sample, n, seed=0):
+    # n clients with the columns of the sample, each column drawn from the sample's values (missing ones included)
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({col: rng.choice(sample[col].to_numpy(), n) for col in sample.columns})
+    df['SK_ID_CURR'] = 100002 + np.arange(n)
+    return df
+
+
+def extract_path(n, work_path, seed=0):
+    # csv file of n clients (shipped sample if it exists, synthetic extract written once otherwise)
+    shipped = SAMPLES_PATH.joinpath('global_extract_%i.csv' % n)
+    if shipped.exists():
+        return shipped
+    path = pathlib.Path(work_path).joinpath('global_extract_%i_%i.csv' % (n, seed))
+    if not path.exists():
+        sample = pd.read_csv(SAMPLES_PATH.joinpath('global_extract_1000.csv'))
+        synthetic_extract(sample, n, seed).to_csv(path, index=False)
+    return path
+
+
+def upload_contents(path):
+    # Content of a dcc.Upload of the file ('data:<type>;base64,<data>')
+    return 'data:text/csv;base64,' + base64.b64encode(pathlib.Path(path).read_bytes()).decode('ascii')
+
+
+#################### MEASURES ####################
+
+def measure(func, repeat=REPEAT):
+    # Median and best time of a few calls, peak of traced memory of one more call (in MB)
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'median_s': float(np.median(times)), 'min_s': float(np.min(times)), 'peak_mb': peak / 2**20}
+
+
+def latencies(values, elapsed=None):
+    # Summary of request latencies (in ms) and throughput (requests per second)
+    values = np.asarray(values) * 1e3
+    summary = {'count': int(len(values))}
+    if len(values):
+        summary.update({'mean_ms': float(values.mean()), 'p50_ms': float(np.percentile(values, 50)),
+                        'p95_ms': float(np.percentile(values, 95)), 'p99_ms': float(np.percentile(values, 99))})
+    if elapsed is not None:
+        summary['throughput_rps'] = len(values) / elapsed
+    return summary
+
+
+def in_process(sizes, work_path):
+    # Timings of the predictor and the dashboard in this process
+    from apps import artifact, ingest, jobs, predictor, dashboard
+
+    results = {'upload': dict(), 'scoring': dict(), 'update_figure': dict()}
+
+    for n in sizes:
+        path = extract_path(n, work_path)
+        contents = upload_contents(path)
+
+        def upload():
+            # the job of an upload without the process pool (no cache: every upload is parsed and scored)
+            job_id = jobs.new_job(path.name, 'queued')
+            ingest.spool_upload(contents, jobs.job_path(job_id).joinpath(jobs.UPLOAD_FILE))
+            jobs.run_job(str(jobs.job_path(job_id)), path.name, predictor.score_chunk, predictor.used_columns())
+        results['upload'][str(n)] = measure(upload)
+
+        df = pd.concat(list(ingest.parse_chunks(path, path.name, predictor.used_columns())), ignore_index=True)
+        results['scoring'][str(n)] = {'predict': measure(lambda: artifact.predict(predictor.get_artifact(), df)),
+                                      'score_chunk': measure(lambda: predictor.score_chunk(df))}
+        print('%8i clients: upload %.3f s, score_chunk %.3f s'
+              % (n, results['upload'][str(n)]['median_s'], results['scoring'][str(n)]['score_chunk']['median_s']))
+
+    # client selections of the dashboard (callback without the dash request context)
+    update_figure = getattr(dashboard.update_figure, '__wrapped__', dashboard.update_figure)
+    ids = np.random.default_rng(0).choice(np.asarray(dashboard.get_clients()['ids']), N_QUERIES)
+    times = list()
+    for client_id in ids:
+        start = time.perf_counter()
+        update_figure(int(client_id))
+        times.append(time.perf_counter() - start)
+    results['update_figure'] = latencies(times)
+    print('update_figure: %.3f ms (p95 %.3f ms)' % (results['update_figure']['mean_ms'], results['update_figure']['p95_ms']))
+    return results
+
+
+#################### STARTUP ####################
+
+STARTUP_CODE = '''
+import json, time, resource
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+from apps import dashboard
+dashboard.layout()
+done = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'first_dashboard_s': done - imported,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def startup(work_path):
+    # Import of the app and first dashboard display in fresh processes (new store built, then reused)
+    env = dict(os.environ, STORE_PATH=tempfile.mkdtemp(prefix='store_', dir=work_path))
+    results = dict()
+    for state in ['cold', 'warm']:
+        output = subprocess.run([sys.executable, '-c', STARTUP_CODE], cwd=APP_PATH, env=env, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+        results[state] = json.loads(output.strip().splitlines()[-1])
+        print('startup (%s store): import %.2f s, first dashboard %.2f s'
+              % (state, results[state]['import_s'], results[state]['first_dashboard_s']))
+    return results
+
+
+#################### LOAD TEST ####################
+
+def process_peak_mb(pid):
+    # Peak resident memory of a process and its children (Linux /proc, None elsewhere)
+    def peak(p):
+        try:
+            for line in open('/proc/%i/status' % p):
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+        return None
+
+    processes = [pid]
+    for stat in pathlib.Path('/proc').glob('[0-9]*/stat'):
+        try:
+            if int(stat.read_text().rsplit(')', 1)[1].split()[1]) == pid:
+                processes.append(int(stat.parent.name))
+        except (OSError, ValueError, IndexError):
+            continue
+    peaks = [peak(p) for p in processes]
+    if peaks[0] is None:
+        return None
+    return {'master_mb': peaks[0], 'workers_mb': [p for p in peaks[1:] if p is not None],
+            'total_mb': sum(p for p in peaks if p is not None)}
+
+
+def post(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+        return response.status
+
+
+def scenario_requests(base_url):
+    # Bodies of the requests of the load test (one function per scenario)
+    sample = pd.read_csv(SAMPLES_PATH.joinpath('global_extract_100.csv'))
+    record = {k: (None if pd.isna(v) else float(v)) for k, v in sample.iloc[0].items()}
+    batch = SAMPLES_PATH.joinpath('global_extract_100.csv').read_bytes()
+    client_ids = pd.read_csv(APP_PATH.joinpath('datasets/global_general_extract.csv'),
+                             usecols=['SK_ID_CURR'])['SK_ID_CURR'].astype(np.int64).tolist()
+
+    def dashboard_request(rng):
+        payload = {'output': '..' + '...'.join('%s.%s' % output for output in FIGURE_OUTPUTS) + '..',
+                   'outputs': [{'id': i, 'property': p} for i, p in FIGURE_OUTPUTS],
+                   'inputs': [{'id': 'SK_ID_CURR', 'property': 'value', 'value': rng.choice(client_ids)}],
+                   'changedPropIds': ['SK_ID_CURR.value'], 'state': []}
+        return post(base_url + '/_dash-update-component', json.dumps(payload).encode('utf-8'), 'application/json')
+
+    return {'dashboard': dashboard_request,
+            'score': lambda rng: post(base_url + '/api/v1/score', json.dumps(record).encode('utf-8'), 'application/json'),
+            'batch': lambda rng: post(base_url + '/api/v1/score/batch', batch, 'text/csv')}
+
+
+def start_server(port, workers, work_path):
+    # gunicorn serving the app (as in the Procfile), ready once the home page answers
+    log = open(pathlib.Path(work_path).joinpath('gunicorn.log'), 'w')
+    env = dict(os.environ, STORE_PATH=str(pathlib.Path(work_path).joinpath('store')))
+    process = subprocess.Popen(['gunicorn', 'index:server', '--workers', str(workers), '--bind', '127.0.0.1:%i' % port],
+                               cwd=APP_PATH, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn stopped (see %s)' % log.name)
+        try:
+            urllib.request.urlopen('http://127.0.0.1:%i/' % port, timeout=1).read()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not answer within 60 s (see %s)' % log.name)
+
+
+def load_test(work_path, workers=WORKERS, clients=CLIENTS, duration=DURATION, port=PORT):
+    """
+    Several clients sending requests to the app served by gunicorn for a fixed duration.
+
+    Parameters
+    ----------
+    work_path : path
+        The folder of the shared arrays and of the gunicorn log.
+
+    workers, clients : integers
+        The number of gunicorn workers and of concurrent clients (threads).
+
+    duration : float
+        The duration of the test (seconds), after one warm-up request of each scenario.
+
+    port : integer
+        The local port of the server.
+
+    Return
+    ------
+    results : dictionary
+        The latencies and throughput of every scenario and overall, the errors and the peak
+        memory of the server processes.
+
+    """
+
+    process = start_server(port, workers, work_path)
+    try:
+        requests = scenario_requests('http://127.0.0.1:%i' % port)
+        # warm-up: the lazy loads of every worker are not measured (one round per worker)
+        for _ in range(workers):
+            for name in SCENARIOS:
+                requests[name](random.Random(0))
+
+        records, errors, lock = list(), list(), threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def client(k):
+            rng = random.Random(k)
+            turn = k
+            while time.perf_counter() < deadline:
+                name = SCENARIOS[turn % len(SCENARIOS)]
+                turn += 1
+                start = time.perf_counter()
+                try:
+                    requests[name](rng)
+                    with lock:
+                        records.append((name, time.perf_counter() - start))
+                except (urllib.error.URLError, OSError) as e:
+                    with lock:
+                        errors.append('%s: %s' % (name, e))
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(k,)) for k in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        memory = process_peak_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    results = {'workers': workers, 'clients': clients, 'duration_s': elapsed, 'errors': len(errors),
+               'overall': latencies([latency for _, latency in records], elapsed),
+               'scenarios': {name: latencies([latency for n, latency in records if n == name], elapsed)
+                             for name in sorted(set(SCENARIOS))},
+               'server_memory': memory}
+    print('load test: %i requests in %.1f s (%.1f req/s, p95 %.1f ms), %i errors'
+          % (results['overall']['count'], elapsed, results['overall']['throughput_rps'],
+             results['overall'].get('p95_ms', np.nan), len(errors)))
+    return results
+
+
+#################### RESULTS ####################
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=APP_PATH, check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    # Numeric metrics as {'section.size.metric': value}
+    metrics = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix + key] = value
+    return metrics
+
+
+def compare(results, baseline):
+    # Ratio of every metric to the one of a previous run
+    old, new = flatten(baseline['results']), flatten(results['results'])
+    print('%-60s %12s %12s %8s' % ('metric (vs %s)' % (baseline.get('commit') or '?')[:10], 'before', 'after', 'ratio'))
+    for key in sorted(set(old) & set(new)):
+        if old[key]:
+            print('%-60s %12.4g %12.4g %8.2f' % (key, old[key], new[key], new[key] / old[key]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks and load test of the dashboard and predictor apps.')
+    parser.add_argument('--sizes', type=int, nargs='*', default=SIZES, help='clients of the uploaded extracts')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='gunicorn workers of the load test')
+    parser.add_argument('--clients', type=int, default=CLIENTS, help='concurrent clients of the load test')
+    parser.add_argument('--duration', type=float, default=DURATION, help='duration of the load test (seconds)')
+    parser.add_argument('--port', type=int, default=PORT, help='local port of the load test server')
+    parser.add_argument('--skip-load', action='store_true', help='no load test (in process timings and startup only)')
+    parser.add_argument('--work', default=None, help='folder of the synthetic extracts (temporary folder by default)')
+    parser.add_argument('--output', default='bench_results.json', help='json file of the results')
+    parser.add_argument('--baseline', default=None, help='json results of a previous run to compare with')
+    args = parser.parse_args()
+
+    work_path = pathlib.Path(args.work or tempfile.mkdtemp(prefix='bench_suite_'))
+    work_path.mkdir(parents=True, exist_ok=True)
+
+    results = {'startup': startup(work_path)}
+    results.update(in_process(args.sizes, work_path))
+    if not args.skip_load:
+        results['load_test'] = load_test(work_path, args.workers, args.clients, args.duration, args.port)
+
+    report = {'commit': git_commit(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                          'cpus': os.cpu_count()},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to %s' % args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
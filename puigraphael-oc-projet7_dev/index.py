@@ -1,16 +1,27 @@
 #import dash
+import logging
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
-# connect to application pages
-from apps import home, dashboard, predictor
+# connect to application pages (and to the scoring API routes), metrics and profiling of the server
+from apps import home, dashboard, predictor, api, metrics, profiling
 
 # connect to main app.py file
 from app import app
 from app import server
 
 
+# messages of the app modules (failed jobs, model swaps) written to stderr, as the logs of gunicorn
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s')
+
+# timing of the requests and /metrics route (Prometheus text format, all the workers)
+metrics.init_app(app)
+
+# flame graphs of the chosen requests (only if PROFILING=1, see apps/profiling.py)
+profiling.init_app(app)
+
+
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),
     html.Div(id='page-content', children=[])
@@ -21,7 +32,7 @@ app.layout = html.Div([
               [Input(component_id='url', component_property='pathname')])
 def display_page(pathname):
     if pathname == '/dashboard/':
-        return dashboard.layout
+        return dashboard.layout()
     if pathname == '/predictor/':
         return predictor.layout
     else:
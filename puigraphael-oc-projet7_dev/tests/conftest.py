@@ -0,0 +1,20 @@
+# data retreiving
+import os
+import sys
+import pathlib
+import tempfile
+
+# run from the app folder: python -m pytest tests
+APP_PATH = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(APP_PATH))
+
+# the folders written by the app (jobs, shared arrays, metrics, profiles, published models) are temporary
+# folders of the test session, set before the modules of the app are imported
+TMP_PATH = pathlib.Path(tempfile.mkdtemp(prefix='payback_tests_'))
+for variable in ('JOBS_PATH', 'STORE_PATH', 'METRICS_PATH', 'PROFILES_PATH', 'REGISTRY_PATH'):
+    os.environ[variable] = str(TMP_PATH.joinpath(variable.lower()))
+# no watcher thread of the registry: the tests check the pointer themselves
+os.environ['REGISTRY_POLL_INTERVAL'] = '0'
+
+# samples of the app (same columns as the uploads)
+SAMPLES_PATH = APP_PATH.joinpath('../app_samples').resolve()
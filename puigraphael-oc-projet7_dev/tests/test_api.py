@@ -0,0 +1,115 @@
+# data handling
+import numpy as np
+import pandas as pd
+
+import pytest
+
+from conftest import SAMPLES_PATH
+
+#################### SCORING API (validation of the bodies, errors returned as json) ####################
+
+
+@pytest.fixture(scope='module')
+def client():
+    import index
+    return index.server.test_client()
+
+
+@pytest.fixture(scope='module')
+def sample():
+    return pd.read_csv(SAMPLES_PATH.joinpath('global_extract_10.csv'))
+
+
+def records(df):
+    return [{k: (None if pd.isna(v) else float(v)) for k, v in row.items()} for row in df.to_dict('records')]
+
+
+def test_score_one_client(client, sample):
+    from apps import artifact, predictor
+    record = records(sample)[0]
+    response = client.post('/api/v1/score', json=record)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['SK_ID_CURR'] == int(record['SK_ID_CURR'])
+    assert body['model_version'] == predictor.get_artifact()['version']
+    assert np.isclose(body['probability'], artifact.predict(predictor.get_artifact(), sample.iloc[:1])[0])
+    assert body['risk_band'] in ('low', 'medium', 'high')
+    # TARGET is in the samples but is not a feature
+    assert body['unknown_fields'] == ['TARGET']
+
+
+def test_batch_formats_give_the_same_scores(client, sample):
+    as_json = client.post('/api/v1/score/batch', json=records(sample)).get_json()
+    as_csv = client.post('/api/v1/score/batch', data=sample.to_csv(index=False), content_type='text/csv').get_json()
+    assert as_json['SK_ID_CURR'] == as_csv['SK_ID_CURR'] == sample['SK_ID_CURR'].tolist()
+    assert np.allclose(as_json['probability'], as_csv['probability'])
+    assert as_json['unknown_fields'] == as_csv['unknown_fields'] == ['TARGET']
+
+
+def test_null_values_are_missing_values(client, sample):
+    record = records(sample)[0]
+    record['EXT_SOURCE_1'] = None
+    assert client.post('/api/v1/score', json=record).status_code == 200
+
+
+def test_missing_features_are_refused(client, sample):
+    record = records(sample)[0]
+    del record['EXT_SOURCE_3'], record['AMT_CREDIT']
+    response = client.post('/api/v1/score', json=record)
+    assert response.status_code == 400
+    body = response.get_json()
+    assert sorted(body['missing_features']) == ['AMT_CREDIT', 'EXT_SOURCE_3']
+    assert 'EXT_SOURCE_3' in body['error']
+
+    # the client of the batch is given
+    response = client.post('/api/v1/score/batch', json=records(sample.iloc[:2])[:1] + [record])
+    assert response.status_code == 400
+    assert '(client 1)' in response.get_json()['error']
+
+    # columns of a csv body
+    response = client.post('/api/v1/score/batch', data=sample.drop(columns=['DAYS_BIRTH']).to_csv(index=False),
+                           content_type='text/csv')
+    assert response.status_code == 400
+    assert response.get_json()['missing_features'] == ['DAYS_BIRTH']
+
+
+def test_unknown_fields_are_reported(client, sample):
+    record = records(sample)[0]
+    record['EXT_SOURCE3'] = 0.5
+    body = client.post('/api/v1/score', json=record).get_json()
+    assert body['unknown_fields'] == ['EXT_SOURCE3', 'TARGET']
+
+    df = sample.assign(COMMENT='x')
+    body = client.post('/api/v1/score/batch', data=df.to_csv(index=False), content_type='text/csv').get_json()
+    assert body['unknown_fields'] == ['COMMENT', 'TARGET']
+
+
+@pytest.mark.parametrize('kwargs, status', [
+    ({'data': '{not json', 'content_type': 'application/json'}, 400),
+    ({'json': [1, 2]}, 400),
+    ({'data': 'a,b\n1,2', 'content_type': 'text/plain'}, 415),
+])
+def test_invalid_bodies(client, kwargs, status):
+    response = client.post('/api/v1/score/batch', **kwargs)
+    assert response.status_code == status
+    assert 'error' in response.get_json()
+
+
+def test_values_must_be_numbers(client, sample):
+    record = records(sample)[0]
+    record['AMT_CREDIT'] = 'a lot'
+    response = client.post('/api/v1/score', json=record)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Feature values must be numbers or null.'
+
+
+def test_single_client_route_refuses_batches(client, sample):
+    response = client.post('/api/v1/score', json=records(sample.iloc[:2]))
+    assert response.status_code == 400
+
+
+def test_batch_size_is_bounded(client, sample, monkeypatch):
+    from apps import api
+    monkeypatch.setattr(api, 'MAX_BATCH_ROWS', 5)
+    response = client.post('/api/v1/score/batch', json=records(sample))
+    assert response.status_code == 413
@@ -0,0 +1,99 @@
+# data retreiving
+import pickle
+
+# data handling
+import numpy as np
+import pandas as pd
+
+# modeling
+import lightgbm
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import MinMaxScaler
+
+import pytest
+
+from apps import artifact
+from conftest import SAMPLES_PATH
+
+#################### FUSED ARTIFACT (imputer and scaler folded into the trees) ####################
+
+
+def synthetic_model(seed=0, n=2000, n_features=6):
+    # Model trained as in notebook 4: median imputation, min-max scaling, then LightGBM
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, n_features)) * rng.uniform(1, 1000, n_features) + rng.uniform(-500, 500, n_features)
+    y = (X[:, 0] / X[:, 0].std() + X[:, 1] / X[:, 1].std() + rng.normal(size=n) > 0).astype(int)
+    X[rng.random(X.shape) < 0.2] = np.nan
+
+    imputer = SimpleImputer(strategy='median').fit(X)
+    scaler = MinMaxScaler().fit(imputer.transform(X))
+    model = lightgbm.LGBMClassifier(n_estimators=30, num_leaves=15, verbose=-1)
+    model.fit(scaler.transform(imputer.transform(X)), y)
+    return X, model, imputer, scaler
+
+
+def pipeline_predict(model, imputer, scaler, X):
+    return model.predict_proba(scaler.transform(imputer.transform(X)))[:, 1]
+
+
+def test_folded_model_scores_raw_values_as_the_pipeline():
+    X, model, imputer, scaler = synthetic_model()
+    feature_names = ['f%i' % i for i in range(X.shape[1])]
+    fused = artifact.build_artifact(model, imputer, scaler, feature_names)
+    booster = lightgbm.Booster(model_str=fused['model_string'])
+
+    # nan values included: they follow the branch of the median
+    expected = pipeline_predict(model, imputer, scaler, X)
+    assert np.allclose(booster.predict(X), expected, atol=1e-6)
+
+    # same predictions from a dataframe of raw features (float32 buffer, as the app)
+    fused['booster'] = booster
+    df = pd.DataFrame(X, columns=feature_names)
+    assert np.allclose(artifact.predict(fused, df), pipeline_predict(model, imputer, scaler, X.astype(np.float32)),
+                       atol=1e-5)
+
+
+def test_save_and_load_keep_the_model(tmp_path):
+    X, model, imputer, scaler = synthetic_model(seed=1)
+    fused = artifact.build_artifact(model, imputer, scaler, ['f%i' % i for i in range(X.shape[1])])
+    artifact.save_artifact(fused, tmp_path.joinpath('predictor.npz'))
+    loaded = artifact.load_artifact(tmp_path.joinpath('predictor.npz'))
+
+    assert loaded['version'] == fused['version']
+    assert loaded['feature_names'] == fused['feature_names']
+    assert np.allclose(loaded['booster'].predict(X), pipeline_predict(model, imputer, scaler, X), atol=1e-6)
+
+
+def test_version_depends_on_the_scoring_only():
+    X, model, imputer, scaler = synthetic_model(seed=2)
+    feature_names = ['f%i' % i for i in range(X.shape[1])]
+    fused = artifact.build_artifact(model, imputer, scaler, feature_names)
+    model_string = fused['model_string']
+
+    # another LightGBM version, other formatting of the floats: same model, same version
+    other_dump = model_string.replace('version=v4', 'version=v3')
+    other_dump = '\n'.join('leaf_value=' + ' '.join('%.17e' % float(v) for v in line[11:].split())
+                           if line.startswith('leaf_value=') else line for line in other_dump.split('\n'))
+    assert artifact.model_version(other_dump, feature_names) == fused['version']
+
+    # other features or other leaf values: another version
+    assert artifact.model_version(model_string, feature_names[::-1]) != fused['version']
+    changed = model_string.replace('leaf_value=', 'leaf_value=1 ', 1)
+    assert artifact.model_version(changed, feature_names) != fused['version']
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_shipped_artifact_matches_the_pickles():
+    # the artifact of the datasets folder scores the samples of the app as the three pickles
+    rebuilt = artifact.build_from_pickles(sample_path=SAMPLES_PATH.joinpath('global_extract_10.csv'))
+    shipped = artifact.load_artifact()
+    assert shipped['version'] == rebuilt['version']
+
+    df = pd.read_csv(SAMPLES_PATH.joinpath('global_extract_100.csv'))
+    pickles = [pickle.load(open(artifact.DATA_PATH.joinpath(name), 'rb'))
+               for name in ('payback_predictor.pickle.dat', 'imputer.pickle.dat', 'scaler.pickle.dat')]
+    model, imputer, scaler = pickles
+    # (pickled by an older scikit-learn: the imputation and the scaling applied from their fitted values)
+    X = df[shipped['feature_names']].to_numpy(dtype=np.float64)
+    X = np.where(np.isnan(X), imputer.statistics_, X) * scaler.scale_ + scaler.min_
+    assert np.allclose(artifact.predict(shipped, df), model.booster_.predict(X), atol=1e-6)
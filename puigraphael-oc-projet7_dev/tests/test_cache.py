@@ -0,0 +1,88 @@
+# data retreiving
+import base64
+
+# data handling
+import pandas as pd
+
+import pytest
+
+from apps import cache
+
+#################### RESULT CACHE (hits and misses across models and extracts) ####################
+
+
+def upload(text):
+    return 'data:text/csv;base64,' + base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_PATH', None)
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_key_changes_with_the_content_the_format_the_model_and_the_extracts():
+    key = cache.upload_key(upload('a,b\n1,2\n'), 'clients.csv', 'aaaaaaaaaaaa', 'extracts1')
+    assert key == cache.upload_key(upload('a,b\n1,2\n'), 'other_name.CSV', 'aaaaaaaaaaaa', 'extracts1')
+    assert key != cache.upload_key(upload('a,b\n1,3\n'), 'clients.csv', 'aaaaaaaaaaaa', 'extracts1')
+    assert key != cache.upload_key(upload('a,b\n1,2\n'), 'clients.xls', 'aaaaaaaaaaaa', 'extracts1')
+    assert key != cache.upload_key(upload('a,b\n1,2\n'), 'clients.csv', 'bbbbbbbbbbbb', 'extracts1')
+    assert key != cache.upload_key(upload('a,b\n1,2\n'), 'clients.csv', 'aaaaaaaaaaaa', 'extracts2')
+
+
+def test_hit_for_the_same_model_only():
+    df = pd.DataFrame({'SK_ID_CURR': [1, 2], 'PREDICTION': [0.1, 0.9]})
+    contents = upload('SK_ID_CURR\n1\n2\n')
+    cache.put(cache.upload_key(contents, 'a.csv', 'aaaaaaaaaaaa'), df)
+
+    assert cache.get(cache.upload_key(contents, 'a.csv', 'aaaaaaaaaaaa')) is df
+    assert cache.get(cache.upload_key(contents, 'a.csv', 'bbbbbbbbbbbb')) is None
+
+
+def test_memory_tier_evicts_the_least_recently_used(monkeypatch):
+    df = pd.DataFrame({'PREDICTION': [0.5] * 100})
+    monkeypatch.setattr(cache, 'MEMORY_MAX_BYTES', 2 * cache.table_size(df))
+    cache.put('a', df)
+    cache.put('b', df)
+    cache.get('a')
+    cache.put('c', df)
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+def test_disk_tier_is_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path))
+    df = pd.DataFrame({'PREDICTION': [0.25, 0.75]})
+    cache.put('a', df)
+    # another worker: empty memory, same folder
+    cache.clear()
+    pd.testing.assert_frame_equal(cache.get('a'), df)
+
+
+def test_predictor_scores_again_for_a_new_model_or_new_extracts(monkeypatch):
+    from apps import predictor, jobs, percentiles
+    submitted = list()
+    monkeypatch.setattr(jobs, 'submit', lambda *args, **kwargs: submitted.append(kwargs['model_version']) or 'job')
+    contents = upload('SK_ID_CURR\n1\n')
+    live = predictor.get_artifact()
+
+    # cached results of the live model and of the current extracts: nothing is scored
+    df = pd.DataFrame({'SK_ID_CURR': [1], 'PREDICTION': [0.5]})
+    cache.put(cache.upload_key(contents, 'a.csv', live['version'], percentiles.index_key(predictor.DATA_PATH)), df)
+    job_id = predictor.start_job(contents, 'a.csv')
+    assert jobs.read_status(job_id)['state'] == 'done'
+    assert submitted == []
+
+    # another live model: the upload is scored again
+    monkeypatch.setattr(predictor, 'get_artifact', lambda: dict(live, version='bbbbbbbbbbbb'))
+    assert predictor.start_job(contents, 'a.csv') == 'job'
+    assert submitted == ['bbbbbbbbbbbb']
+
+    # same model, other extracts (other percentiles): scored again too
+    monkeypatch.setattr(predictor, 'get_artifact', lambda: live)
+    monkeypatch.setattr(percentiles, 'index_key', lambda data_path=None: 'other extracts')
+    assert predictor.start_job(contents, 'a.csv') == 'job'
+    assert submitted == ['bbbbbbbbbbbb', live['version']]
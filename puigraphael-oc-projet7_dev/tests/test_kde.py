@@ -0,0 +1,34 @@
+# data retreiving
+import os
+import time
+import shutil
+
+from apps import kde
+
+#################### KDE CURVES (saved curves reused while the content of the extracts is the same) ####################
+
+
+def test_curves_follow_the_content_of_the_extracts(tmp_path, monkeypatch):
+    for name in (kde.TRAIN_FILE, kde.GLOBAL_FILE):
+        shutil.copyfile(kde.DATA_PATH.joinpath(name), tmp_path.joinpath(name))
+    built = kde.load_or_build(tmp_path)
+    hashed = list()
+    source_hash = kde.source_hash
+    monkeypatch.setattr(kde, 'source_hash', lambda paths: hashed.append(paths) or source_hash(paths))
+    monkeypatch.setattr(kde, 'build_from_sources', lambda data_path: {'rebuilt': True})
+
+    # same files: nothing is read
+    assert kde.load_or_build(tmp_path)['source_hash'] == built['source_hash']
+    assert hashed == []
+
+    # touched files (e.g. a checkout): read once, the curves are kept
+    later = time.time() + 10
+    os.utime(tmp_path.joinpath(kde.TRAIN_FILE), (later, later))
+    assert kde.load_or_build(tmp_path)['source_hash'] == built['source_hash']
+    assert kde.load_or_build(tmp_path)['source_hash'] == built['source_hash']
+    assert len(hashed) == 1
+
+    # new content: rebuilt
+    with open(tmp_path.joinpath(kde.GLOBAL_FILE), 'a') as f:
+        f.write('\n')
+    assert kde.load_or_build(tmp_path) == {'rebuilt': True}
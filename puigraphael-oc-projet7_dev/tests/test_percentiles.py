@@ -0,0 +1,63 @@
+# data handling
+import numpy as np
+import pandas as pd
+
+from scipy import stats
+
+from apps import percentiles, kde
+
+#################### PERCENTILE RANKS (binary searches in the sorted populations) ####################
+
+
+def test_percentile_rank_matches_scipy():
+    rng = np.random.default_rng(0)
+    # ties included (integers)
+    population = rng.integers(0, 50, 1000).astype(np.float32)
+    values = np.concatenate([rng.integers(-5, 55, 200), [0, 49, -1, 50]]).astype(np.float32)
+    ranks = percentiles.percentile_rank(percentiles.sorted_values(population), values)
+    expected = [stats.percentileofscore(population, value, kind='mean') for value in values]
+    assert np.allclose(ranks, expected)
+
+
+def test_missing_values_and_empty_populations():
+    sorted_array = percentiles.sorted_values([3, np.nan, 1, 2])
+    assert sorted_array.tolist() == [1, 2, 3]
+    assert np.isnan(percentiles.percentile_rank(sorted_array, np.nan))
+    assert percentiles.percentile_rank(sorted_array, 2) == 50
+    assert np.isnan(percentiles.percentile_rank(percentiles.sorted_values([]), 1.0))
+    assert np.isnan(percentiles.percentile_rank(percentiles.sorted_values([]), [1.0, 2.0])).all()
+
+
+def population():
+    # 4 clients of each TARGET class, the predictions of the train clients and of 2 clients without TARGET
+    train_df = pd.DataFrame({'SK_ID_CURR': np.arange(8), 'TARGET': [0, 0, 0, 0, 1, 1, 1, 1]})
+    for column in kde.FEATURES.values():
+        train_df[column] = np.arange(8, dtype=np.float32)
+    train_df['EXT_SOURCE_1'] = [np.nan, 1, 2, 3, 4, 5, 6, np.nan]
+    global_df = pd.DataFrame({'SK_ID_CURR': np.arange(10),
+                              'PREDICTION': np.linspace(0.05, 0.95, 10).astype(np.float32)})
+    return train_df, global_df
+
+
+def test_index_per_class():
+    index = percentiles.build_index(*population())
+    assert index['EXT_SOURCE_2_0'].tolist() == [0, 1, 2, 3]
+    assert index['EXT_SOURCE_2_1'].tolist() == [4, 5, 6, 7]
+    # missing values are not part of the populations
+    assert index['EXT_SOURCE_1_0'].tolist() == [1, 2, 3]
+    assert len(index['PREDICTION_all']) == 10
+    # predictions per class: the clients with a TARGET only
+    assert len(index['PREDICTION_0']) == len(index['PREDICTION_1']) == 4
+
+
+def test_client_percentiles():
+    index = percentiles.build_index(*population())
+    client = {column: 3.5 for column in kde.FEATURES.values()}
+    client.update(EXT_SOURCE_1=None, PREDICTION=0.5)
+    ranks = percentiles.client_percentiles(index, client)
+
+    assert ranks['EXT_SOURCE_2'] == {'0': 100.0, '1': 0.0}
+    # ranked as an age (DAYS_BIRTH are negative): the order is reversed
+    assert ranks['DAYS_BIRTH'] == {'0': 0.0, '1': 100.0}
+    assert np.isnan(ranks['EXT_SOURCE_1']['0']) and np.isnan(ranks['EXT_SOURCE_1']['1'])
+    assert set(ranks) == set(kde.FEATURES.values()) | {'PREDICTION'}
@@ -0,0 +1,100 @@
+# data retreiving
+import shutil
+
+import pytest
+
+from apps import artifact, registry
+
+#################### ARTIFACT REGISTRY (publish, activate, roll back) ####################
+
+NEW_VERSION = 'abcdefabcdef'
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    # datasets folder with the shipped artifact and its extract, empty registry, nothing loaded
+    monkeypatch.setattr(registry, 'REGISTRY_PATH', tmp_path.joinpath('registry'))
+    monkeypatch.setattr(registry, '_live', None)
+    monkeypatch.setattr(registry, '_versions', dict())
+    monkeypatch.setattr(registry, '_default_path', tmp_path.joinpath('datasets', registry.ARTIFACT_FILE))
+    path = tmp_path.joinpath('datasets')
+    path.mkdir()
+    shutil.copyfile(artifact.ARTIFACT_PATH, path.joinpath(registry.ARTIFACT_FILE))
+    path.joinpath(registry.DATA_FILES['extract']).write_text('old extract\n')
+    return path
+
+
+@pytest.fixture
+def new_model(tmp_path):
+    # another model (the shipped one under another version) and the extract it scored
+    new_artifact = artifact.load_artifact()
+    new_artifact['version'] = NEW_VERSION
+    artifact.save_artifact(new_artifact, tmp_path.joinpath('new.npz'))
+    tmp_path.joinpath('new_extract.csv').write_text('new extract\n')
+    return tmp_path.joinpath('new.npz'), {'extract': tmp_path.joinpath('new_extract.csv')}
+
+
+def extract(data_path):
+    return data_path.joinpath(registry.DATA_FILES['extract']).read_text()
+
+
+def test_default_artifact_until_something_is_published(data_path):
+    assert registry.read_current() is None
+    assert registry.get_artifact()['version'] == artifact.load_artifact()['version']
+
+
+def test_publish_makes_the_version_live_with_its_extract(data_path, new_model):
+    old_version = registry.get_artifact()['version']
+    version = registry.publish(new_model[0], data_files=new_model[1], data_path=data_path)
+
+    assert version == NEW_VERSION
+    assert registry.read_current() == NEW_VERSION
+    assert extract(data_path) == 'new extract\n'
+    # the former artifact is kept (roll back), the oldest first
+    assert registry.list_versions() == [old_version, NEW_VERSION]
+
+    # the process swaps to it when it checks the pointer
+    assert registry.live_version() == old_version
+    registry.check_current()
+    assert registry.live_version() == NEW_VERSION
+    # a job submitted before keeps its version
+    assert registry.get_version(old_version)['version'] == old_version
+
+
+def test_roll_back_installs_the_extract_of_the_version(data_path, new_model):
+    old_version = registry.get_artifact()['version']
+    registry.publish(new_model[0], data_files=new_model[1], data_path=data_path)
+
+    registry.activate_version(old_version, data_path)
+    assert registry.read_current() == old_version
+    assert extract(data_path) == 'old extract\n'
+
+    registry.activate_version(NEW_VERSION, data_path)
+    assert registry.read_current() == NEW_VERSION
+    assert extract(data_path) == 'new extract\n'
+
+
+def test_inactive_publication(data_path, new_model):
+    old_version = registry.get_artifact()['version']
+    registry.publish(new_model[0], activate=False, data_files=new_model[1], data_path=data_path)
+    assert registry.read_current() is None
+    assert extract(data_path) == 'old extract\n'
+    assert registry.list_versions() == [old_version, NEW_VERSION]
+
+
+def test_version_without_its_extract_is_refused(data_path, new_model):
+    with pytest.raises(ValueError, match='without its extract'):
+        registry.publish(new_model[0], data_path=data_path)
+    assert registry.read_current() is None
+    assert extract(data_path) == 'old extract\n'
+
+    # published again with its extract
+    registry.publish(new_model[0], data_files=new_model[1], data_path=data_path)
+    assert registry.read_current() == NEW_VERSION
+
+
+def test_unknown_or_invalid_versions(data_path):
+    with pytest.raises(ValueError):
+        registry.activate_version('0123456789ab', data_path)
+    with pytest.raises(ValueError):
+        registry.version_path('../datasets')
@@ -0,0 +1,115 @@
+# data handling
+import numpy as np
+import pandas as pd
+
+import pytest
+
+from apps import jobs, results
+
+#################### RESULT TABLES (filtered, sorted and cut on the server) ####################
+
+
+@pytest.fixture
+def result():
+    # result of a finished job, as written by the scoring jobs
+    df = pd.DataFrame({'SK_ID_CURR': [101, 102, 103, 104, 105, 106],
+                       'EXT_SOURCE_1': [0.2, np.nan, 0.7, 0.4, np.nan, 0.9],
+                       'PREDICTION': [0.10, 0.80, 0.50, 0.95, 0.30, 0.50],
+                       'MAIN DRIVERS': ['AMT_CREDIT +0.20', 'EXT_SOURCE_3 -0.41', '', 'DAYS_BIRTH +0.10',
+                                        'EXT_SOURCE_3 +0.05', 'AMT_CREDIT -0.30']})
+    return results.load_result(jobs.finished_job('clients.csv', df))
+
+
+def ids(result, rows):
+    return result['values']['SK_ID_CURR'][rows].tolist()
+
+
+@pytest.mark.parametrize('filter_query, expected', [
+    ('', [101, 102, 103, 104, 105, 106]),
+    ('{PREDICTION} >= 0.5', [102, 103, 104, 106]),
+    ('{PREDICTION} ge 0.5 && {PREDICTION} < 0.9', [102, 103, 106]),
+    ('{PREDICTION} = 0.5', [103, 106]),
+    ('{PREDICTION} != 0.5', [101, 102, 104, 105]),
+    ('{EXT_SOURCE_1} > 0.5', [103, 106]),
+    ('{MAIN DRIVERS} contains EXT_SOURCE_3', [102, 105]),
+    ('{MAIN DRIVERS} contains "AMT_CREDIT -"', [106]),
+    ('{PREDICTION} > high', []),
+    # comparisons not understood are ignored
+    ('{UNKNOWN} > 1 && {PREDICTION} < 0.2', [101]),
+])
+def test_filter(result, filter_query, expected):
+    assert ids(result, results.query_rows(result, filter_query)) == expected
+
+
+def test_sort_keeps_missing_values_last(result):
+    ascending = results.query_rows(result, sort_by=[{'column_id': 'EXT_SOURCE_1', 'direction': 'asc'}])
+    descending = results.query_rows(result, sort_by=[{'column_id': 'EXT_SOURCE_1', 'direction': 'desc'}])
+    assert ids(result, ascending) == [101, 104, 103, 106, 102, 105]
+    assert ids(result, descending) == [106, 103, 104, 101, 102, 105]
+
+
+def test_sort_is_stable_and_combines_with_the_filter(result):
+    rows = results.query_rows(result, '{PREDICTION} >= 0.3',
+                              sort_by=[{'column_id': 'PREDICTION', 'direction': 'asc'}])
+    # ties in the order of the upload
+    assert ids(result, rows) == [105, 103, 106, 102, 104]
+
+    rows = results.query_rows(result, sort_by=[{'column_id': 'PREDICTION', 'direction': 'desc'},
+                                               {'column_id': 'EXT_SOURCE_1', 'direction': 'desc'}])
+    assert ids(result, rows) == [104, 102, 106, 103, 105, 101]
+
+
+def test_riskiest_rows(result):
+    assert ids(result, results.query_rows(result, top_n=2)) == [104, 102]
+    # among the filtered rows, then sorted as asked
+    rows = results.query_rows(result, '{EXT_SOURCE_1} > 0', [{'column_id': 'SK_ID_CURR', 'direction': 'asc'}], top_n=2)
+    assert ids(result, rows) == [103, 104]
+
+
+def test_pages(result):
+    rows = results.query_rows(result, sort_by=[{'column_id': 'PREDICTION', 'direction': 'desc'}])
+    assert results.page_count(rows, page_size=4) == 2
+    page = results.page_records(result, rows, page_current=1, page_size=4)
+    assert [record['SK_ID_CURR'] for record in page] == [105, 101]
+    # json types: missing values as None, texts decoded
+    assert page[0]['EXT_SOURCE_1'] is None
+    assert page[0]['MAIN DRIVERS'] == 'EXT_SOURCE_3 +0.05'
+    assert results.page_count(rows[:0]) == 1
+
+
+def test_finished_jobs_are_not_polled(result):
+    from apps import predictor
+    done = jobs.finished_job('done.csv', pd.DataFrame({'PREDICTION': [0.5]}))
+    running = jobs.new_job('running.csv', 'running')
+    intervals = {job_id: predictor.job_block(job_id).children[1] for job_id in (done, running)}
+    assert intervals[done].disabled and not intervals[running].disabled
+
+    # the poll of a running job updates that job only, and stops once it is finished
+    children, finished = predictor.update_job.__wrapped__(1, intervals[running].id)
+    assert not finished
+    jobs.write_status(jobs.job_path(running), dict(jobs.read_status(running), state='done', progress=1.0))
+    jobs.result_path(running).write_text('PREDICTION\n0.5\n')
+    children, finished = predictor.update_job.__wrapped__(2, intervals[running].id)
+    assert finished
+
+
+def test_failed_job_removed_meanwhile():
+    import shutil
+    from concurrent.futures import Future
+    failed = Future()
+    failed.set_exception(RuntimeError('killed'))
+
+    # the failure is recorded in the status of the job
+    job_id = jobs.new_job('failed.csv', 'running')
+    jobs.job_finished(jobs.job_path(job_id), failed)
+    assert jobs.read_status(job_id)['state'] == 'error'
+
+    # a job removed before the pool is done leaves no status behind
+    job_id = jobs.new_job('removed.csv', 'running')
+    shutil.rmtree(jobs.job_path(job_id))
+    jobs.job_finished(jobs.job_path(job_id), failed)
+    assert jobs.read_status(job_id) is None
+
+    done = Future()
+    done.set_result(None)
+    jobs.job_finished(jobs.job_path(job_id), done, on_done=lambda job_id: pytest.fail('removed job'))